@@ -5,6 +5,7 @@ import aws_cdk as cdk
 
 from simple_trader_cdk.simple_trader_cdk_stack import SimpleTraderCdkStack
 from simple_trader_cdk.analytics_stack import AnalyticsStack
+from simple_trader_cdk.golden_ami_stack import GoldenAmiStack
 from simple_trader_cdk.iam_stack import IamStack
 
 app = cdk.App()
@@ -14,10 +15,17 @@ IamStack(app, "SimpleTraderIamStack",
     env=cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')),
 )
 
+# Deploy the image pipeline baking Python into the trading AMI
+golden_ami_stack = GoldenAmiStack(app, "SimpleTraderGoldenAmiStack",
+    env=cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')),
+)
+
 # Deploy main application stack
-SimpleTraderCdkStack(app, "SimpleTraderCdkStack",
+simple_trader_stack = SimpleTraderCdkStack(app, "SimpleTraderCdkStack",
     env=cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')),
 )
+# The trading instance reads its AMI from the parameter created by the golden AMI stack
+simple_trader_stack.add_dependency(golden_ami_stack)
 
 # Deploy main application stack
 AnalyticsStack(app, "AnalyticsStack",
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Cache warmup for the analytics website, run right after gunicorn starts.
+
+The manifest lists endpoints and the parameters to call them with. Every endpoint is called once
+per combination of its recent months, combos and grid values, with bounded concurrency. Latency
+percentiles per endpoint go into a JSON report in the working bucket, next to the previous report
+so slower backtests after a new repo_analytics.zip show up as regressions.
+
+    {"path": "/backtest/...", "recent_months": 3,            from_date/to_date of the last 3 whole months
+     "combos": [{"stop_loss": 5, "take_profit": 3}],         crossed with every grid value
+     "grid": {"trade_direction": ["ALL", "LONG"]},
+     "params": {"entry_time": "09:17"}}                       sent with every call
+
+    warmup.py --manifest FILE --base-url URL [--bucket B --release ID]
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+from host_common import percentile, s3_exists, s3_read_json, s3_write_json
+
+REPORT_PREFIX = "warmup-reports"
+LATEST_REPORT_KEY = f"{REPORT_PREFIX}/latest.json"
+
+DEFAULT_CONCURRENCY = 3
+DEFAULT_TIMEOUT_SECONDS = 180
+DEFAULT_REGRESSION_THRESHOLD = 0.25
+READY_TIMEOUT_SECONDS = 120
+# nginx answers requests from 127.0.0.1 with this header from gunicorn and stores the fresh response,
+# so the latencies are those of the backtests rather than of cache hits while the cache still fills
+CACHE_BYPASS_HEADER = "X-Cache-Bypass"
+
+
+def recent_months(count, today=None):
+    """(first day, last day) of the last count whole months, newest first"""
+    months = []
+    first_of_month = (today or date.today()).replace(day=1)
+    for _ in range(count):
+        last_day = first_of_month - timedelta(days=1)
+        first_of_month = last_day.replace(day=1)
+        months.append((first_of_month.isoformat(), last_day.isoformat()))
+    return months
+
+
+def expand(endpoint, today=None):
+    """All query parameter sets for one manifest endpoint"""
+    date_ranges = [{"from_date": start, "to_date": end}
+                   for start, end in recent_months(endpoint.get("recent_months", 0), today)] or [{}]
+    combos = endpoint.get("combos") or [{}]
+    grid = endpoint.get("grid", {})
+    grid_values = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+    calls = []
+    for date_range, combo, grid_value in itertools.product(date_ranges, combos, grid_values):
+        calls.append({**endpoint.get("params", {}), **date_range, **combo, **grid_value})
+    return calls
+
+
+def call(base_url, path, params, timeout):
+    url = f"{base_url}{path}?{urllib.parse.urlencode(params)}"
+    request = urllib.request.Request(url, headers={CACHE_BYPASS_HEADER: "1"})
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError) as e:
+        print(f"{url} failed: {e}")
+        status = 0
+    return status, round((time.monotonic() - started) * 1000, 1)
+
+
+def wait_until_ready(base_url, timeout=READY_TIMEOUT_SECONDS):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # Any HTTP answer means the workers are up, even a 404 on /
+        if call(base_url, "/", {}, timeout=5)[0]:
+            return True
+        time.sleep(1)
+    return False
+
+
+def summarize(latencies, statuses):
+    ok = [latency for latency, status in zip(latencies, statuses) if 200 <= status < 300]
+    return {
+        "calls": len(statuses),
+        "errors": len(statuses) - len(ok),
+        "p50_ms": percentile(ok, 50),
+        "p95_ms": percentile(ok, 95),
+        "p99_ms": percentile(ok, 99),
+        "max_ms": max(ok) if ok else None,
+    }
+
+
+def regressions(report, previous, threshold):
+    """Endpoints whose p95 grew by more than threshold compared to the previous report"""
+    slower = []
+    for name, summary in report["endpoints"].items():
+        before = previous.get("endpoints", {}).get(name, {}).get("p95_ms")
+        after = summary["p95_ms"]
+        if before and after and after > before * (1 + threshold):
+            slower.append({"endpoint": name, "p95_ms": after, "previous_p95_ms": before,
+                           "previous_release": previous.get("release")})
+    return slower
+
+
+def run(manifest, base_url, release=None, today=None):
+    concurrency = manifest.get("concurrency", DEFAULT_CONCURRENCY)
+    timeout = manifest.get("timeout_seconds", DEFAULT_TIMEOUT_SECONDS)
+    calls = [(endpoint, params) for endpoint in manifest["endpoints"] for params in expand(endpoint, today)]
+    print(f"Warming {len(calls)} calls over {len(manifest['endpoints'])} endpoints, {concurrency} at a time")
+
+    started_at = datetime.now(timezone.utc)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda item: call(base_url, item[0]["path"], item[1], timeout), calls))
+
+    endpoints = {}
+    for endpoint in manifest["endpoints"]:
+        endpoint_results = [result for (called, _), result in zip(calls, results) if called is endpoint]
+        endpoints[endpoint["name"]] = summarize([latency for _, latency in endpoint_results],
+                                                [status for status, _ in endpoint_results])
+        print(f"{endpoint['name']}: {endpoints[endpoint['name']]}")
+
+    return {
+        "release": release,
+        "started_at": started_at.isoformat(),
+        "duration_seconds": round((datetime.now(timezone.utc) - started_at).total_seconds(), 1),
+        "endpoints": endpoints,
+    }
+
+
+def publish(report, bucket, threshold):
+    previous = s3_read_json(bucket, LATEST_REPORT_KEY) if s3_exists(bucket, LATEST_REPORT_KEY) else {}
+    report["regressions"] = regressions(report, previous, threshold)
+    for regression in report["regressions"]:
+        print(f"REGRESSION {regression['endpoint']}: p95 {regression['p95_ms']} ms, "
+              f"was {regression['previous_p95_ms']} ms on {regression['previous_release']}")
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    key = f"{REPORT_PREFIX}/{stamp}-{report['release'] or 'unknown'}.json"
+    s3_write_json(report, bucket, key)
+    s3_write_json(report, bucket, LATEST_REPORT_KEY)
+    print(f"Report written to s3://{bucket}/{key}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", required=True)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--bucket", help="Write the report to the bucket, print it otherwise")
+    parser.add_argument("--release", help="Release the report belongs to, e.g. the repo_analytics.zip ETag")
+    args = parser.parse_args(argv)
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+
+    if not wait_until_ready(args.base_url):
+        print(f"{args.base_url} did not answer within {READY_TIMEOUT_SECONDS}s")
+        return 1
+
+    report = run(manifest, args.base_url, args.release)
+    if args.bucket:
+        publish(report, args.bucket, manifest.get("regression_threshold", DEFAULT_REGRESSION_THRESHOLD))
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Helpers shared by the host scripts of the trading and analytics instances.
+
+Deployed next to the scripts of both hosts, see create_host_scripts_deployment in the stacks, so
+every script imports it as a plain module. S3 access goes through the AWS CLI, the interpreters
+on the hosts do not ship boto3.
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+@contextmanager
+def phase(name):
+    """Prints the step markers the start Lambda turns into phase timings, see ssm_runner.py"""
+    print(f"::step-start::{name}::{time.time():.3f}", flush=True)
+    try:
+        yield
+    finally:
+        print(f"::step-end::{name}::{time.time():.3f}", flush=True)
+
+
+def s3_get(bucket, key, dest):
+    subprocess.run(["aws", "s3", "cp", "--only-show-errors", f"s3://{bucket}/{key}", dest], check=True)
+
+
+def s3_put(src, bucket, key):
+    subprocess.run(["aws", "s3", "cp", "--only-show-errors", src, f"s3://{bucket}/{key}"], check=True)
+
+
+def s3_copy(bucket, src_key, dest_key):
+    subprocess.run(["aws", "s3", "cp", "--only-show-errors", f"s3://{bucket}/{src_key}", f"s3://{bucket}/{dest_key}"],
+                   check=True)
+
+
+def s3_exists(bucket, key):
+    result = subprocess.run(["aws", "s3api", "head-object", "--bucket", bucket, "--key", key],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+
+def s3_read_json(bucket, key):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        local_path = os.path.join(tmp_dir, os.path.basename(key))
+        s3_get(bucket, key, local_path)
+        with open(local_path) as f:
+            return json.load(f)
+
+
+def s3_write_json(document, bucket, key):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        local_path = os.path.join(tmp_dir, os.path.basename(key))
+        with open(local_path, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+        s3_put(local_path, bucket, key)
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def percentile(values, pct):
+    """Nearest rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def switch_link(link_path, target):
+    """Atomically points link_path at target, readers see either the old or the new target"""
+    # Older hosts have a plain directory here, it used to be rebuilt from scratch anyway
+    if os.path.isdir(link_path) and not os.path.islink(link_path):
+        shutil.rmtree(link_path)
+
+    temp_link = link_path + ".next"
+    if os.path.lexists(temp_link):
+        os.remove(temp_link)
+    os.symlink(target, temp_link)
+    os.replace(temp_link, link_path)
@@ -0,0 +1,93 @@
+#!/bin/bash
+# Builds CPython twice on a Graviton (Neoverse N1) host: the stock --enable-optimizations build the
+# instances used to compile themselves, and a PGO+LTO build tuned with -mcpu=neoverse-n1. The tuned
+# build is only published to the working bucket when python_gate.py finds it faster than the stock
+# one on pyperformance and on strategy_bench.py.
+#
+#     build_python.sh BUCKET_NAME [PYTHON_VERSION]    (run by the PythonBuild CodeBuild project)
+#
+#     s3://BUCKET/python-builds/python-<version>-neoverse-n1-<build id>.tar.gz    /usr/local tree
+#     s3://BUCKET/python-builds/python-<version>-neoverse-n1-<build id>.json      gate report
+#     s3://BUCKET/python-builds/latest.sha256                                     what instances install
+#
+# The build id covers the version, the flags and this script, a build that was already published
+# is not built again unless FORCE=1.
+set -euo pipefail
+
+BUCKET_NAME=$1
+PYTHON_VERSION=${2:-3.9.6}
+SCRIPT_DIR=$(cd "$(dirname "$0")" && pwd)
+WORK_DIR=${WORK_DIR:-/tmp/python-build}
+PREFIX=s3://$BUCKET_NAME/python-builds
+
+TUNED_CFLAGS="-mcpu=neoverse-n1"
+TUNED_CONFIGURE="--enable-optimizations --with-lto"
+# Pure-Python benchmarks, closest to the per-tick strategy code. Pinned so reports stay comparable.
+PYPERFORMANCE_VERSION=1.0.6
+BENCHMARKS=chaos,deltablue,float,go,json_loads,nbody,pickle_pure_python,raytrace,richards,unpack_sequence
+
+BUILD_ID=$( (echo "$PYTHON_VERSION $TUNED_CFLAGS $TUNED_CONFIGURE $PYPERFORMANCE_VERSION $BENCHMARKS"; cat "$0") \
+    | sha256sum | cut -c1-12)
+NAME=python-$PYTHON_VERSION-neoverse-n1-$BUILD_ID
+
+if [ "${FORCE:-0}" != "1" ] && aws s3 ls "$PREFIX/$NAME.tar.gz" >/dev/null; then
+    echo "$NAME is already published"
+    exit 0
+fi
+
+# Same toolchain as the instances, gcc10 because the system gcc 7 has no -mcpu=neoverse-n1
+yum install -y gcc10 gcc10-c++ make tar gzip wget libffi-devel bzip2-devel zlib-devel xz-devel sqlite-devel
+yum remove -y openssl-devel
+yum install -y openssl11-devel
+
+rm -rf "$WORK_DIR"
+mkdir -p "$WORK_DIR"
+cd "$WORK_DIR"
+wget -q "https://www.python.org/ftp/python/$PYTHON_VERSION/Python-$PYTHON_VERSION.tgz"
+
+unpack() {
+    mkdir "src-$1"
+    tar xzf "Python-$PYTHON_VERSION.tgz" -C "src-$1" --strip-components=1
+}
+
+# Installed under DESTDIR, the interpreters find their standard library relative to the binary
+unpack stock
+(cd src-stock && ./configure --prefix=/usr/local --enable-optimizations \
+    && make -j"$(nproc)" && make altinstall DESTDIR="$WORK_DIR/stock")
+
+unpack tuned
+(cd src-tuned && ./configure --prefix=/usr/local $TUNED_CONFIGURE \
+    CC=gcc10-gcc CXX=gcc10-g++ AR=gcc10-gcc-ar RANLIB=gcc10-gcc-ranlib CFLAGS="$TUNED_CFLAGS" \
+    && make -j"$(nproc)" && make altinstall DESTDIR="$WORK_DIR/tuned")
+
+STOCK_PYTHON=$WORK_DIR/stock/usr/local/bin/python3.9
+TUNED_PYTHON=$WORK_DIR/tuned/usr/local/bin/python3.9
+"$TUNED_PYTHON" -c "import ssl, sqlite3, bz2, lzma, ctypes"
+
+"$STOCK_PYTHON" -m venv bench-venv
+bench-venv/bin/pip install --quiet "pyperformance==$PYPERFORMANCE_VERSION"
+for build in stock tuned; do
+    python=$WORK_DIR/$build/usr/local/bin/python3.9
+    bench-venv/bin/pyperformance run --fast --python="$python" --benchmarks="$BENCHMARKS" --output="pyperformance-$build.json"
+    "$python" "$SCRIPT_DIR/strategy_bench.py" --output "strategy-$build.json"
+done
+
+gate_passed=0
+bench-venv/bin/python "$SCRIPT_DIR/python_gate.py" \
+    --stock pyperformance-stock.json --tuned pyperformance-tuned.json \
+    --stock-strategy strategy-stock.json --tuned-strategy strategy-tuned.json \
+    --build "$NAME" --cflags "$TUNED_CFLAGS $TUNED_CONFIGURE" --output "$NAME.json" || gate_passed=$?
+
+if [ "$gate_passed" != "0" ]; then
+    aws s3 cp "$NAME.json" "$PREFIX/rejected/$NAME.json" --only-show-errors
+    echo "$NAME did not pass the benchmark gate, nothing published"
+    exit 1
+fi
+
+tar -C "$WORK_DIR/tuned" --owner=0 --group=0 --numeric-owner -czf "$NAME.tar.gz" usr
+sha256sum "$NAME.tar.gz" > latest.sha256
+aws s3 cp "$NAME.tar.gz" "$PREFIX/$NAME.tar.gz" --only-show-errors
+aws s3 cp "$NAME.json" "$PREFIX/$NAME.json" --only-show-errors
+# Last, so instances never see a pointer to a tarball that is not there yet
+aws s3 cp latest.sha256 "$PREFIX/latest.sha256" --only-show-errors
+echo "Published $NAME"
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Benchmark gate for the tuned interpreter of build_python.sh.
+
+Compares the pyperformance results (pyperf JSON) and strategy_bench.py results of the stock and
+the tuned build. The tuned build passes when it is faster on the geometric mean of the
+pyperformance benchmarks, no single benchmark got slower by more than the allowed regression and
+the strategy benchmark is at least as fast. Writes the comparison as a report and exits 1 when
+the build does not pass:
+
+    python_gate.py --stock pyperformance-stock.json --tuned pyperformance-tuned.json \\
+        --stock-strategy strategy-stock.json --tuned-strategy strategy-tuned.json --output report.json
+"""
+import argparse
+import json
+import math
+import statistics
+import sys
+
+MIN_GEOMEAN_SPEEDUP = 1.02
+MAX_REGRESSION = 0.05  # Largest slowdown of any single benchmark
+MIN_STRATEGY_SPEEDUP = 1.0
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def benchmark_medians(suite):
+    """{benchmark: median seconds} of a pyperf suite, calibration runs carry no values"""
+    common_name = suite.get("metadata", {}).get("name")
+    medians = {}
+    for benchmark in suite["benchmarks"]:
+        name = benchmark.get("metadata", {}).get("name", common_name)
+        values = [value for run in benchmark["runs"] for value in run.get("values", [])]
+        if values:
+            medians[name] = statistics.median(values)
+    return medians
+
+
+def geometric_mean(values):
+    return math.exp(sum(math.log(value) for value in values) / len(values))
+
+
+def evaluate(stock_suite, tuned_suite, stock_strategy, tuned_strategy, min_speedup=MIN_GEOMEAN_SPEEDUP,
+             max_regression=MAX_REGRESSION, min_strategy_speedup=MIN_STRATEGY_SPEEDUP):
+    stock, tuned = benchmark_medians(stock_suite), benchmark_medians(tuned_suite)
+    names = sorted(set(stock) & set(tuned))
+    if not names:
+        raise ValueError("The two pyperformance results have no benchmark in common")
+
+    benchmarks = {name: {"stock_seconds": stock[name], "tuned_seconds": tuned[name],
+                         "speedup": round(stock[name] / tuned[name], 4)} for name in names}
+    geomean = round(geometric_mean([benchmarks[name]["speedup"] for name in names]), 4)
+    strategy_speedup = round(stock_strategy["ns_per_tick"] / tuned_strategy["ns_per_tick"], 4)
+
+    failures = []
+    if geomean < min_speedup:
+        failures.append(f"geometric mean speedup {geomean} below {min_speedup}")
+    for name in names:
+        if benchmarks[name]["speedup"] < 1 - max_regression:
+            failures.append(f"{name} speedup {benchmarks[name]['speedup']} is a regression beyond {max_regression:.0%}")
+    if strategy_speedup < min_strategy_speedup:
+        failures.append(f"strategy speedup {strategy_speedup} below {min_strategy_speedup}")
+    if stock_strategy.get("checksum") != tuned_strategy.get("checksum"):
+        failures.append("strategy results differ between the builds")
+
+    return {
+        "passed": not failures,
+        "failures": failures,
+        "geomean_speedup": geomean,
+        "strategy": {"stock_ns_per_tick": stock_strategy["ns_per_tick"],
+                     "tuned_ns_per_tick": tuned_strategy["ns_per_tick"], "speedup": strategy_speedup},
+        "benchmarks": benchmarks,
+        "missing": sorted(set(stock) ^ set(tuned)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stock", required=True, help="pyperformance result of the stock build")
+    parser.add_argument("--tuned", required=True, help="pyperformance result of the tuned build")
+    parser.add_argument("--stock-strategy", required=True)
+    parser.add_argument("--tuned-strategy", required=True)
+    parser.add_argument("--build", help="Name of the tuned build, recorded in the report")
+    parser.add_argument("--cflags", help="Flags of the tuned build, recorded in the report")
+    parser.add_argument("--min-speedup", type=float, default=MIN_GEOMEAN_SPEEDUP)
+    parser.add_argument("--max-regression", type=float, default=MAX_REGRESSION)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args(argv)
+
+    report = evaluate(load_json(args.stock), load_json(args.tuned), load_json(args.stock_strategy),
+                      load_json(args.tuned_strategy), args.min_speedup, args.max_regression)
+    report = {"build": args.build, "flags": args.cflags, **report}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, result in report["benchmarks"].items():
+        print(f"{name:20s} {result['speedup']:.3f}x")
+    print(f"{'geometric mean':20s} {report['geomean_speedup']:.3f}x")
+    print(f"{'strategy':20s} {report['strategy']['speedup']:.3f}x")
+    for failure in report["failures"]:
+        print(f"FAILED: {failure}")
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Per-tick strategy microbenchmark, the interpreter-bound part of the trading loop.
+
+Replays a fixed, seeded stream of ticks over a few hundred symbols through the kind of code the
+strategy runs on every tick: dict lookups per symbol, EMAs, VWAP, a rolling high/low window and a
+breakout check with position bookkeeping. Standard library only, so it runs unchanged on every
+interpreter build_python.sh compares:
+
+    python3.9 strategy_bench.py [--ticks 200000] [--repeat 7] [--output strategy.json]
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from collections import deque
+
+SYMBOLS = 250
+WINDOW = 20
+
+
+def make_ticks(count, symbols=SYMBOLS, seed=17):
+    rng = random.Random(seed)
+    names = [f"SYM{index:03d}" for index in range(symbols)]
+    prices = {name: rng.uniform(100, 3000) for name in names}
+    ticks = []
+    for _ in range(count):
+        name = names[rng.randrange(symbols)]
+        prices[name] *= 1 + rng.gauss(0, 0.0008)
+        ticks.append((name, round(prices[name], 2), rng.randrange(1, 500)))
+    return ticks
+
+
+class SymbolState:
+    __slots__ = ("ema_fast", "ema_slow", "volume", "turnover", "window", "position", "entry", "pnl")
+
+    def __init__(self, price):
+        self.ema_fast = self.ema_slow = price
+        self.volume = 0
+        self.turnover = 0.0
+        self.window = deque(maxlen=WINDOW)
+        self.position = 0
+        self.entry = 0.0
+        self.pnl = 0.0
+
+
+def on_tick(states, symbol, price, quantity):
+    state = states.get(symbol)
+    if state is None:
+        state = states[symbol] = SymbolState(price)
+    state.ema_fast += (price - state.ema_fast) * 0.2
+    state.ema_slow += (price - state.ema_slow) * 0.05
+    state.volume += quantity
+    state.turnover += price * quantity
+    vwap = state.turnover / state.volume
+    window = state.window
+    if len(window) == WINDOW:
+        high, low = max(window), min(window)
+        if state.position == 0 and price > high and state.ema_fast > state.ema_slow and price > vwap:
+            state.position, state.entry = 1, price
+        elif state.position == 0 and price < low and state.ema_fast < state.ema_slow and price < vwap:
+            state.position, state.entry = -1, price
+        elif state.position and abs(price - state.entry) / state.entry > 0.004:
+            state.pnl += (price - state.entry) * state.position
+            state.position = 0
+    window.append(price)
+
+
+def run_once(ticks):
+    states = {}
+    started = time.perf_counter()
+    for symbol, price, quantity in ticks:
+        on_tick(states, symbol, price, quantity)
+    elapsed = time.perf_counter() - started
+    # Returned so the work cannot be optimised away and runs can be checked for the same result
+    return elapsed, round(sum(state.pnl for state in states.values()), 4)
+
+
+def bench(ticks=200000, repeat=7):
+    stream = make_ticks(ticks)
+    run_once(stream[:ticks // 10])  # Warm up
+    runs = [run_once(stream) for _ in range(repeat)]
+    checksums = {checksum for _, checksum in runs}
+    if len(checksums) != 1:
+        raise RuntimeError(f"Runs disagree: {checksums}")
+    timings = [elapsed for elapsed, _ in runs]
+    return {
+        "python": platform.python_version(),
+        "ticks": ticks,
+        "ns_per_tick": round(statistics.median(timings) / ticks * 1e9, 1),
+        "runs_seconds": [round(elapsed, 4) for elapsed in timings],
+        "checksum": checksums.pop(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ticks", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    result = bench(args.ticks, args.repeat)
+    print(f"{sys.executable}: {result['ns_per_tick']} ns per tick")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""Manifest driven artifact sync for the SimpleTrader trading host.
+
+The working bucket holds content addressed artifacts and a small manifest describing which
+version of each artifact makes up a release:
+
+    manifest.json                      current manifest, the only object read on a normal morning
+    manifests/<manifest_id>.json       every manifest ever published, used for pinning and rollback
+    artifacts/<sha256>/<name>          artifact blobs, never overwritten
+
+On the instance, blobs are cached under <projects>/.artifacts and every sync builds a fresh
+release directory that the app directory symlink is atomically switched to.
+
+    artifact_sync.py publish  --bucket B [--source-dir DIR]    (run wherever the artifacts are built)
+    artifact_sync.py pin      --bucket B MANIFEST_ID
+    artifact_sync.py rollback --bucket B
+    artifact_sync.py sync     --bucket B --app-dir DIR [--manifest MANIFEST_ID]    (run on the instance)
+    artifact_sync.py profile  --bucket B --app-dir DIR --python PYTHON
+
+sync compiles every module of the release to bytecode with the interpreter running it, the same
+python3.9 the virtualenv is built from, so the first start of setup.py does not pay for it.
+profile records an `-X importtime` breakdown of the modules setup.py imports, once per repo.zip
+version and interpreter, next to the artifact as artifacts/<sha256>/importtime-<py39>.json.
+"""
+import argparse
+import ast
+import compileall
+import hashlib
+import json
+import os
+import py_compile
+import re
+import shutil
+import subprocess
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from host_common import (phase, s3_copy, s3_exists, s3_get, s3_put, s3_read_json, s3_write_json, sha256_file,
+                         switch_link)
+
+MANIFEST_KEY = "manifest.json"
+MANIFEST_PREFIX = "manifests"
+ARTIFACT_PREFIX = "artifacts"
+
+# Artifact name -> location inside the release. Zip files are unpacked at that location.
+DEFAULT_ARTIFACTS = {
+    "repo.zip": ".",
+    "config.py": "src/config.py",
+    "requirements.txt": "requirements.txt",
+    "keys.json": "keys.json",
+}
+
+RELEASES_TO_KEEP = 5
+MAX_PARALLEL_DOWNLOADS = 8
+
+ENTRY_POINT = "src/setup/setup.py"
+IMPORT_PROFILE_TOP = 25
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def manifest_id(artifacts):
+    canonical = json.dumps({name: entry["sha256"] for name, entry in artifacts.items()}, sort_keys=True)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+def artifact_key(name, sha256):
+    return f"{ARTIFACT_PREFIX}/{sha256}/{name}"
+
+
+# Publishing side
+def publish(bucket, source_dir, artifacts=None):
+    artifacts = artifacts or DEFAULT_ARTIFACTS
+    entries = {}
+    for name, path in artifacts.items():
+        local_path = os.path.join(source_dir, name)
+        sha256 = sha256_file(local_path)
+        key = artifact_key(name, sha256)
+        if s3_exists(bucket, key):
+            print(f"{name} unchanged ({sha256[:12]})")
+        else:
+            print(f"Uploading {name} ({sha256[:12]})")
+            s3_put(local_path, bucket, key)
+        entries[name] = {"sha256": sha256, "key": key, "path": path}
+
+    current = current_manifest(bucket)
+    manifest = {
+        "id": manifest_id(entries),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "previous": current["id"] if current else None,
+        "artifacts": entries,
+    }
+    if current and current["id"] == manifest["id"]:
+        print(f"Manifest {manifest['id']} is already current")
+        return current
+
+    s3_write_json(manifest, bucket, f"{MANIFEST_PREFIX}/{manifest['id']}.json")
+    refresh_root_copies(bucket, manifest, current)
+    s3_write_json(manifest, bucket, MANIFEST_KEY)
+    print(f"Published manifest {manifest['id']}")
+    return manifest
+
+
+def current_manifest(bucket):
+    if not s3_exists(bucket, MANIFEST_KEY):
+        return None
+    return s3_read_json(bucket, MANIFEST_KEY)
+
+
+def refresh_root_copies(bucket, manifest, current):
+    """Keep the plain copy at the bucket root in step with the manifest for tooling that reads it directly"""
+    current_artifacts = current["artifacts"] if current else {}
+    for name, entry in manifest["artifacts"].items():
+        if current_artifacts.get(name, {}).get("sha256") != entry["sha256"]:
+            s3_copy(bucket, entry["key"], name)
+
+
+def pin(bucket, pinned_id):
+    manifest = s3_read_json(bucket, f"{MANIFEST_PREFIX}/{pinned_id}.json")
+    refresh_root_copies(bucket, manifest, current_manifest(bucket))
+    s3_write_json(manifest, bucket, MANIFEST_KEY)
+    print(f"Pinned manifest {pinned_id}")
+    return manifest
+
+
+def rollback(bucket):
+    current = current_manifest(bucket)
+    if not current or not current.get("previous"):
+        raise SystemExit("No previous manifest to roll back to")
+    return pin(bucket, current["previous"])
+
+
+# Instance side
+def fetch_artifacts(bucket, manifest, cache_dir):
+    """Download every artifact missing from the local cache in parallel, returns the names fetched"""
+    missing = []
+    for name, entry in manifest["artifacts"].items():
+        if not os.path.exists(os.path.join(cache_dir, entry["sha256"], name)):
+            missing.append((name, entry))
+
+    def download(item):
+        name, entry = item
+        blob_dir = os.path.join(cache_dir, entry["sha256"])
+        os.makedirs(blob_dir, exist_ok=True)
+        partial_path = os.path.join(blob_dir, name + ".partial")
+        s3_get(bucket, entry["key"], partial_path)
+        if sha256_file(partial_path) != entry["sha256"]:
+            os.remove(partial_path)
+            raise RuntimeError(f"Checksum mismatch for {name}")
+        os.replace(partial_path, os.path.join(blob_dir, name))
+        return name
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_DOWNLOADS) as executor:
+        return list(executor.map(download, missing))
+
+
+def build_release(manifest, cache_dir, release_dir):
+    os.makedirs(release_dir)
+    # Unpack archives first so single files layered on top (config.py) win
+    ordered = sorted(manifest["artifacts"].items(), key=lambda item: not item[0].endswith(".zip"))
+    for name, entry in ordered:
+        blob_path = os.path.join(cache_dir, entry["sha256"], name)
+        target = os.path.normpath(os.path.join(release_dir, entry["path"]))
+        if name.endswith(".zip"):
+            with zipfile.ZipFile(blob_path) as archive:
+                archive.extractall(target)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(blob_path, target)
+
+    with open(os.path.join(release_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def compile_release(release_dir):
+    # Checked hashes instead of mtimes: still correct if a file is patched by hand mid-session,
+    # and the pyc files stay valid although unpacking gives every file a new mtime
+    compiled = compileall.compile_dir(release_dir, quiet=1, workers=0,
+                                      invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+    if not compiled:
+        print("Some modules did not compile, they are compiled on import instead")
+    return compiled
+
+
+def prune_releases(releases_dir, active_release, keep=RELEASES_TO_KEEP):
+    releases = sorted(os.listdir(releases_dir))
+    for release in releases[:-keep]:
+        path = os.path.join(releases_dir, release)
+        if path != active_release:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def sync(bucket, app_dir, pinned_id=None):
+    started = time.monotonic()
+    projects_dir = os.path.dirname(app_dir.rstrip("/"))
+    cache_dir = os.path.join(projects_dir, ".artifacts")
+    releases_dir = os.path.join(projects_dir, ".releases", os.path.basename(app_dir.rstrip("/")))
+    os.makedirs(cache_dir, exist_ok=True)
+    os.makedirs(releases_dir, exist_ok=True)
+
+    with phase("artifact_sync.manifest"):
+        if pinned_id:
+            manifest = s3_read_json(bucket, f"{MANIFEST_PREFIX}/{pinned_id}.json")
+        else:
+            manifest = s3_read_json(bucket, MANIFEST_KEY)
+    print(f"Syncing manifest {manifest['id']}")
+
+    with phase("artifact_sync.fetch"):
+        fetched = fetch_artifacts(bucket, manifest, cache_dir)
+    print(f"Fetched {fetched or 'nothing'}, reused {sorted(set(manifest['artifacts']) - set(fetched))}")
+
+    release_name = datetime.now().strftime("%Y%m%d-%H%M%S") + "-" + manifest["id"]
+    release_dir = os.path.join(releases_dir, release_name)
+    with phase("artifact_sync.unpack"):
+        build_release(manifest, cache_dir, release_dir)
+    with phase("artifact_sync.compile"):
+        compile_release(release_dir)
+    switch_link(app_dir, release_dir)
+    prune_releases(releases_dir, release_dir)
+
+    print(f"{app_dir} -> {release_dir} in {time.monotonic() - started:.1f}s")
+    return release_dir
+
+
+# Import profile
+def entry_point_imports(path):
+    """Import statements of the entry point script, profiled without running the rest of it"""
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    return sorted({ast.unparse(node) for node in ast.walk(tree)
+                   if isinstance(node, ast.Import) or (isinstance(node, ast.ImportFrom) and node.level == 0)})
+
+
+def parse_importtime(stderr):
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            rows.append({
+                "module": match.group(4),
+                "self_us": int(match.group(1)),
+                "cumulative_us": int(match.group(2)),
+                "depth": len(match.group(3)) // 2,
+            })
+    return rows
+
+
+IMPORT_SNIPPET = """
+import json, sys
+failed = {}
+for statement in sys.argv[1:]:
+    try:
+        exec(statement, {})
+    except Exception as e:
+        failed[statement] = repr(e)
+print(json.dumps({"python": sys.version.split()[0], "failed": failed}))
+"""
+
+
+def import_profile(app_dir, python, entry_point=ENTRY_POINT):
+    imports = entry_point_imports(os.path.join(app_dir, entry_point))
+    env = dict(os.environ, PYTHONPATH=os.path.join(app_dir, "src"))
+    result = subprocess.run([python, "-X", "importtime", "-c", IMPORT_SNIPPET, *imports],
+                            cwd=app_dir, env=env, capture_output=True, text=True, timeout=600, check=True)
+    summary = json.loads(result.stdout.strip().splitlines()[-1])
+    rows = parse_importtime(result.stderr)
+    return {
+        "python": summary["python"],
+        "profiled_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "entry_point": entry_point,
+        "imports": imports,
+        "failed": summary["failed"],
+        "total_ms": round(sum(row["cumulative_us"] for row in rows if row["depth"] == 0) / 1000, 1),
+        "slowest_cumulative": sorted(rows, key=lambda row: -row["cumulative_us"])[:IMPORT_PROFILE_TOP],
+        "slowest_self": sorted(rows, key=lambda row: -row["self_us"])[:IMPORT_PROFILE_TOP],
+    }
+
+
+def python_tag(python):
+    result = subprocess.run([python, "-c", "import sys; print('py%d%d' % sys.version_info[:2])"],
+                            capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+def profile(bucket, app_dir, python, force=False):
+    with open(os.path.join(app_dir, "manifest.json")) as f:
+        repo = json.load(f)["artifacts"]["repo.zip"]
+    key = f"{ARTIFACT_PREFIX}/{repo['sha256']}/importtime-{python_tag(python)}.json"
+    if not force and s3_exists(bucket, key):
+        print(f"Import profile {key} exists")
+        return None
+
+    with phase("artifact_sync.import_profile"):
+        report = import_profile(app_dir, python)
+    s3_write_json(report, bucket, key)
+    print(f"Imports of {ENTRY_POINT} take {report['total_ms']} ms, slowest:")
+    for row in report["slowest_cumulative"][:10]:
+        print(f"  {row['cumulative_us'] / 1000:8.1f} ms  {row['module']}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["publish", "pin", "rollback", "sync", "profile"])
+    parser.add_argument("manifest_id", nargs="?")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--source-dir", default=".")
+    parser.add_argument("--app-dir")
+    parser.add_argument("--manifest", help="Sync a specific manifest instead of the current one")
+    parser.add_argument("--python", default=sys.executable, help="profile: interpreter the app runs with")
+    parser.add_argument("--force", action="store_true", help="profile: even if this version has a report")
+    args = parser.parse_args(argv)
+
+    if args.command == "publish":
+        publish(args.bucket, args.source_dir)
+    elif args.command == "pin":
+        if not args.manifest_id:
+            parser.error("pin needs a manifest id")
+        pin(args.bucket, args.manifest_id)
+    elif args.command == "rollback":
+        rollback(args.bucket)
+    elif args.command == "profile":
+        if not args.app_dir:
+            parser.error("profile needs --app-dir")
+        profile(args.bucket, args.app_dir, args.python, args.force)
+    else:
+        if not args.app_dir:
+            parser.error("sync needs --app-dir")
+        sync(args.bucket, args.app_dir, args.manifest)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Historical context snapshots for the SimpleTrader trading host.
+
+The evening before a session, build runs pre_market_setup.py for that session (passed as
+SIMPLETRADER_SESSION_DATE) and publishes the context it writes to <app-dir>/historical_context.
+Tabular files also get an uncompressed Arrow IPC copy next to them, which the app can memory-map
+with open_table() instead of parsing CSV.
+
+    context-snapshots/<session>/files/<path>       snapshot files
+    context-snapshots/<session>/manifest.json      sha256 of every file, written last
+
+restore downloads the snapshot into <projects>/.context/<session>, verifies it, points
+<app-dir>/historical_context at it and reads every file once so the page cache is warm.
+
+    context_snapshot.py build   --bucket B --app-dir DIR --session YYYY-MM-DD    (the evening before)
+    context_snapshot.py restore --bucket B --app-dir DIR [--session YYYY-MM-DD]  (at boot and 08:55)
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+from datetime import date, datetime, timezone
+
+from host_common import phase, s3_exists, s3_put, s3_read_json, s3_write_json, sha256_file, switch_link
+
+SNAPSHOT_PREFIX = "context-snapshots"
+CONTEXT_DIR_NAME = "historical_context"
+SESSION_ENV = "SIMPLETRADER_SESSION_DATE"
+SESSIONS_TO_KEEP = 3
+NO_SNAPSHOT = 2
+
+
+def s3_sync(bucket, prefix, dest):
+    subprocess.run(["aws", "s3", "sync", "--only-show-errors", "--delete", f"s3://{bucket}/{prefix}", dest], check=True)
+
+
+def snapshot_prefix(session):
+    return f"{SNAPSHOT_PREFIX}/{session}"
+
+
+def list_files(root):
+    files = []
+    for dir_path, _, names in os.walk(root):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(dir_path, name), root))
+    return sorted(files)
+
+
+def to_arrow(csv_path):
+    """Writes an uncompressed Arrow IPC copy of a CSV file, skipped when pyarrow is not installed"""
+    try:
+        from pyarrow import csv, ipc
+    except ImportError:
+        return None
+    table = csv.read_csv(csv_path)
+    arrow_path = os.path.splitext(csv_path)[0] + ".arrow"
+    with ipc.new_file(arrow_path, table.schema) as writer:
+        writer.write_table(table)
+    return arrow_path
+
+
+def open_table(arrow_path):
+    """Memory-maps a snapshot .arrow file, pages are only read when the columns are touched"""
+    import pyarrow as pa
+    return pa.ipc.open_file(pa.memory_map(arrow_path, "r")).read_all()
+
+
+# Evening side
+def build(bucket, app_dir, session, python=sys.executable):
+    data_dir = os.path.join(app_dir, CONTEXT_DIR_NAME)
+    # Still pointing at the snapshot restored this morning, build into a fresh directory instead
+    if os.path.islink(data_dir):
+        os.remove(data_dir)
+    env = dict(os.environ, PYTHONPATH=os.path.join(app_dir, "src"), **{SESSION_ENV: session})
+    print(f"Preparing context for {session}")
+    with phase("context_snapshot.pre_market_setup"):
+        subprocess.run([python, os.path.join(app_dir, "src", "setup", "pre_market_setup.py")],
+                       cwd=app_dir, env=env, check=True)
+
+    for name in list_files(data_dir):
+        if name.endswith(".csv"):
+            to_arrow(os.path.join(data_dir, name))
+
+    files = {}
+    for name in list_files(data_dir):
+        local_path = os.path.join(data_dir, name)
+        files[name] = sha256_file(local_path)
+        s3_put(local_path, bucket, f"{snapshot_prefix(session)}/files/{name}")
+
+    manifest = {
+        "session": session,
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "files": files,
+    }
+    s3_write_json(manifest, bucket, f"{snapshot_prefix(session)}/manifest.json")
+    print(f"Published {len(files)} files for {session}")
+    return manifest
+
+
+# Instance side
+def verified(files_dir, manifest):
+    return all(os.path.isfile(os.path.join(files_dir, name)) and sha256_file(os.path.join(files_dir, name)) == sha256
+               for name, sha256 in manifest["files"].items())
+
+
+def link_context(app_dir, files_dir):
+    switch_link(os.path.join(app_dir, CONTEXT_DIR_NAME), files_dir)
+
+
+def prefetch(files_dir):
+    """Reads every file once, so the first memory-mapped access does not wait on the EBS volume"""
+    for name in list_files(files_dir):
+        with open(os.path.join(files_dir, name), "rb") as f:
+            while f.read(4 * 1024 * 1024):
+                pass
+
+
+def prune_sessions(context_root, session, keep=SESSIONS_TO_KEEP):
+    for name in sorted(os.listdir(context_root))[:-keep]:
+        if name != session:
+            shutil.rmtree(os.path.join(context_root, name), ignore_errors=True)
+
+
+def restore(bucket, app_dir, session):
+    manifest_key = f"{snapshot_prefix(session)}/manifest.json"
+    if not s3_exists(bucket, manifest_key):
+        print(f"No context snapshot for {session}")
+        return NO_SNAPSHOT
+
+    context_root = os.path.join(os.path.dirname(app_dir.rstrip("/")), ".context")
+    session_dir = os.path.join(context_root, session)
+    files_dir = os.path.join(session_dir, "files")
+    manifest = s3_read_json(bucket, manifest_key)
+
+    if verified(files_dir, manifest):
+        print(f"Context snapshot for {session} already restored")
+    else:
+        os.makedirs(files_dir, exist_ok=True)
+        with phase("context_snapshot.download"):
+            s3_sync(bucket, f"{snapshot_prefix(session)}/files/", files_dir)
+        if not verified(files_dir, manifest):
+            raise RuntimeError(f"Context snapshot for {session} does not match its manifest")
+        print(f"Restored {len(manifest['files'])} files for {session}")
+
+    link_context(app_dir, files_dir)
+    with phase("context_snapshot.prefetch"):
+        prefetch(files_dir)
+    prune_sessions(context_root, session)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build", "restore"])
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--app-dir", required=True)
+    parser.add_argument("--session", default=date.today().isoformat(), help="Trading day the context is for")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        build(args.bucket, args.app_dir, args.session)
+        return 0
+    return restore(args.bucket, args.app_dir, args.session)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""End-of-day upload of the day's trade logs, run by the stop flow before the instance is stopped.
+
+The day's log directory is packed into one zstd compressed tar archive (gzip where zstd is not
+installed yet), uploaded with parallel multipart requests and checked against the object S3
+stored: size, the sha256 kept in its metadata and the ETag, which for a multipart upload is
+derived from the MD5 of every part and so covers the whole content. Only a verified upload exits
+0, the stop flow stops the instance after that or after its deadline.
+
+    <prefix><name>.tar.zst           the archive, x-amz-meta-sha256 holds its checksum
+    <prefix><name>.tar.zst.sha256    sha256sum -c compatible checksum file
+
+    eod_upload.py upload --bucket B --source DIR --prefix SimpleTraderLogArchive/2024-01-02/ --name trade_logs-2024-01-02
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from host_common import phase, s3_put, sha256_file
+
+WORK_DIR = "/home/ec2-user/eod"
+ZSTD_LEVEL = 3
+# Applied to the AWS CLI of the upload, multipart_etag() relies on the same part size
+MULTIPART_CHUNK_MB = 16
+MAX_CONCURRENT_REQUESTS = 16
+MAX_PARTS = 10000
+UPLOAD_ATTEMPTS = 2
+
+
+def configure_transfers(work_dir):
+    """Environment for aws s3 cp with the part size and parallelism of the upload. They go into a copy
+    of the CLI config, the host's ~/.aws/config used by the log shipper and artifact_sync stays as it is."""
+    config_file = os.path.join(work_dir, "aws-config")
+    shared_config = os.environ.get("AWS_CONFIG_FILE", os.path.expanduser("~/.aws/config"))
+    if os.path.exists(shared_config):
+        shutil.copyfile(shared_config, config_file)
+    else:
+        open(config_file, "w").close()
+    env = dict(os.environ, AWS_CONFIG_FILE=config_file)
+    for name, value in [("multipart_threshold", f"{MULTIPART_CHUNK_MB}MB"),
+                        ("multipart_chunksize", f"{MULTIPART_CHUNK_MB}MB"),
+                        ("max_concurrent_requests", str(MAX_CONCURRENT_REQUESTS))]:
+        subprocess.run(["aws", "configure", "set", f"default.s3.{name}", value], check=True, env=env)
+    return env
+
+
+def s3_upload(path, bucket, key, metadata, env=None):
+    metadata_arg = ",".join(f"{name}={value}" for name, value in metadata.items())
+    subprocess.run(["aws", "s3", "cp", "--only-show-errors", "--metadata", metadata_arg, path,
+                    f"s3://{bucket}/{key}"], check=True, env=env)
+
+
+def s3_head(bucket, key):
+    result = subprocess.run(["aws", "s3api", "head-object", "--bucket", bucket, "--key", key],
+                            check=True, capture_output=True, text=True)
+    return json.loads(result.stdout)
+
+
+def pack(source_dir, archive_base):
+    """tar of source_dir piped through zstd on all cores, returns the archive path"""
+    parent, name = os.path.split(os.path.abspath(source_dir))
+    if shutil.which("zstd"):
+        archive, compressor = archive_base + ".tar.zst", ["zstd", "-T0", f"-{ZSTD_LEVEL}", "-q", "-f", "-o"]
+    else:
+        archive, compressor = archive_base + ".tar.gz", ["gzip", "-c"]
+    tar = subprocess.Popen(["tar", "-C", parent, "-cf", "-", name], stdout=subprocess.PIPE)
+    if compressor[0] == "zstd":
+        compress = subprocess.run(compressor + [archive], stdin=tar.stdout)
+    else:
+        with open(archive, "wb") as out:
+            compress = subprocess.run(compressor, stdin=tar.stdout, stdout=out)
+    tar.stdout.close()
+    if tar.wait() != 0 or compress.returncode != 0:
+        raise RuntimeError(f"Packing {source_dir} failed")
+    return archive
+
+
+def part_size(size, chunk_size=MULTIPART_CHUNK_MB * 1024 * 1024):
+    """The part size the CLI ends up using, it doubles the configured one past MAX_PARTS parts"""
+    while math.ceil(size / chunk_size) > MAX_PARTS:
+        chunk_size *= 2
+    return chunk_size
+
+
+def multipart_etag(path, chunk_size=MULTIPART_CHUNK_MB * 1024 * 1024):
+    """The ETag S3 reports for the file uploaded by the CLI: its MD5 below the multipart threshold,
+    else the MD5 of the part MD5s and the number of parts"""
+    size = os.path.getsize(path)
+    if size < chunk_size:
+        with open(path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+    chunk_size = part_size(size, chunk_size)
+    part_digests = []
+    with open(path, "rb") as f:
+        for part in iter(lambda: f.read(chunk_size), b""):
+            part_digests.append(hashlib.md5(part).digest())
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+def verify(head, size, sha256, etag):
+    """What does not match between the stored object and the local archive"""
+    problems = []
+    if head["ContentLength"] != size:
+        problems.append(f"size {head['ContentLength']} instead of {size}")
+    if head.get("Metadata", {}).get("sha256") != sha256:
+        problems.append(f"sha256 {head.get('Metadata', {}).get('sha256')} instead of {sha256}")
+    # With SSE-KMS the ETag is not an MD5, size and sha256 have to do
+    if head.get("ServerSideEncryption") != "aws:kms" and head["ETag"].strip('"') != etag:
+        problems.append(f"ETag {head['ETag']} instead of {etag}")
+    return problems
+
+
+def upload(bucket, source_dir, prefix, name, work_dir=WORK_DIR):
+    if not os.path.isdir(source_dir):
+        print(f"Nothing to upload, {source_dir} does not exist")
+        return None
+
+    os.makedirs(work_dir, exist_ok=True)
+    with phase("eod_upload.pack"):
+        started = time.monotonic()
+        archive = pack(source_dir, os.path.join(work_dir, name))
+        size, sha256, etag = os.path.getsize(archive), sha256_file(archive), multipart_etag(archive)
+        checksum_file = archive + ".sha256"
+        with open(checksum_file, "w") as f:
+            f.write(f"{sha256}  {os.path.basename(archive)}\n")
+        source_size = sum(os.path.getsize(os.path.join(root, file_name))
+                          for root, _, file_names in os.walk(source_dir) for file_name in file_names)
+        print(f"Packed {source_size} bytes into {size} bytes in {time.monotonic() - started:.1f}s")
+
+    key = prefix + os.path.basename(archive)
+    transfer_env = configure_transfers(work_dir)
+    for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+        with phase("eod_upload.upload"):
+            started = time.monotonic()
+            s3_upload(archive, bucket, key, {"sha256": sha256}, transfer_env)
+            seconds = time.monotonic() - started
+            print(f"Uploaded s3://{bucket}/{key} in {seconds:.1f}s, {size / 1e6 / max(seconds, 0.001):.1f} MB/s")
+        with phase("eod_upload.verify"):
+            problems = verify(s3_head(bucket, key), size, sha256, etag)
+        if not problems:
+            break
+        print(f"Upload attempt {attempt} does not match the archive: {', '.join(problems)}")
+    else:
+        raise RuntimeError(f"s3://{bucket}/{key} could not be verified, the archive stays in {work_dir}")
+
+    s3_put(checksum_file, bucket, key + ".sha256")
+    os.remove(archive)
+    os.remove(checksum_file)
+    print(f"Verified s3://{bucket}/{key} ({sha256})")
+    return key
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["upload"])
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--source", required=True, help="Directory packed into the archive")
+    parser.add_argument("--prefix", required=True, help="Key prefix of the archive, ending in /")
+    parser.add_argument("--name", required=True, help="Archive name without the extension")
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    args = parser.parse_args(argv)
+
+    upload(args.bucket, args.source, args.prefix, args.name, args.work_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Symbol to shard assignment for a fleet of trading instances.
+
+assign balances the symbol universe over the shards, heaviest symbols first onto the least loaded
+shard, and publishes it to the bucket. apply runs on every instance of the fleet at boot: the
+instance's position in the fleet (INSTANCE_IDS of the stack, passed by the start flow) is its
+shard, its symbols go to <app-dir>/shard.json and the shard to an environment file the systemd
+units load.
+
+    fleet/shards.json    {"shard_count": 2, "shards": [["RELIANCE", ...], ["TCS", ...]], ...}
+
+    fleet_shard.py assign --bucket B --shards N --symbols FILE    (lines of SYMBOL or SYMBOL,WEIGHT)
+    fleet_shard.py apply  --bucket B --app-dir DIR --fleet i-a,i-b
+
+A fleet of one instance needs no assignment, its single shard trades every symbol.
+"""
+import argparse
+import json
+import os
+import sys
+import urllib.request
+from datetime import datetime, timezone
+
+from host_common import s3_exists, s3_read_json, s3_write_json
+
+ASSIGNMENT_KEY = "fleet/shards.json"
+SHARD_FILE_NAME = "shard.json"
+SHARD_ENV_PATH = "/etc/simpletrader/shard.env"
+IMDS_URL = "http://169.254.169.254/latest"
+
+
+def read_symbols(path):
+    """{symbol: weight} from lines of SYMBOL or SYMBOL,WEIGHT, e.g. the ticks per second of the symbol"""
+    symbols = {}
+    with open(path) as f:
+        for line in f:
+            fields = [field.strip() for field in line.split(",")]
+            if not fields[0] or fields[0].startswith("#"):
+                continue
+            symbols[fields[0]] = float(fields[1]) if len(fields) > 1 and fields[1] else 1.0
+    return symbols
+
+
+def balance(symbols, shard_count):
+    """Greedy longest-processing-time assignment, each shard's symbols sorted"""
+    shards = [[] for _ in range(shard_count)]
+    loads = [0.0] * shard_count
+    for symbol, weight in sorted(symbols.items(), key=lambda item: (-item[1], item[0])):
+        lightest = loads.index(min(loads))
+        shards[lightest].append(symbol)
+        loads[lightest] += weight
+    return [sorted(shard) for shard in shards], loads
+
+
+def assign(bucket, shard_count, symbols_path):
+    symbols = read_symbols(symbols_path)
+    shards, loads = balance(symbols, shard_count)
+    assignment = {
+        "shard_count": shard_count,
+        "assigned_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "shards": shards,
+        "loads": [round(load, 3) for load in loads],
+    }
+    s3_write_json(assignment, bucket, ASSIGNMENT_KEY)
+    for shard, (shard_symbols, load) in enumerate(zip(shards, loads)):
+        print(f"Shard {shard}: {len(shard_symbols)} symbols, load {load:g}")
+    return assignment
+
+
+def own_instance_id():
+    token_request = urllib.request.Request(f"{IMDS_URL}/api/token", method="PUT",
+                                           headers={"X-aws-ec2-metadata-token-ttl-seconds": "60"})
+    token = urllib.request.urlopen(token_request, timeout=2).read().decode()
+    id_request = urllib.request.Request(f"{IMDS_URL}/meta-data/instance-id",
+                                        headers={"X-aws-ec2-metadata-token": token})
+    return urllib.request.urlopen(id_request, timeout=2).read().decode()
+
+
+def shard_of(instance_id, fleet):
+    if instance_id not in fleet:
+        raise RuntimeError(f"{instance_id} is not part of the fleet {fleet}")
+    return fleet.index(instance_id)
+
+
+def apply(bucket, app_dir, fleet, instance_id=None, env_path=SHARD_ENV_PATH):
+    shard = shard_of(instance_id or own_instance_id(), fleet)
+    symbols = None
+    if s3_exists(bucket, ASSIGNMENT_KEY):
+        assignment = s3_read_json(bucket, ASSIGNMENT_KEY)
+        if assignment["shard_count"] != len(fleet):
+            # Symbols would be traded twice or not at all
+            raise RuntimeError(f"{ASSIGNMENT_KEY} has {assignment['shard_count']} shards, the fleet {len(fleet)} instances")
+        symbols = assignment["shards"][shard]
+    elif len(fleet) > 1:
+        raise RuntimeError(f"A fleet of {len(fleet)} instances needs {ASSIGNMENT_KEY}, run fleet_shard.py assign")
+
+    shard_file = os.path.join(app_dir, SHARD_FILE_NAME)
+    with open(shard_file, "w") as f:
+        # symbols is null for a single instance, which trades the whole universe
+        json.dump({"shard": shard, "shard_count": len(fleet), "symbols": symbols}, f, indent=2)
+
+    os.makedirs(os.path.dirname(env_path), exist_ok=True)
+    with open(env_path, "w") as f:
+        f.write(f"SIMPLETRADER_SHARD={shard}\n")
+        f.write(f"SIMPLETRADER_SHARD_COUNT={len(fleet)}\n")
+        f.write(f"SIMPLETRADER_SHARD_FILE={shard_file}\n")
+    print(f"Shard {shard} of {len(fleet)}, {'all' if symbols is None else len(symbols)} symbols")
+    return shard
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["assign", "apply"])
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--shards", type=int, help="assign: number of shards, the size of the fleet")
+    parser.add_argument("--symbols", help="assign: file with one SYMBOL or SYMBOL,WEIGHT per line")
+    parser.add_argument("--app-dir", help="apply: where shard.json is written")
+    parser.add_argument("--fleet", help="apply: comma separated instance ids in shard order")
+    args = parser.parse_args(argv)
+
+    if args.command == "assign":
+        if not args.shards or not args.symbols:
+            parser.error("assign needs --shards and --symbols")
+        assign(args.bucket, args.shards, args.symbols)
+        return 0
+
+    if not args.app_dir or not args.fleet:
+        parser.error("apply needs --app-dir and --fleet")
+    apply(args.bucket, args.app_dir, args.fleet.split(","))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/bin/bash
+# Low latency host profile for the SimpleTrader trading instance, run as root by the start flow.
+#
+# The top quarter of the cores (6-7 of a c6g.2xlarge, at least one core) is reserved for the trading
+# process: isolcpus/nohz_full keep the scheduler and timer ticks off them, every other service and IRQ
+# is kept on the remaining cores. The ranges follow the instance type, so every shard of a fleet gets
+# its own. The kernel arguments only take effect on the next boot, the instance is stopped every
+# evening anyway.
+#
+#     host_profile.sh BUCKET_NAME
+set -euo pipefail
+
+BUCKET_NAME=$1
+PROFILE_DIR=$(cd "$(dirname "$0")" && pwd)
+
+cpu_range() {
+    if [ "$1" -eq "$2" ]; then echo "$1"; else echo "$1-$2"; fi
+}
+
+# --all, the SSM agent itself may already be confined to the housekeeping cores
+CPU_COUNT=$(nproc --all)
+if [ "$CPU_COUNT" -lt 2 ]; then
+    # Nothing to isolate on a single core, the trading process shares it
+    HOUSEKEEPING_CPUS=0
+    ISOLATED_CPUS=0
+    KERNEL_ARGS="transparent_hugepage=never"
+else
+    ISOLATED_COUNT=$(( CPU_COUNT / 4 > 1 ? CPU_COUNT / 4 : 1 ))
+    HOUSEKEEPING_CPUS=$(cpu_range 0 $(( CPU_COUNT - ISOLATED_COUNT - 1 )))
+    ISOLATED_CPUS=$(cpu_range $(( CPU_COUNT - ISOLATED_COUNT )) $(( CPU_COUNT - 1 )))
+    KERNEL_ARGS="isolcpus=$ISOLATED_CPUS nohz_full=$ISOLATED_CPUS rcu_nocbs=$ISOLATED_CPUS transparent_hugepage=never"
+fi
+echo "$CPU_COUNT cores, housekeeping: $HOUSEKEEPING_CPUS, trading: $ISOLATED_CPUS"
+
+# Kernel arguments, next boot. grubby replaces the values of arguments already set.
+KERNEL_ARGS_SET=true
+for arg in $KERNEL_ARGS; do
+    grep -qw -- "$arg" /proc/cmdline || KERNEL_ARGS_SET=false
+done
+if [ "$KERNEL_ARGS_SET" = false ]; then
+    if [ "$CPU_COUNT" -lt 2 ]; then
+        grubby --update-kernel=ALL --remove-args="isolcpus nohz_full rcu_nocbs"
+    fi
+    grubby --update-kernel=ALL --args="$KERNEL_ARGS"
+    echo "Kernel arguments updated, effective after the next boot"
+fi
+
+# Transparent hugepages off right away, the kernel argument keeps it off after reboots
+echo never > /sys/kernel/mm/transparent_hugepage/enabled
+echo never > /sys/kernel/mm/transparent_hugepage/defrag
+
+# Network and VM tuning
+install -m 0644 "$PROFILE_DIR/90-simpletrader.conf" /etc/sysctl.d/90-simpletrader.conf
+sysctl --quiet --load /etc/sysctl.d/90-simpletrader.conf
+
+# Everything else, including the SSM agent, cron and pip, stays on the housekeeping cores (from the next boot)
+mkdir -p /etc/systemd/system.conf.d
+printf '[Manager]\nCPUAffinity=%s\n' "$HOUSEKEEPING_CPUS" > /etc/systemd/system.conf.d/10-housekeeping.conf
+if [ -f /etc/sysconfig/irqbalance ]; then
+    sed -i '/^IRQBALANCE_BANNED_CPULIST=/d' /etc/sysconfig/irqbalance
+    [ "$CPU_COUNT" -ge 2 ] && echo "IRQBALANCE_BANNED_CPULIST=$ISOLATED_CPUS" >> /etc/sysconfig/irqbalance
+    systemctl try-restart irqbalance
+fi
+
+# Systemd units replace the crontab entries older instances were launched with
+mkdir -p /etc/simpletrader
+echo "BUCKET_NAME=$BUCKET_NAME" > /etc/simpletrader/env
+sed -i '/SimpleTrader\/src\/setup\//d' /etc/crontab
+install -m 0644 "$PROFILE_DIR"/simpletrader-*.service "$PROFILE_DIR"/simpletrader-*.timer /etc/systemd/system/
+# The cores of this instance type, pre-market on the housekeeping ones and trading on the isolated ones
+pin_unit() {
+    mkdir -p "/etc/systemd/system/$1.d"
+    printf '[Service]\nCPUAffinity=%s\n' "$2" > "/etc/systemd/system/$1.d/10-cpus.conf"
+}
+pin_unit simpletrader-premarket.service "$HOUSEKEEPING_CPUS"
+pin_unit simpletrader-trading.service "$ISOLATED_CPUS"
+# The timers run on local time, the instance is set to IST by its user data. A timer systemd cannot
+# load would silently leave the day without pre-market and trading, so they are checked first.
+timedatectl set-timezone Asia/Kolkata
+systemd-analyze verify /etc/systemd/system/simpletrader-premarket.timer /etc/systemd/system/simpletrader-trading.timer
+systemctl daemon-reload
+systemctl enable --now simpletrader-premarket.timer simpletrader-trading.timer
+# Restarted to pick up a new log_shipper.py, stopping it flushes what it has read
+systemctl enable simpletrader-log-shipper.service
+systemctl restart simpletrader-log-shipper.service
+
+echo "Host profile applied, isolated cores: $(cat /sys/devices/system/cpu/isolated 2>/dev/null || echo none)"
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Before/after latency benchmark for the trading host profile (host_profile/host_profile.sh).
+
+Measures how late the process wakes up from short sleeps (scheduler and timer jitter on the core
+it runs on) and, with --host, TCP connect round trips to the broker. Run it pinned the way the
+trading process runs, once before and once after the profile is applied, and compare the two:
+
+    taskset -c 6 python3.9 latency_bench.py run --label before [--host api.broker.example]
+    taskset -c 6 python3.9 latency_bench.py run --label after  [--host api.broker.example]
+    python3.9 latency_bench.py compare /home/ec2-user/bench/before.json /home/ec2-user/bench/after.json
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import time
+from datetime import datetime, timezone
+
+from host_common import percentile
+
+RESULTS_DIR = "/home/ec2-user/bench"
+PERCENTILES = [50, 99, 99.9]
+
+
+def summarize(samples_us):
+    summary = {f"p{pct:g}_us": round(percentile(samples_us, pct), 1) for pct in PERCENTILES}
+    summary["max_us"] = round(max(samples_us), 1)
+    summary["samples"] = len(samples_us)
+    return summary
+
+
+def wakeup_jitter(samples=20000, interval_us=200):
+    """How much later than asked the thread wakes up from a short sleep"""
+    late = []
+    interval = interval_us / 1e6
+    for _ in range(samples):
+        started = time.perf_counter()
+        time.sleep(interval)
+        late.append((time.perf_counter() - started - interval) * 1e6)
+    return summarize(late)
+
+
+def tcp_connect(host, port=443, samples=50):
+    address = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)[0][4]
+    rtts = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        with socket.create_connection(address, timeout=5):
+            rtts.append((time.perf_counter() - started) * 1e6)
+        time.sleep(0.05)
+    return summarize(rtts)
+
+
+def run(label, host=None, results_dir=RESULTS_DIR):
+    report = {
+        "label": label,
+        "ran_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "cpus": sorted(os.sched_getaffinity(0)),
+        "kernel_cmdline": open("/proc/cmdline").read().strip() if os.path.exists("/proc/cmdline") else "",
+        "wakeup_jitter": wakeup_jitter(),
+    }
+    if host:
+        report["tcp_connect"] = tcp_connect(host)
+
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{label}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Saved to {path}")
+    return report
+
+
+def compare(before, after):
+    lines = []
+    for section in ["wakeup_jitter", "tcp_connect"]:
+        if section not in before or section not in after:
+            continue
+        for metric, value in after[section].items():
+            if metric == "samples":
+                continue
+            previous = before[section][metric]
+            change = (value - previous) / previous * 100 if previous else 0
+            lines.append(f"{section:14} {metric:9} {previous:>10} -> {value:>10}  ({change:+.0f}%)")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["run", "compare"])
+    parser.add_argument("reports", nargs="*", help="compare: the before and after report files")
+    parser.add_argument("--label", default=datetime.now().strftime("%Y%m%d-%H%M%S"))
+    parser.add_argument("--host", help="Broker host to measure TCP connect time to")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        run(args.label, args.host)
+        return 0
+
+    if len(args.reports) != 2:
+        parser.error("compare needs the before and after report files")
+    with open(args.reports[0]) as f:
+        before = json.load(f)
+    with open(args.reports[1]) as f:
+        after = json.load(f)
+    print("\n".join(compare(before, after)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""Intraday shipping of the trade logs and the ledger, run as simpletrader-log-shipper.service.
+
+Tails every file under trade_logs/<today>/ and ledger/ and rolls the complete lines written to
+each file into a gzip compressed chunk per time window (ROLL_SECONDS). Sealed chunks are written
+to a spool directory on disk, then uploaded by a few background threads:
+
+    SimpleTraderLogs/<date>/[shard=N/]<file>.<generation>.<offset>.gz          trade_logs/<date>/<file>
+    SimpleTraderLedgerStream/<date>/[shard=N/]<file>.<generation>.<offset>.gz  ledger/<file>
+
+A chunk's key holds the file offset it starts at, so a chunk sealed again after a crash replaces
+the first one instead of duplicating its lines, the generation counts how often the file was
+replaced or truncated. The spool is the backpressure: while it holds more
+than MAX_SPOOL_BYTES the shipper stops reading and the lines wait in the files they were written
+to. On SIGTERM (systemctl stop) the remaining lines, partial last lines included, are sealed and
+the spool drained, which makes the end of day a small final flush:
+
+    log_shipper.py run   --bucket B --app-dir DIR --app-name SimpleTrader
+    log_shipper.py check --app-dir DIR --app-name SimpleTrader    (exits 1 while anything is unshipped)
+
+S3_ENDPOINT_URL points the uploads at a local S3 stand-in such as MinIO or moto_server.
+"""
+import argparse
+import gzip
+import json
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+SHIPPER_DIR = "/home/ec2-user/log_shipper"
+ROLL_SECONDS = 300
+POLL_SECONDS = 2
+MAX_CHUNK_BYTES = 32 * 1024 * 1024  # Uncompressed, a busy file is sealed before its window ends
+MAX_SPOOL_BYTES = 256 * 1024 * 1024
+UPLOAD_WORKERS = 4
+FINAL_FLUSH_SECONDS = 240  # Inside the unit's TimeoutStopSec
+MAX_RETRY_WAIT_SECONDS = 60
+STATUS_EVERY_SECONDS = 60
+
+
+def s3_put(src, bucket, key):
+    endpoint = ["--endpoint-url", os.environ["S3_ENDPOINT_URL"]] if os.environ.get("S3_ENDPOINT_URL") else []
+    subprocess.run(["aws", "s3", "cp", "--only-show-errors", *endpoint, src, f"s3://{bucket}/{key}"],
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def shard_prefix(environ=os.environ):
+    """shard=N/ in a fleet of more than one instance, see fleet_shard.py"""
+    return f"shard={environ['SIMPLETRADER_SHARD']}/" if int(environ.get("SIMPLETRADER_SHARD_COUNT", "1")) > 1 else ""
+
+
+def walk(root):
+    for dir_path, _, names in os.walk(root):
+        for name in sorted(names):
+            path = os.path.join(dir_path, name)
+            yield path, os.path.relpath(path, root)
+
+
+def source_files(app_dir, app_name, today, shard=""):
+    """(path, key without the offset) of every file shipped on the given day"""
+    for path, relative in walk(os.path.join(app_dir, "trade_logs", today)):
+        yield path, f"{app_name}Logs/{today}/{shard}{relative}"
+    for path, relative in walk(os.path.join(app_dir, "ledger")):
+        yield path, f"{app_name}LedgerStream/{today}/{shard}{relative}"
+
+
+def start_of_day(now):
+    return datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def spooled_files(spool_dir):
+    return [(path, relative) for path, relative in walk(spool_dir) if not path.endswith(".tmp")]
+
+
+class LogShipper:
+    def __init__(self, bucket, app_dir, app_name, shipper_dir=SHIPPER_DIR, shard="", roll_seconds=ROLL_SECONDS,
+                 max_spool_bytes=MAX_SPOOL_BYTES, max_chunk_bytes=MAX_CHUNK_BYTES):
+        self.bucket = bucket
+        self.app_dir = app_dir
+        self.app_name = app_name
+        self.shard = shard
+        self.roll_seconds = roll_seconds
+        self.max_spool_bytes = max_spool_bytes
+        self.max_chunk_bytes = max_chunk_bytes
+        self.spool_dir = os.path.join(shipper_dir, "spool")
+        self.state_path = os.path.join(shipper_dir, "state.json")
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        # state["files"][path] = {"inode", "offset", "generation"}, offset is the end of the last sealed chunk
+        self.state = load_state(self.state_path)
+        self.buffers = {}  # path -> {"key", "start", "window", "data"}, read but not sealed yet
+        self.uploads = queue.Queue()
+        self.lock = threading.Lock()
+        self.spooled = {}  # spool path -> size, queued or uploading
+        self.spool_bytes = 0
+        self.stopping = threading.Event()
+        self.give_up_at = None
+        self.workers = []
+        self.shipped_chunks = 0
+        self.throttled = False
+
+        # Sealed before a crash or a stop that ran out of time
+        for path, key in spooled_files(self.spool_dir):
+            self.queue_upload(path, key)
+
+    def queue_upload(self, spool_path, key, replace_from=None):
+        """Spools a chunk, a chunk sealed again under the same key replaces the queued one"""
+        with self.lock:
+            if replace_from:
+                os.replace(replace_from, spool_path)
+            queued = spool_path in self.spooled
+            self.spool_bytes += os.path.getsize(spool_path) - self.spooled.get(spool_path, 0)
+            self.spooled[spool_path] = os.path.getsize(spool_path)
+        if not queued:
+            self.uploads.put((spool_path, key))
+
+    def read_lines(self, path, offset, final):
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(self.max_chunk_bytes)
+        if final:
+            return data + b"\n" if data and not data.endswith(b"\n") else data
+        end = data.rfind(b"\n") + 1
+        # A line longer than a whole chunk is shipped in pieces rather than never
+        return data if end == 0 and len(data) == self.max_chunk_bytes else data[:end]
+
+    def poll(self, now=None, final=False):
+        """Reads what was written since the last poll and seals the chunks that are due"""
+        now = now or time.time()
+        window = int(now // self.roll_seconds)
+        today = datetime.fromtimestamp(now).date().isoformat()
+        throttled = not final and self.spool_bytes > self.max_spool_bytes
+        if throttled != self.throttled:
+            print(f"Spool {'above' if throttled else 'back below'} {self.max_spool_bytes} bytes, "
+                  f"{'pausing' if throttled else 'resuming'} reads", flush=True)
+            self.throttled = throttled
+
+        seen = set()
+        for path, key in source_files(self.app_dir, self.app_name, today, self.shard):
+            seen.add(path)
+            stat = os.stat(path)
+            tracked = self.state["files"].get(path)
+            if tracked is None:
+                # Files last written before today were shipped on their own day, or predate the shipper
+                tracked = {"inode": stat.st_ino, "offset": 0 if stat.st_mtime >= start_of_day(now) else stat.st_size}
+                self.state["files"][path] = tracked
+            elif tracked["inode"] != stat.st_ino or stat.st_size < tracked["offset"]:
+                # Replaced or truncated, shipped again from the start under new keys
+                tracked.update(inode=stat.st_ino, offset=0, generation=tracked.get("generation", 0) + 1)
+                self.buffers.pop(path, None)
+            if throttled:
+                continue
+
+            buffer = self.buffers.get(path)
+            read_from = tracked["offset"] + (len(buffer["data"]) if buffer else 0)
+            while stat.st_size > read_from:
+                data = self.read_lines(path, read_from, final)
+                if not data:
+                    break
+                if buffer is None:
+                    buffer = self.buffers[path] = {"key": key, "start": read_from, "window": window, "data": bytearray()}
+                buffer["data"] += data
+                read_from += len(data)
+                if len(buffer["data"]) >= self.max_chunk_bytes:
+                    self.seal(path)
+                    buffer = None
+
+        for path in [path for path, buffer in self.buffers.items() if final or buffer["window"] != window]:
+            self.seal(path)
+        # Yesterday's log files are done with
+        for path in set(self.state["files"]) - seen - set(self.buffers):
+            del self.state["files"][path]
+        self.save_state()
+
+    def seal(self, path):
+        buffer = self.buffers.pop(path)
+        tracked = self.state["files"][path]
+        key = f"{buffer['key']}.{tracked.get('generation', 0)}.{buffer['start']:012d}.gz"
+        spool_path = os.path.join(self.spool_dir, key)
+        os.makedirs(os.path.dirname(spool_path), exist_ok=True)
+        with gzip.open(spool_path + ".tmp", "wb", compresslevel=6) as f:
+            f.write(buffer["data"])
+        # Replaces the chunk of the same offset sealed before a crash, which only holds fewer lines
+        self.queue_upload(spool_path, key, replace_from=spool_path + ".tmp")
+        tracked["offset"] = buffer["start"] + len(buffer["data"])
+
+    def save_state(self):
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(self.state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def upload(self, spool_path, key):
+        """Retries until the upload succeeds or the final flush runs out of time, then the chunk stays spooled"""
+        attempt = 0
+        while True:
+            try:
+                inode = os.stat(spool_path).st_ino
+                s3_put(spool_path, self.bucket, key)
+            except (subprocess.CalledProcessError, OSError) as e:
+                wait = min(MAX_RETRY_WAIT_SECONDS, 2 ** attempt)
+                if self.give_up_at is not None and time.time() + wait > self.give_up_at:
+                    print(f"Giving up on {key} for now: {e}", flush=True)
+                    return False
+                print(f"Upload of {key} failed, retrying in {wait}s: {e}", flush=True)
+                attempt += 1
+                time.sleep(wait)
+                continue
+            with self.lock:
+                # Unless it was sealed again while uploading, then the newer chunk goes up too
+                if os.stat(spool_path).st_ino == inode:
+                    os.remove(spool_path)
+                    self.spool_bytes -= self.spooled.pop(spool_path)
+                    self.shipped_chunks += 1
+                    return True
+
+    def upload_worker(self):
+        while True:
+            item = self.uploads.get()
+            try:
+                if item is None:
+                    return
+                self.upload(*item)
+            finally:
+                self.uploads.task_done()
+
+    def start_workers(self, count=UPLOAD_WORKERS):
+        for _ in range(count):
+            worker = threading.Thread(target=self.upload_worker, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def drain(self, deadline):
+        """Waits until every sealed chunk is uploaded, uploads inline when no worker runs"""
+        if not self.workers:
+            while not self.uploads.empty() and time.time() < deadline:
+                self.upload(*self.uploads.get())
+                self.uploads.task_done()
+        while self.uploads.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.2)
+        return not spooled_files(self.spool_dir)
+
+    def stop(self, *_):
+        self.stopping.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.start_workers()
+        print(f"Shipping {self.app_dir} to s3://{self.bucket}, chunks of {self.roll_seconds}s", flush=True)
+        last_status = time.time()
+        while not self.stopping.is_set():
+            self.poll()
+            if time.time() - last_status >= STATUS_EVERY_SECONDS:
+                print(f"{self.shipped_chunks} chunks shipped, {self.uploads.unfinished_tasks} queued, "
+                      f"spool {self.spool_bytes} bytes", flush=True)
+                last_status = time.time()
+            self.stopping.wait(POLL_SECONDS)
+
+        started = time.time()
+        self.give_up_at = started + FINAL_FLUSH_SECONDS
+        self.poll(final=True)
+        drained = self.drain(self.give_up_at)
+        print(f"Final flush {'complete' if drained else 'incomplete'} in {time.time() - started:.1f}s, "
+              f"{self.shipped_chunks} chunks shipped", flush=True)
+        return 0 if drained else 1
+
+
+def check(app_dir, app_name, shipper_dir=SHIPPER_DIR, shard="", now=None):
+    """What is not shipped yet: spooled chunks and bytes of today's files past the sealed offset"""
+    now = now or time.time()
+    today = datetime.fromtimestamp(now).date().isoformat()
+    files = load_state(os.path.join(shipper_dir, "state.json"))["files"]
+    unshipped = {}
+    for path, _ in source_files(app_dir, app_name, today, shard):
+        tracked = files.get(path)
+        if tracked is None and os.path.getmtime(path) < start_of_day(now):
+            continue
+        behind = os.path.getsize(path) - (tracked["offset"] if tracked else 0)
+        if behind > 0:
+            unshipped[path] = behind
+    return {"spooled": [key for _, key in spooled_files(os.path.join(shipper_dir, "spool"))], "unshipped": unshipped}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["run", "check"])
+    parser.add_argument("--bucket", help="run: the working bucket")
+    parser.add_argument("--app-dir", required=True)
+    parser.add_argument("--app-name", required=True)
+    parser.add_argument("--shipper-dir", default=SHIPPER_DIR)
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        pending = check(args.app_dir, args.app_name, args.shipper_dir, shard_prefix())
+        for key in pending["spooled"]:
+            print(f"Spooled, not uploaded: {key}")
+        for path, behind in pending["unshipped"].items():
+            print(f"Not shipped: {behind} bytes of {path}")
+        return 1 if pending["spooled"] or pending["unshipped"] else 0
+
+    if not args.bucket:
+        parser.error("run needs --bucket")
+    return LogShipper(args.bucket, args.app_dir, args.app_name, args.shipper_dir, shard_prefix()).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
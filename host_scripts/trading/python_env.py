@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Hash keyed virtualenvs for the SimpleTrader trading host.
+
+Every distinct requirements.txt gets its own virtualenv under <venvs-dir>/<hash> and a wheelhouse
+of aarch64 wheels stored once in the working bucket under wheelhouse/<hash>/wheelhouse.tar.
+<venvs-dir>/current always points at the virtualenv matching the active release.
+
+    python_env.py ensure --bucket B --requirements FILE    unchanged requirements mean no pip work at all
+    python_env.py build  --bucket B --requirements FILE    only build and publish the wheelhouse
+"""
+import argparse
+import hashlib
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+from host_common import phase, s3_exists, s3_get, s3_put, switch_link
+
+VENVS_DIR = "/home/ec2-user/venvs"
+WHEELHOUSE_DIR = "/home/ec2-user/wheelhouse"
+WHEELHOUSE_PREFIX = "wheelhouse"
+PYTHON = "/usr/local/bin/python3.9"
+
+VENVS_TO_KEEP = 3
+COMPLETE_MARKER = ".complete"
+
+
+def requirements_hash(requirements_path, python=PYTHON):
+    lines = []
+    with open(requirements_path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                lines.append(line)
+
+    # Wheels are only valid for one interpreter and architecture, so both are part of the key
+    python_version = subprocess.run([python, "-c", "import sys; print(sys.version.split()[0])"],
+                                    check=True, capture_output=True, text=True).stdout.strip()
+    key = "\n".join(sorted(lines) + [python_version, platform.machine()])
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def wheelhouse_key(req_hash):
+    return f"{WHEELHOUSE_PREFIX}/{req_hash}/wheelhouse.tar"
+
+
+def build_wheelhouse(requirements_path, wheel_dir, python=PYTHON):
+    print(f"Building wheels for {requirements_path}")
+    subprocess.run([python, "-m", "pip", "wheel", "--quiet", "-r", requirements_path, "-w", wheel_dir], check=True)
+
+
+def fetch_wheelhouse(bucket, requirements_path, req_hash, python=PYTHON):
+    """Makes the wheelhouse for req_hash available locally, building and publishing it if nobody has yet"""
+    wheel_dir = os.path.join(WHEELHOUSE_DIR, req_hash)
+    if os.path.isfile(os.path.join(wheel_dir, COMPLETE_MARKER)):
+        return wheel_dir
+
+    shutil.rmtree(wheel_dir, ignore_errors=True)
+    os.makedirs(wheel_dir)
+    key = wheelhouse_key(req_hash)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archive_path = os.path.join(tmp_dir, "wheelhouse.tar")
+        if s3_exists(bucket, key):
+            print(f"Downloading wheelhouse {req_hash}")
+            s3_get(bucket, key, archive_path)
+            with tarfile.open(archive_path) as archive:
+                archive.extractall(wheel_dir)
+        else:
+            build_wheelhouse(requirements_path, wheel_dir, python)
+            # Wheels are already compressed, a plain tar keeps packing cheap
+            with tarfile.open(archive_path, "w") as archive:
+                for name in os.listdir(wheel_dir):
+                    archive.add(os.path.join(wheel_dir, name), arcname=name)
+            s3_put(archive_path, bucket, key)
+            print(f"Published wheelhouse {req_hash}")
+
+    open(os.path.join(wheel_dir, COMPLETE_MARKER), "w").close()
+    return wheel_dir
+
+
+def create_venv(venv_dir, requirements_path, wheel_dir, python=PYTHON):
+    # Virtualenvs are not relocatable, so build in place and only mark complete at the end
+    shutil.rmtree(venv_dir, ignore_errors=True)
+    subprocess.run([python, "-m", "venv", venv_dir], check=True)
+    subprocess.run([os.path.join(venv_dir, "bin", "python"), "-m", "pip", "install", "--quiet",
+                    "--no-index", "--find-links", wheel_dir, "-r", requirements_path], check=True)
+    open(os.path.join(venv_dir, COMPLETE_MARKER), "w").close()
+
+
+def activate(venvs_dir, venv_dir):
+    switch_link(os.path.join(venvs_dir, "current"), venv_dir)
+
+
+def prune_venvs(venvs_dir, active_venv, keep=VENVS_TO_KEEP):
+    venvs = [os.path.join(venvs_dir, name) for name in os.listdir(venvs_dir) if name != "current"]
+    venvs = [path for path in venvs if os.path.isdir(path) and not os.path.islink(path)]
+    venvs.sort(key=os.path.getmtime)
+    for path in venvs[:-keep]:
+        if path != active_venv:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def ensure(bucket, requirements_path, venvs_dir=VENVS_DIR, python=PYTHON):
+    req_hash = requirements_hash(requirements_path, python)
+    venv_dir = os.path.join(venvs_dir, req_hash)
+    os.makedirs(venvs_dir, exist_ok=True)
+
+    if os.path.isfile(os.path.join(venv_dir, COMPLETE_MARKER)):
+        print(f"Requirements unchanged, reusing virtualenv {req_hash}")
+    else:
+        with phase("python_env.wheelhouse"):
+            wheel_dir = fetch_wheelhouse(bucket, requirements_path, req_hash, python)
+        print(f"Creating virtualenv {req_hash} from the wheelhouse")
+        with phase("python_env.pip_install"):
+            create_venv(venv_dir, requirements_path, wheel_dir, python)
+
+    os.utime(venv_dir)  # Marks it as recently used for pruning
+    activate(venvs_dir, venv_dir)
+    prune_venvs(venvs_dir, venv_dir)
+    return venv_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["ensure", "build"])
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--requirements", required=True)
+    parser.add_argument("--venvs-dir", default=VENVS_DIR)
+    parser.add_argument("--python", default=PYTHON)
+    args = parser.parse_args(argv)
+
+    if args.command == "ensure":
+        ensure(args.bucket, args.requirements, args.venvs_dir, args.python)
+    else:
+        fetch_wheelhouse(args.bucket, args.requirements, requirements_hash(args.requirements, args.python), args.python)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,63 +1,80 @@
 import boto3
 import os
-import time
+
+import instance_steps
+import ssm_runner
 
 ec2_client = boto3.client('ec2')
 ssm_client = boto3.client('ssm')
 route53_client = boto3.client('route53')
 
-S3_BUCKET = "simpletrader-working-bucket-ajith"
+S3_BUCKET = os.environ.get("BUCKET_NAME", "simpletrader-working-bucket-ajith")
 S3_KEY = "repo_analytics.zip"
-TARGET_DIR = "/home/ec2-user"
+# On the gp3 data volume, survives stop/start so unchanged code and requirements cost nothing
+APP_DIR = "/mnt/data/analytics"
+RELEASES_TO_KEEP = 2
+
+# Gunicorn runs 2 x vCPUs + 1 workers, but never more than the memory allows at this much per worker
+GUNICORN_MB_PER_WORKER = 1024
+GUNICORN_THREADS = 2
+GUNICORN_TIMEOUT_SECONDS = 300  # Long backtests must not be killed by the 30s default
+
+# Nginx cache for the GET backtest endpoints, emptied whenever a new release is switched to
+NGINX_CACHE_DIR = "/mnt/data/nginx_cache"
+NGINX_CACHE_MAX_SIZE = "2g"
+NGINX_CACHE_TTL = "12h"
 DOMAIN_NAME = "simple-trader-analytics.click"
 TAG_KEY = "Project"
 TAG_VALUE = "SimpleTraderAnalytics"
 
-# 1. Start EC2
-def start_ec2(instance_id):
-    status = ec2_client.describe_instance_status(InstanceIds=[instance_id])
-    if not status['InstanceStatuses'] or status['InstanceStatuses'][0]['InstanceState']['Name'] != 'running':
-        ec2_client.start_instances(InstanceIds=[instance_id])
-        ec2_client.get_waiter('instance_status_ok').wait(InstanceIds=[instance_id])
-
-# 2. Create Elastic IP if required
+# 1. Reuse the project's Elastic IP, allocated once and kept across stops
 def associate_eip(instance_id):
-    existing_eip = None
-    for eip in ec2_client.describe_addresses()['Addresses']:
-        tags = {tag['Key']: tag['Value'] for tag in eip.get('Tags', [])}
-        if tags.get(TAG_KEY) == TAG_VALUE:
-            existing_eip = eip
-            break
-
-    # Don't create if one is present already
-    if existing_eip:
+    addresses = ec2_client.describe_addresses(
+        Filters=[{'Name': f'tag:{TAG_KEY}', 'Values': [TAG_VALUE]}]
+    )['Addresses']
+
+    if addresses:
+        existing_eip = addresses[0]
         allocation_id = existing_eip['AllocationId']
         public_ip = existing_eip['PublicIp']
+        # A VPC address stays associated while the instance is stopped
+        if existing_eip.get('InstanceId') == instance_id:
+            print(f"EIP {public_ip} is already associated with {instance_id}")
+            return public_ip
         print(f"Reusing EIP: {public_ip}")
     else:
         # Allocate and tag new EIP
-        eip_response = ec2_client.allocate_address(Domain='vpc')
+        eip_response = ec2_client.allocate_address(Domain='vpc', TagSpecifications=[{
+            'ResourceType': 'elastic-ip',
+            'Tags': [
+                {'Key': TAG_KEY, 'Value': TAG_VALUE},
+                {'Key': 'CreatedBy', 'Value': 'Lambda'}
+            ]
+        }])
         allocation_id = eip_response['AllocationId']
         public_ip = eip_response['PublicIp']
-
-        ec2_client.create_tags(Resources=[allocation_id], Tags=[
-            {'Key': TAG_KEY, 'Value': TAG_VALUE},
-            {'Key': 'CreatedBy', 'Value': 'Lambda'}
-        ])
         print(f"Allocated new EIP: {public_ip}")
 
     # Associate EIP to instance
     ec2_client.associate_address(InstanceId=instance_id, AllocationId=allocation_id)
     return public_ip
 
-# 3. Update Route 53 record with Elastic IP
+# 2. Point the Route 53 record at the Elastic IP, only when it changed
 def update_route53(public_ip):
-    # Update Route 53 A record
-    hosted_zone = route53_client.list_hosted_zones_by_name(DNSName=DOMAIN_NAME)
-    if not hosted_zone['HostedZones']:
+    hosted_zone = route53_client.list_hosted_zones_by_name(DNSName=DOMAIN_NAME, MaxItems='1')
+    if not hosted_zone['HostedZones'] or hosted_zone['HostedZones'][0]['Name'] != DOMAIN_NAME + '.':
         raise Exception(f"No hosted zone found for {DOMAIN_NAME}")
     hosted_zone_id = hosted_zone['HostedZones'][0]['Id'].split('/')[-1]
 
+    records = route53_client.list_resource_record_sets(
+        HostedZoneId=hosted_zone_id, StartRecordName=DOMAIN_NAME, StartRecordType='A', MaxItems='1'
+    )['ResourceRecordSets']
+    current_ips = [record['Value'] for record in records[0].get('ResourceRecords', [])] \
+        if records and records[0]['Name'] == DOMAIN_NAME + '.' and records[0]['Type'] == 'A' else []
+    if current_ips == [public_ip]:
+        print(f"{DOMAIN_NAME} already points at {public_ip}")
+        return {"dns_changed": False}
+
     route53_client.change_resource_record_sets(
         HostedZoneId=hosted_zone_id,
         ChangeBatch={
@@ -73,86 +90,156 @@ def update_route53(public_ip):
             }]
         }
     )
+    print(f"Pointed {DOMAIN_NAME} at {public_ip}, was {current_ips}")
+    return {"dns_changed": True}
 
 
-# 4. Bootstrap flask app via SSM
+# 3. Bootstrap flask app via SSM
 def create_flask_app(instance_id):
-    command = f"""#!/bin/bash
-cd {TARGET_DIR}
-rm -rf {TARGET_DIR}/analytics
-mkdir -p analytics
-cd analytics
-aws s3 cp s3://{S3_BUCKET}/{S3_KEY} .
-unzip -o repo_analytics.zip
-python3 -m venv venv
-source venv/bin/activate
-pip install --upgrade pip
-pip install -r requirements.txt
-pip install gunicorn flask
+    steps = [
+        # Unpacks repo_analytics.zip into releases/<etag> only when the object changed, current points at it
+        ("download", [f"""
+mkdir -p {APP_DIR}/releases {APP_DIR}/venvs
+ETAG=$(aws s3api head-object --bucket {S3_BUCKET} --key {S3_KEY} --query ETag --output text | tr -d '"')
+RELEASE={APP_DIR}/releases/$ETAG
+if [ "$(readlink -f {APP_DIR}/current)" != "$RELEASE" ]; then
+    rm -rf $RELEASE.tmp && mkdir -p $RELEASE.tmp
+    aws s3 cp s3://{S3_BUCKET}/{S3_KEY} $RELEASE.tmp/{S3_KEY} --only-show-errors
+    unzip -oq $RELEASE.tmp/{S3_KEY} -d $RELEASE.tmp && rm -f $RELEASE.tmp/{S3_KEY}
+    rm -rf $RELEASE && mv $RELEASE.tmp $RELEASE
+    ln -sfn $RELEASE {APP_DIR}/current.tmp && mv -Tf {APP_DIR}/current.tmp {APP_DIR}/current
+    sudo rm -rf {NGINX_CACHE_DIR}/*
+    echo "Switched to release $ETAG"
+else
+    echo "Release $ETAG is current"
+fi
+ls -1dt {APP_DIR}/releases/*/ | tail -n +{RELEASES_TO_KEEP + 1} | xargs -r rm -rf
+"""]),
+        # Virtualenv keyed by the requirements and interpreter, only built when that key is new
+        ("dependencies", [f"""
+REQ_HASH=$( (cat {APP_DIR}/current/requirements.txt; echo gunicorn flask; python3 --version; uname -m) | sha256sum | cut -c1-16)
+VENV={APP_DIR}/venvs/$REQ_HASH
+if [ ! -f $VENV/.complete ]; then
+    rm -rf $VENV
+    python3 -m venv $VENV
+    $VENV/bin/pip install --quiet --upgrade pip
+    $VENV/bin/pip install --quiet -r {APP_DIR}/current/requirements.txt gunicorn flask
+    touch $VENV/.complete
+    echo "Built virtualenv $REQ_HASH"
+else
+    echo "Virtualenv $REQ_HASH is current"
+fi
+ln -sfn $VENV {APP_DIR}/venv.tmp && mv -Tf {APP_DIR}/venv.tmp {APP_DIR}/venv
+ls -1dt {APP_DIR}/venvs/*/ | {{ grep -v "/$REQ_HASH/$" || true; }} | tail -n +{RELEASES_TO_KEEP} | xargs -r rm -rf
+sudo chown -R ec2-user:ec2-user {APP_DIR}
+"""]),
+        ("gunicorn", [f"""
+# Size the worker pool from the instance
+VCPUS=$(nproc)
+MEM_MB=$(awk '/MemTotal/ {{print int($2 / 1024)}}' /proc/meminfo)
+WORKERS=$(( VCPUS * 2 + 1 ))
+MAX_WORKERS=$(( MEM_MB / {GUNICORN_MB_PER_WORKER} ))
+[ $WORKERS -gt $MAX_WORKERS ] && WORKERS=$MAX_WORKERS
+[ $WORKERS -lt 2 ] && WORKERS=2
+echo "Starting gunicorn with $WORKERS workers x {GUNICORN_THREADS} threads ($VCPUS vCPUs, $MEM_MB MB)"
 
 # Start Gunicorn
-nohup gunicorn --bind 127.0.0.1:8000 app:app --access-logfile /mnt/data/analytics_logs/access.log --error-logfile /mnt/data/analytics_logs/error.log --log-level info > /mnt/data/analytics_logs/gunicorn.log 2>&1 &
-
+cd {APP_DIR}/current
+nohup {APP_DIR}/venv/bin/gunicorn --bind 127.0.0.1:8000 app:app --workers $WORKERS --threads {GUNICORN_THREADS} --timeout {GUNICORN_TIMEOUT_SECONDS} --max-requests 500 --max-requests-jitter 50 --access-logfile /mnt/data/analytics_logs/access.log --error-logfile /mnt/data/analytics_logs/error.log --log-level info > /mnt/data/analytics_logs/gunicorn.log 2>&1 &
+"""]),
+        ("nginx", [f"""
+sudo mkdir -p {NGINX_CACHE_DIR}
+sudo chown nginx:nginx {NGINX_CACHE_DIR}
 sudo systemctl enable nginx
 sudo systemctl start nginx
 
-# Configure NGINX
+# Configure NGINX, the warmup on this host calls through nginx without basic auth to fill the cache
 sudo tee /etc/nginx/conf.d/flaskapp.conf > /dev/null <<'EOF'
+# Only local requests may skip the cache, the warmup does to measure the backtests themselves
+map $remote_addr $local_cache_bypass {{
+    127.0.0.1 $http_x_cache_bypass;
+    default   "";
+}}
+
+proxy_cache_path {NGINX_CACHE_DIR} levels=1:2 keys_zone=backtest:10m max_size={NGINX_CACHE_MAX_SIZE} inactive=7d use_temp_path=off;
+log_format cache '$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent '
+                 '"$http_user_agent" rt=$request_time cache=$upstream_cache_status';
+
 server {{
     listen 80;
     server_name _;
+    access_log /var/log/nginx/access.log cache;
 
-    location / {{
-        auth_basic "Restricted Access";
-        auth_basic_user_file /etc/nginx/.htpasswd;
+    satisfy any;
+    allow 127.0.0.1;
+    deny all;
+    auth_basic "Restricted Access";
+    auth_basic_user_file /etc/nginx/.htpasswd;
+
+    proxy_set_header Host $host;
+    proxy_set_header X-Real-IP $remote_addr;
+    proxy_read_timeout {GUNICORN_TIMEOUT_SECONDS}s;
+
+    if ($http_user_agent ~* (googlebot|bingbot|slurp|duckduckbot|baiduspider|yandex)) {{
+        return 403;
+    }}
 
+    location / {{
         proxy_pass http://127.0.0.1:8000;
-        proxy_set_header Host $host;
-        proxy_set_header X-Real-IP $remote_addr;
+    }}
 
-        if ($http_user_agent ~* (googlebot|bingbot|slurp|duckduckbot|baiduspider|yandex)) {{
-            return 403;
-        }}
+    # Backtests are pure functions of the URL for a given release. The key leaves out the host, users
+    # and the local warmup reach nginx under different names
+    location /backtest/ {{
+        proxy_pass http://127.0.0.1:8000;
+        proxy_cache backtest;
+        proxy_cache_methods GET HEAD;
+        proxy_cache_key "$request_method$request_uri";
+        proxy_cache_valid 200 {NGINX_CACHE_TTL};
+        proxy_cache_lock on;
+        proxy_cache_lock_timeout {GUNICORN_TIMEOUT_SECONDS}s;
+        proxy_cache_use_stale error timeout updating;
+        # Answered by gunicorn, the response still replaces the cached one
+        proxy_cache_bypass $local_cache_bypass;
+        add_header X-Cache-Status $upstream_cache_status always;
     }}
 }}
 EOF
 
-sudo nginx -t && sudo systemctl reload nginx
-
-# Warmup call - important
-curl -s -o /dev/null -w "%{{http_code}}" "http://127.0.0.1:8000/backtest/gaps/trading_gaps_leg2/run_test?from_date=2024-12-01&to_date=2024-12-31&stop_loss=5&take_profit=3&entry_time=09%3A17&trade_direction=ALL&initial_capital=100000" | grep -q '^2' && echo "Primer Succeeded" || echo "Primer failed"
-    """
-
-    output = ssm_client.send_command(
-        InstanceIds=[instance_id],
-        DocumentName="AWS-RunShellScript",
-        Parameters={'commands': [command]},
-    )
-
-    return output
-
-# Main method
+# Restart rather than reload, so the cache index is rebuilt from whatever is left on disk
+sudo nginx -t && sudo systemctl restart nginx
+"""]),
+        # Calls the endpoints in the warmup manifest and writes a latency report to the bucket,
+        # a warmup_manifest.json shipped in repo_analytics.zip takes precedence over the default one
+        ("warmup", [f"""
+mkdir -p {APP_DIR}/bin
+aws s3 sync s3://{S3_BUCKET}/host_scripts/analytics/ {APP_DIR}/bin/ --only-show-errors
+MANIFEST={APP_DIR}/bin/warmup_manifest.json
+[ -f {APP_DIR}/current/warmup_manifest.json ] && MANIFEST={APP_DIR}/current/warmup_manifest.json
+python3 {APP_DIR}/bin/warmup.py --manifest $MANIFEST --base-url http://127.0.0.1 --bucket {S3_BUCKET} --release $(basename $(readlink -f {APP_DIR}/current)) || echo "Warmup failed"
+"""]),
+    ]
+
+    return ssm_runner.send(instance_id, steps, deadline_seconds=1200, ssm_client=ssm_client)
+
+# 4. Check gunicorn answers at all, nginx sits behind basic auth
+def send_verify(instance_id):
+    command = 'curl -s -o /dev/null -w "%{http_code}" http://127.0.0.1:8000/ | grep -qv "^000" && echo "Website is up"'
+    return ssm_runner.send(instance_id, [("verify", [command])], deadline_seconds=60, ssm_client=ssm_client)
+
+
+STEPS = {
+    "start_instance": lambda state: instance_steps.start_instance(os.environ['INSTANCE_ID'], ec2_client),
+    "describe_instance": lambda state: instance_steps.describe_instance(os.environ['INSTANCE_ID'], ec2_client),
+    "check_agent": lambda state: instance_steps.check_agent(os.environ['INSTANCE_ID'], ssm_client),
+    "associate_eip": lambda state: {"public_ip": associate_eip(os.environ['INSTANCE_ID'])},
+    "update_route53": lambda state: update_route53(state["public_ip"]),
+    "send_bootstrap": lambda state: create_flask_app(os.environ['INSTANCE_ID']),
+    "send_verify": lambda state: send_verify(os.environ['INSTANCE_ID']),
+    "poll_command": lambda state: ssm_runner.poll(os.environ['INSTANCE_ID'], state, ssm_client),
+}
+
+
+# Invoked once per state of the website start state machine, see simple_trader_cdk/instance_workflow.py
 def handler(event, context):
-    INSTANCE_ID = os.environ['INSTANCE_ID']
-
-    start_ec2(INSTANCE_ID)
-    public_ip = associate_eip(INSTANCE_ID)
-    update_route53(public_ip)
-    response = create_flask_app(INSTANCE_ID)
-
-    command_id = response['Command']['CommandId']
-    output = None
-
-    # Poll until the command finishes
-    while (output is None or output.get('Status') in ['Pending', 'InProgress']):
-        time.sleep(2)
-        output = ssm_client.get_command_invocation(
-            CommandId=command_id,
-            InstanceId=INSTANCE_ID,
-        )
-
-    print("Command status:", output['Status'])
-    print("Standard output:\n", output.get('StandardOutputContent', ''))
-    print("Standard error:\n", output.get('StandardErrorContent', ''))
-
-    return {"status": "Success", "details": f"Started EC2, EIP: {public_ip}, A record updated."}
+    return instance_steps.run_step(STEPS, event)
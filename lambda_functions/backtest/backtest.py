@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import uuid
+import zipfile
+from datetime import datetime, timezone
+
+import boto3
+
+import fanout
+import instance_steps
+
+s3_client = boto3.client('s3')
+
+BACKTEST_PREFIX = "backtests"
+# The analytics code the website runs, unpacked once per ETag and kept while the Lambda stays warm
+CODE_ROOT = "/tmp/analytics"
+
+
+def job_key(job_id, name):
+    return f"{BACKTEST_PREFIX}/{job_id}/{name}"
+
+
+def put_json(document, key):
+    s3_client.put_object(Bucket=os.environ['BUCKET_NAME'], Key=key, Body=json.dumps(document).encode('utf-8'))
+
+
+def get_json(key):
+    return json.loads(s3_client.get_object(Bucket=os.environ['BUCKET_NAME'], Key=key)['Body'].read())
+
+
+def ensure_code(etag):
+    """Unpacks the release of repo_analytics.zip the job was planned with and puts it on sys.path in place
+    of the release a previous job on this worker used"""
+    code_dir = os.path.join(CODE_ROOT, etag)
+    if not os.path.isdir(code_dir):
+        shutil.rmtree(CODE_ROOT, ignore_errors=True)  # An older release from a previous job
+        os.makedirs(CODE_ROOT)
+        archive = os.path.join(CODE_ROOT, "code.zip")
+        response = s3_client.get_object(Bucket=os.environ['BUCKET_NAME'], Key=os.environ['CODE_KEY'], IfMatch=f'"{etag}"')
+        with open(archive, "wb") as f:
+            shutil.copyfileobj(response['Body'], f)
+        with zipfile.ZipFile(archive) as zip_file:
+            zip_file.extractall(code_dir + ".tmp")
+        os.remove(archive)
+        os.rename(code_dir + ".tmp", code_dir)
+        print(f"Unpacked {os.environ['CODE_KEY']} {etag}")
+    fanout.add_code_dir(code_dir)
+
+
+def plan(state):
+    job = {key: value for key, value in state.items() if key != "job_id"}
+    job_id = state.get("job_id") or f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+    chunks = fanout.plan(job)
+    # Every chunk runs the same release, even if a new one is uploaded while the job runs
+    code_etag = s3_client.head_object(Bucket=os.environ['BUCKET_NAME'], Key=os.environ['CODE_KEY'])['ETag'].strip('"')
+    put_json({**job, "code_etag": code_etag}, job_key(job_id, "job.json"))
+    print(f"Job {job_id}: {len(chunks)} chunks on release {code_etag}")
+    # The Map state hands every chunk its own worker, only the indexes travel through the state machine
+    return {"job_id": job_id, "code_etag": code_etag, "chunks": [{"index": chunk["index"]} for chunk in chunks]}
+
+
+def run_chunk(state):
+    job = get_json(job_key(state["job_id"], "job.json"))
+    ensure_code(job["code_etag"])
+    chunk = fanout.plan(job)[state["index"]]
+    part = fanout.run_chunk(job, chunk)
+    put_json(part, job_key(state["job_id"], f"parts/{chunk['index']:05d}.json"))
+    print(f"Chunk {chunk['index']} {chunk['params']} took {part['seconds']}s")
+    return {"seconds": part["seconds"]}
+
+
+def reduce(state):
+    job = get_json(job_key(state["job_id"], "job.json"))
+    if job.get("reducer"):
+        ensure_code(job["code_etag"])
+    chunks = fanout.plan(job)
+    parts = [get_json(job_key(state["job_id"], f"parts/{chunk['index']:05d}.json")) for chunk in chunks]
+    report = {"job_id": state["job_id"], **fanout.reduce(job, chunks, parts)}
+    put_json(report, job_key(state["job_id"], "report.json"))
+    print(f"Report of {len(chunks)} chunks, slowest {report['slowest_chunk_seconds']}s")
+    return {"job_id": state["job_id"], "report_key": job_key(state["job_id"], "report.json"),
+            "slowest_chunk_seconds": report["slowest_chunk_seconds"]}
+
+
+STEPS = {
+    "plan": plan,
+    "run_chunk": run_chunk,
+    "reduce": reduce,
+}
+
+
+# Invoked by the backtest state machine, run_chunk once per chunk inside its Map state
+def handler(event, context):
+    return instance_steps.run_step(STEPS, event)
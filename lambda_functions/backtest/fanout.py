@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Fan-out backtest engine: split a job into chunks, run them independently, reduce the results.
+
+A job names a backtest function of the analytics code and the range to run it over:
+
+    {"callable": "trading_gaps_leg2.backtest:run_test",      module:function in repo_analytics.zip
+     "from_date": "2021-01-01", "to_date": "2024-12-31",
+     "chunk_days": 90,                                        date range split into chunks of this size
+     "grid": {"stop_loss": [0.5, 1.0], "take_profit": [1, 2]},  optional, crossed with every chunk
+     "params": {"entry_time": "09:17"},                       passed to every call
+     "reducer": "trading_gaps_leg2.backtest:merge_results"}    optional, see reduce()
+
+The function is called as function(from_date=..., to_date=..., **params, **grid value) and returns a
+dict (or a DataFrame, turned into {"rows": [...]}). The Lambda workers (backtest.py) run one chunk
+each under a Step Functions Map, locally the same chunks run on a process pool:
+
+    fanout.py run --job job.json --code-dir /mnt/data/analytics/current [--workers N] [--output report.json]
+"""
+import argparse
+import importlib
+import itertools
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+DEFAULT_CHUNK_DAYS = 90
+MAX_CHUNKS = 1000  # Keeps the chunk list well inside the 256 KB Step Functions payload
+
+
+def date_chunks(from_date, to_date, chunk_days=DEFAULT_CHUNK_DAYS):
+    """[(from, to)] covering from_date..to_date inclusive, chunk_days long except for the last"""
+    start, end = date.fromisoformat(from_date), date.fromisoformat(to_date)
+    if end < start:
+        raise ValueError(f"to_date {to_date} is before from_date {from_date}")
+    chunks = []
+    while start <= end:
+        chunk_end = min(start + timedelta(days=chunk_days - 1), end)
+        chunks.append((start.isoformat(), chunk_end.isoformat()))
+        start = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def grid_values(grid):
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())] if grid else [{}]
+
+
+def plan(job):
+    """Every (grid value, date chunk) pair of the job, in the order the report lists them"""
+    chunks = []
+    for combo in grid_values(job.get("grid")):
+        for from_date, to_date in date_chunks(job["from_date"], job["to_date"], job.get("chunk_days", DEFAULT_CHUNK_DAYS)):
+            chunks.append({
+                "index": len(chunks),
+                "combo": combo,
+                "params": {**job.get("params", {}), **combo, "from_date": from_date, "to_date": to_date},
+            })
+    if len(chunks) > MAX_CHUNKS:
+        raise ValueError(f"{len(chunks)} chunks, at most {MAX_CHUNKS}: raise chunk_days or shrink the grid")
+    return chunks
+
+
+def load_callable(path):
+    module_name, _, function_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def to_result(value):
+    """JSON friendly chunk result, DataFrames become their rows"""
+    if hasattr(value, "to_dict") and hasattr(value, "columns"):
+        return {"rows": json.loads(value.to_json(orient="records", date_format="iso"))}
+    return json.loads(json.dumps(value, default=str))
+
+
+def run_chunk(job, chunk):
+    started = time.monotonic()
+    result = to_result(load_callable(job["callable"])(**chunk["params"]))
+    return {"index": chunk["index"], "seconds": round(time.monotonic() - started, 3), "result": result}
+
+
+def merge(results):
+    """Default reducer: numbers are summed, lists concatenated in date order, anything else kept per chunk"""
+    merged = {}
+    for result in results:
+        for key, value in result.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float, list)):
+                merged.setdefault("per_chunk", {}).setdefault(key, []).append(value)
+            elif isinstance(value, list):
+                merged[key] = merged.get(key, []) + value
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def reduce(job, chunks, parts):
+    """One entry per grid value, its chunk results merged by the job's reducer or merge()"""
+    reducer = load_callable(job["reducer"]) if job.get("reducer") else None
+    by_index = {part["index"]: part for part in parts}
+    results = []
+    for combo, combo_chunks in itertools.groupby(chunks, key=lambda chunk: json.dumps(chunk["combo"], sort_keys=True)):
+        combo_parts = [by_index[chunk["index"]] for chunk in combo_chunks]
+        chunk_results = [part["result"] for part in combo_parts]
+        results.append({
+            "params": json.loads(combo),
+            "result": reducer(json.loads(combo), chunk_results) if reducer else merge(chunk_results),
+        })
+    seconds = [part["seconds"] for part in parts]
+    return {
+        "callable": job["callable"],
+        "from_date": job["from_date"],
+        "to_date": job["to_date"],
+        "chunks": len(chunks),
+        "slowest_chunk_seconds": max(seconds) if seconds else 0,
+        "total_chunk_seconds": round(sum(seconds), 3),
+        "results": results,
+    }
+
+
+# The code dir added last, a warm Lambda worker moves on to a new one when the release changes
+current_code_dir = None
+
+
+def add_code_dir(code_dir):
+    """Puts code_dir first on sys.path. Another code dir added before is taken off together with the
+    modules imported from it, so the job's callable is imported from code_dir and not the old release"""
+    global current_code_dir
+    if current_code_dir is not None and current_code_dir != code_dir:
+        drop_code_dir(current_code_dir)
+    if code_dir not in sys.path:
+        sys.path.insert(0, code_dir)
+    current_code_dir = code_dir
+
+
+def drop_code_dir(code_dir):
+    prefix = os.path.join(os.path.abspath(code_dir), "")
+    while code_dir in sys.path:
+        sys.path.remove(code_dir)
+    for name, module in list(sys.modules.items()):
+        # Namespace packages have no __file__, only a __path__
+        files = [getattr(module, "__file__", None)] + list(getattr(module, "__path__", None) or [])
+        if any(file and os.path.abspath(file).startswith(prefix) for file in files):
+            del sys.modules[name]
+    importlib.invalidate_caches()
+
+
+def run_local(job, code_dir, workers=None):
+    """The whole job on a process pool, workers defaults to the number of CPUs"""
+    add_code_dir(code_dir)
+    chunks = plan(job)
+    workers = workers or os.cpu_count()
+    print(f"Running {len(chunks)} chunks on {workers} processes")
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers, initializer=add_code_dir, initargs=(code_dir,)) as pool:
+        parts = list(pool.map(run_chunk, itertools.repeat(job), chunks))
+    report = reduce(job, chunks, parts)
+    report["wall_seconds"] = round(time.monotonic() - started, 3)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["run", "plan"])
+    parser.add_argument("--job", required=True, help="Job JSON file")
+    parser.add_argument("--code-dir", default=".", help="Directory the job's callable is imported from")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--output", help="Write the report here instead of printing it")
+    args = parser.parse_args(argv)
+
+    with open(args.job) as f:
+        job = json.load(f)
+
+    if args.command == "plan":
+        chunks = plan(job)
+        print(json.dumps(chunks, indent=2))
+        print(f"{len(chunks)} chunks, about {math.ceil(len(chunks) / (args.workers or os.cpu_count()))} rounds locally")
+        return 0
+
+    report = run_local(job, os.path.abspath(args.code_dir), args.workers)
+    document = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(document)
+        print(f"{report['chunks']} chunks in {report['wall_seconds']}s, slowest {report['slowest_chunk_seconds']}s")
+    else:
+        print(document)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
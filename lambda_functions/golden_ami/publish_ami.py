@@ -0,0 +1,30 @@
+import json
+import os
+import boto3
+
+ssm_client = boto3.client('ssm')
+
+
+def handler(event, context):
+    parameter_name = os.environ['AMI_PARAMETER']
+
+    for record in event['Records']:
+        message = json.loads(record['Sns']['Message'])
+        status = message.get('state', {}).get('status')
+        print(f"Image {message.get('arn')} finished with status {status}")
+
+        # Only successful builds are published, a failed build keeps the previous image
+        if status != 'AVAILABLE':
+            continue
+
+        for ami in message.get('outputResources', {}).get('amis', []):
+            print(f"Publishing {ami['image']} to {parameter_name}")
+            ssm_client.put_parameter(
+                Name=parameter_name,
+                Value=ami['image'],
+                Type='String',
+                DataType='aws:ec2:image',
+                Overwrite=True,
+            )
+
+    return {"status": "Success"}
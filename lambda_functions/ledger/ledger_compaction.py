@@ -0,0 +1,89 @@
+import json
+import os
+from datetime import datetime, timezone
+
+import awswrangler as wr
+import boto3
+import pandas as pd
+
+from ledger_parquet import COMPRESSION, read_ledger
+
+s3_client = boto3.client('s3')
+
+# Which fragments (by ETag) went into which monthly file, makes reruns a no-op
+MANIFEST_KEY = "_manifest.json"
+
+# A row is identified by its symbol and entry time, a fragment uploaded again replaces its rows
+DEDUPE_COLUMNS = ["symbol", "entry_time"]
+
+
+def read_manifest(bucket_name, compacted_prefix):
+    try:
+        body = s3_client.get_object(Bucket=bucket_name, Key=compacted_prefix + MANIFEST_KEY)['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        return {"months": {}, "fragments": {}}
+    return json.loads(body)
+
+
+def write_manifest(bucket_name, compacted_prefix, manifest):
+    s3_client.put_object(Bucket=bucket_name, Key=compacted_prefix + MANIFEST_KEY,
+                         Body=json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def new_fragments(bucket_name, ledger_prefix, manifest):
+    """Fragments that are not compacted yet or changed since, oldest first so newer rows win"""
+    fragments = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=ledger_prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.csv') and manifest["fragments"].get(obj['Key']) != obj['ETag']:
+                fragments.append(obj)
+    return sorted(fragments, key=lambda obj: obj['LastModified'])
+
+
+def month_key(compacted_prefix, month):
+    return f"{compacted_prefix}{month}.parquet"
+
+
+def merge_month(existing, rows):
+    merged = pd.concat([existing, rows], ignore_index=True) if existing is not None else rows
+    merged = merged.drop_duplicates(subset=DEDUPE_COLUMNS, keep='last')
+    return merged.sort_values(DEDUPE_COLUMNS, kind='stable').reset_index(drop=True)
+
+
+def compact(bucket_name, ledger_prefix, compacted_prefix):
+    manifest = read_manifest(bucket_name, compacted_prefix)
+    fragments = new_fragments(bucket_name, ledger_prefix, manifest)
+    print(f"{len(fragments)} ledger fragments to compact")
+    if not fragments:
+        return {"fragments": 0, "months": []}
+
+    frames = [read_ledger(bucket_name, obj['Key']) for obj in fragments]
+    rows = pd.concat(frames, ignore_index=True)
+    rows = rows[rows['entry_time'].notna()]
+
+    months = []
+    for month, month_rows in rows.groupby(rows['entry_time'].dt.strftime('%Y-%m')):
+        path = f"s3://{bucket_name}/{month_key(compacted_prefix, month)}"
+        existing = wr.s3.read_parquet(path) if month in manifest["months"] else None
+        merged = merge_month(existing, month_rows)
+        wr.s3.to_parquet(merged, path, index=False, compression=COMPRESSION)
+        manifest["months"][month] = {
+            "key": month_key(compacted_prefix, month),
+            "rows": len(merged),
+            "compacted_at": datetime.now(timezone.utc).isoformat(),
+        }
+        months.append(month)
+        print(f"Compacted {len(month_rows)} rows into {month}, {len(merged)} rows in total")
+
+    # Only recorded once every month is written, a failed run is simply redone the next night
+    for obj in fragments:
+        manifest["fragments"][obj['Key']] = obj['ETag']
+    write_manifest(bucket_name, compacted_prefix, manifest)
+    return {"fragments": len(fragments), "months": months}
+
+
+# Invoked nightly by an EventBridge rule
+def handler(event, context):
+    result = compact(os.environ['BUCKET_NAME'], os.environ['LEDGER_PREFIX'], os.environ['COMPACTED_PREFIX'])
+    return {"status": "Success", **result}
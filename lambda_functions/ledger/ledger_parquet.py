@@ -0,0 +1,125 @@
+import json
+import os
+import re
+
+import awswrangler as wr
+import boto3
+import pandas as pd
+
+import instance_steps
+
+s3_client = boto3.client('s3')
+
+# Athena (engine v3) reads ZSTD Parquet, it compresses the ledger noticeably better than Snappy
+COMPRESSION = "zstd"
+
+# Keys of the converted CSV objects and their ETag, so unchanged uploads are not converted again
+STATE_KEY = "_converted.json"
+
+# Each instance of a trading fleet uploads its ledger under <ledger prefix>shard=<n>/
+SHARD_DIRECTORY = re.compile(r"/shard=\d+/")
+
+# Pandas dtype for each Glue type used by the ledger, nullable so empty exits survive the cast
+PANDAS_TYPES = {
+    "string": "string",
+    "double": "float64",
+    "int": "Int32",
+    "bigint": "Int64",
+    "boolean": "boolean",
+}
+
+# Set by the stack from simple_trader_cdk/ledger_schema.py, the same columns as the Glue table
+LEDGER_COLUMNS = json.loads(os.environ.get('LEDGER_COLUMNS', '[]'))
+TIMESTAMP_COLUMNS = [column["name"] for column in LEDGER_COLUMNS if column["type"] == "timestamp"]
+COLUMN_TYPES = {column["name"]: PANDAS_TYPES[column["type"]] for column in LEDGER_COLUMNS if column["type"] in PANDAS_TYPES}
+
+
+def read_state(bucket_name, parquet_prefix):
+    try:
+        body = s3_client.get_object(Bucket=bucket_name, Key=parquet_prefix + STATE_KEY)['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        return {}
+    return json.loads(body)
+
+
+def write_state(bucket_name, parquet_prefix, converted):
+    s3_client.put_object(Bucket=bucket_name, Key=parquet_prefix + STATE_KEY,
+                         Body=json.dumps(converted, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def merged_key(source_key):
+    """Where a shard's ledger file belongs once the fleet's shards are merged, <ledger>/shard=1/x.csv is <ledger>/x.csv"""
+    return SHARD_DIRECTORY.sub("/", source_key)
+
+
+def pending_sources(bucket_name, ledger_prefix, converted):
+    """{merged key: [(key, etag)]} of the CSV objects under the ledger prefix, the files of every shard
+    are listed once any of them is new or changed since it was last converted"""
+    sources = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=ledger_prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.csv'):
+                sources.setdefault(merged_key(obj['Key']), []).append((obj['Key'], obj['ETag']))
+    return {key: shards for key, shards in sources.items()
+            if any(converted.get(source_key) != etag for source_key, etag in shards)}
+
+
+def parquet_key(parquet_prefix, source_key, trade_date):
+    # One file per source CSV and day, converting the same source again overwrites it
+    stem = os.path.splitext(os.path.basename(source_key))[0]
+    return f"{parquet_prefix}trade_date={trade_date}/{stem}.parquet"
+
+
+def read_ledger(bucket_name, source_key):
+    frame = wr.s3.read_csv(f"s3://{bucket_name}/{source_key}")
+    for column in TIMESTAMP_COLUMNS:
+        frame[column] = pd.to_datetime(frame[column], errors='coerce')
+    return frame.astype({column: dtype for column, dtype in COLUMN_TYPES.items() if column in frame})
+
+
+def convert(bucket_name, source_key, parquet_prefix, shard_keys=None):
+    """Converts one ledger file, concatenated with the same file of the other shards when given"""
+    shard_keys = shard_keys or [source_key]
+    frame = pd.concat([read_ledger(bucket_name, key) for key in shard_keys], ignore_index=True)
+    undated = frame['entry_time'].isna()
+    if undated.any():
+        print(f"Skipping {int(undated.sum())} rows without entry_time in {source_key}")
+        frame = frame[~undated]
+
+    written = []
+    for trade_date, rows in frame.groupby(frame['entry_time'].dt.strftime('%Y-%m-%d')):
+        key = parquet_key(parquet_prefix, source_key, trade_date)
+        wr.s3.to_parquet(rows, f"s3://{bucket_name}/{key}", index=False, compression=COMPRESSION)
+        written.append(key)
+    print(f"Converted {source_key} from {len(shard_keys)} files into {len(written)} partitions")
+    return written
+
+
+def convert_ledger(state):
+    bucket_name = os.environ['BUCKET_NAME']
+    ledger_prefix = os.environ['LEDGER_PREFIX']
+    parquet_prefix = os.environ['PARQUET_PREFIX']
+
+    converted = read_state(bucket_name, parquet_prefix)
+    pending = pending_sources(bucket_name, ledger_prefix, converted)
+    print(f"{len(pending)} ledger files to convert")
+
+    written = 0
+    for source_key, shards in pending.items():
+        written += len(convert(bucket_name, source_key, parquet_prefix, [key for key, _ in shards]))
+        converted.update(shards)
+        # Saved after every file so a timeout does not redo the finished ones
+        write_state(bucket_name, parquet_prefix, converted)
+
+    return {"ledger_files_converted": len(pending), "ledger_partitions_written": written}
+
+
+STEPS = {
+    "convert_ledger": convert_ledger,
+}
+
+
+# Invoked by the stop state machine once the ledger is uploaded, see simple_trader_cdk/instance_workflow.py
+def handler(event, context):
+    return instance_steps.run_step(STEPS, event)
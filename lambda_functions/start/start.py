@@ -1,48 +1,12 @@
 from datetime import datetime, timedelta, timezone
 import os
-import boto3
 import time
+import boto3
 
-import pandas as pd
-
-def is_today_holiday():
-    bse_holidays  = [
-        pd.Timestamp("2024-01-26", tz="Asia/Kolkata"),  # Fri, Republic Day
-        pd.Timestamp("2024-03-08", tz="Asia/Kolkata"),  # Fri, Mahashivratri
-        pd.Timestamp("2024-03-25", tz="Asia/Kolkata"),  # Mon, Holi
-        pd.Timestamp("2024-03-29", tz="Asia/Kolkata"),  # Fri, Good Friday
-        pd.Timestamp("2024-04-11", tz="Asia/Kolkata"),  # Thu, Id-Ul-Fitr (Ramadan Eid)
-        pd.Timestamp("2024-04-17", tz="Asia/Kolkata"),  # Wed, Shri Ram Navmi
-        pd.Timestamp("2024-05-01", tz="Asia/Kolkata"),  # Wed, Maharashtra Din
-        pd.Timestamp("2024-06-17", tz="Asia/Kolkata"),  # Mon, Bakri Id / Eid ul-Adha
-        pd.Timestamp("2024-07-17", tz="Asia/Kolkata"),  # Wed, Moharram
-        pd.Timestamp("2024-08-15", tz="Asia/Kolkata"),  # Thu, Independence Day
-        pd.Timestamp("2024-10-02", tz="Asia/Kolkata"),  # Wed, Mahatma Gandhi Jayanti
-        pd.Timestamp("2024-11-01", tz="Asia/Kolkata"),  # Fri, Diwali
-        pd.Timestamp("2024-11-15", tz="Asia/Kolkata"),  # Fri, Guru Nanak's Birthday
-        pd.Timestamp("2024-11-20", tz="Asia/Kolkata"),  # Wed, Maharashtra election
-        pd.Timestamp("2024-12-25", tz="Asia/Kolkata"),  # Wed, Christmas
-        pd.Timestamp("2025-02-26", tz="Asia/Kolkata"),  # Wed, Mahashivratri
-        pd.Timestamp("2025-03-14", tz="Asia/Kolkata"),  # Fri, Holi
-        pd.Timestamp("2025-03-31", tz="Asia/Kolkata"),  # Mon, Id-Ul-Fitr (Ramadan Eid)
-        pd.Timestamp("2025-04-10", tz="Asia/Kolkata"),  # Thu, Shri Mahavir Jayanti
-        pd.Timestamp("2025-04-14", tz="Asia/Kolkata"),  # Mon, Dr. Baba Saheb Ambedkar Jayanti
-        pd.Timestamp("2025-04-18", tz="Asia/Kolkata"),  # Fri, Good Friday
-        pd.Timestamp("2025-05-01", tz="Asia/Kolkata"),  # Thu, Maharashtra Day
-        pd.Timestamp("2025-08-15", tz="Asia/Kolkata"),  # Fri, Independence Day
-        pd.Timestamp("2025-08-27", tz="Asia/Kolkata"),  # Wed, Ganesh Chaturthi
-        pd.Timestamp("2025-10-02", tz="Asia/Kolkata"),  # Thu, Mahatma Gandhi Jayanti/Dussehra
-        pd.Timestamp("2025-10-21", tz="Asia/Kolkata"),  # Tue, Diwali Laxmi Pujan*
-        pd.Timestamp("2025-10-22", tz="Asia/Kolkata"),  # Wed, Diwali-Balipratipada
-        pd.Timestamp("2025-11-05", tz="Asia/Kolkata"),  # Wed, Prakash Gurpurb Sri Guru Nanak Dev
-        pd.Timestamp("2025-12-25", tz="Asia/Kolkata"),  # Thu, Christmas
-    ]
-    
-    end_datetime = pd.Timestamp(datetime.now().date(), tz="Asia/Kolkata")
-    if end_datetime in bse_holidays:
-        return True
-
-    return False
+import instance_steps
+import phase_metrics
+import ssm_runner
+from market_calendar import IST, is_holiday
 
 
 def is_config_file_old(bucket_name, object_key):
@@ -72,99 +36,131 @@ def is_config_file_old(bucket_name, object_key):
         print(f"Error: {str(e)}")
         return None
 
-def handler(event, context):
-    instance_id = os.environ['INSTANCE_ID']
+def check_holiday(state):
     bucket_name = os.environ['BUCKET_NAME']
-    app_name = os.environ['APP_NAME']
     config_key = "config.py"
     # if is_config_file_old(bucket_name, config_key):
     #     print("Not starting ec2 machine because config is not updated recently.")
-    #     return {"status": "Success", "details": "Did not start ec2 machine because of no config updates in last 18 hours"}
+    #     return {"holiday": True}
 
-    if is_today_holiday():
+    if is_holiday():
         print("Not starting ec2 machine because today is a holiday")
-        return {"status": "Success", "details": "Did not start ec2 machine"}
-
-    ec2_client = boto3.client('ec2')
-
-    # Step 1: Check the current state of the instance and start if required
-    response = ec2_client.describe_instances(InstanceIds=[instance_id])
-    current_state = response['Reservations'][0]['Instances'][0]['State']['Name']
-    print(f"Current state of instance {instance_id}: {current_state}")
-
-    if current_state == 'running':
-        print(f"Instance {instance_id} is already running. Skipping start.")
-    else:
-        # Start the instance
-        print(f"Starting instance {instance_id}...")
-        ec2_client.start_instances(InstanceIds=[instance_id])
-
-        # Wait for the instance to enter the running state
-        print(f"Waiting for instance {instance_id} to be in 'running' state...")
-        waiter = ec2_client.get_waiter('instance_running')
-        waiter.wait(InstanceIds=[instance_id])
-        print(f"Instance {instance_id} is now running.")
-
-    # Step 2: Prep the host by setting up the directories
-    repo_key = "repo.zip"
-    requirements_key = "requirements.txt"
-    keysjson_key = "keys.json"
+        return {"holiday": True}
+    return {"holiday": False, "started_at": time.time()}
+
+
+def mark_ready(state):
+    """Records when the instance became ready to trade, alarmed on in the stack"""
+    now = datetime.now(IST)
+    ready_at_minute = now.hour * 60 + now.minute + now.second / 60
+    start_to_ready = time.time() - state.get("started_at", time.time())
+    print(f"Ready to trade at {now:%H:%M:%S} IST, {start_to_ready:.0f}s after the start")
+    phase_metrics.emit({"ReadyAtMinuteIST": round(ready_at_minute, 2)}, {"App": os.environ['APP_NAME']}, unit="None")
+    phase_metrics.emit({"StartToReady": round(start_to_ready, 1)}, {"App": os.environ['APP_NAME']})
+    return {"ready_at": now.isoformat(timespec="seconds")}
+
+
+def resume_steps():
+    return [
+        # After hibernation the clock is as old as the stop, step it before anything looks at the time
+        ("resume", [
+            "sudo chronyc -a makestep",
+            "chronyc waitsync 12 0.05",
+            "echo \"Booted at $(uptime -s)\"",
+        ]),
+    ]
+
+
+def bootstrap_steps(bucket_name, app_name, fleet, manifest_id=None, hibernate=False):
     wd_path = f"/home/ec2-user/projects/{app_name}"
-    repo_local_path = f"{wd_path}/repo.zip"
+    scripts_path = "/home/ec2-user/bin"
+    sync_args = f"--bucket {bucket_name} --app-dir {wd_path}"
+    if manifest_id:
+        # Pin the day's run to a specific manifest, e.g. to roll back a bad release
+        sync_args += f" --manifest {manifest_id}"
+
+    # Memory survives hibernation but code, config and keys may have changed since, so the sync still runs
+    return (resume_steps() if hibernate else []) + [
+        # Step 1: Refresh the host scripts, only changed files are copied
+        ("host_scripts", [
+            f"mkdir -p {scripts_path}",
+            f"aws s3 sync s3://{bucket_name}/host_scripts/trading/ {scripts_path}/ --only-show-errors",
+        ]),
+
+        # Step 2: Fetch changed artifacts and switch {wd_path} to a fresh, bytecode compiled release
+        ("artifact_sync", [
+            f"python3.9 {scripts_path}/artifact_sync.py sync {sync_args}",
+        ]),
+
+        # Step 3: Switch to the virtualenv for this requirements.txt, built from the wheelhouse only if it changed
+        ("python_env", [
+            f"python3.9 {scripts_path}/python_env.py ensure --bucket {bucket_name} --requirements {wd_path}/requirements.txt",
+        ]),
+
+        # Step 4: Load the historical context snapshot built last evening, pre_market_setup.py runs live without one
+        ("context_snapshot", [
+            f"python3.9 {scripts_path}/context_snapshot.py restore --bucket {bucket_name} --app-dir {wd_path}"
+            " || echo \"No context snapshot, pre_market_setup.py will run live\"",
+        ]),
+
+        # Step 5: This instance's shard of the symbol universe, from its position in the fleet
+        ("shard", [
+            f"python3.9 {scripts_path}/fleet_shard.py apply --bucket {bucket_name} --app-dir {wd_path} --fleet {','.join(fleet)}",
+        ]),
+
+        # Step 6: Pinned systemd timers for pre-market and trading, kernel and network tuning
+        ("host_profile", [
+            f"sudo bash {scripts_path}/host_profile/host_profile.sh {bucket_name}",
+        ]),
+
+        # Step 7: Restore permissions since we created new directories
+        ("permissions", [
+            "sudo chown -R ec2-user:ec2-user /home/ec2-user/",
+        ]),
+    ]
 
-    commands = [
-            # Step 1: Remove existing directory
-            f"rm -rf {wd_path}",
 
-            # Step 2: Download and unzip repo.zip
-            f"echo \"Copying repo {repo_key} from bucket {bucket_name} to {repo_local_path}\"",
-            f"aws s3 cp s3://{bucket_name}/{repo_key} {repo_local_path}",
-            f"mkdir -p {wd_path}",
-            f"unzip {repo_local_path} -d {wd_path}",
+def verify_steps(app_name, hibernate=False):
+    wd_path = f"/home/ec2-user/projects/{app_name}"
+    resumed = [
+        ("resumed", [
+            "[ \"$(date -d \"$(uptime -s)\" +%F)\" \\< \"$(date +%F)\" ] && echo \"Resumed from hibernation\" || echo \"Cold boot\"",
+            "chronyc tracking | grep -E 'Leap status +: Normal'",
+        ]),
+    ]
+    return (resumed if hibernate else []) + [
+        ("verify", [
+            f"test -L {wd_path} && test -f {wd_path}/src/config.py && test -f {wd_path}/keys.json"
+            " && /home/ec2-user/venvs/current/bin/python -c 'import sys; print(sys.version)'"
+            " && echo \"Ready to trade\"",
+        ]),
+    ]
 
-            # Step 3: Download config.py
-            f"echo \"Copying config.py from bucket {bucket_name} to {wd_path}/src/{config_key}\"",
-            f"aws s3 cp s3://{bucket_name}/{config_key} {wd_path}/src/{config_key}",
 
-            # Step 4: Download requirements.txt
-            f"echo \"Copying requirements.txt from bucket {bucket_name} to {wd_path}/{requirements_key}\"",
-            f"aws s3 cp s3://{bucket_name}/{requirements_key} {wd_path}/{requirements_key}",
+def send_bootstrap(state):
+    fleet = instance_steps.fleet_instance_ids()
+    steps = bootstrap_steps(os.environ['BUCKET_NAME'], os.environ['APP_NAME'], fleet, state.get("manifest_id"),
+                            hibernate=os.environ.get('HIBERNATE') == 'true')
+    return ssm_runner.send(fleet, steps, deadline_seconds=1200)
 
-            # Step 5: Download keys.json
-            f"echo \"Copying keys.json from bucket {bucket_name} to {wd_path}/{keysjson_key}\"",
-            f"aws s3 cp s3://{bucket_name}/{keysjson_key} {wd_path}/{keysjson_key}",
 
-            # Step 6: install dependencies
-            f"cd {wd_path}",
-            "python3.9 -m pip install -r requirements.txt",
+def send_verify(state):
+    steps = verify_steps(os.environ['APP_NAME'], hibernate=os.environ.get('HIBERNATE') == 'true')
+    return ssm_runner.send(instance_steps.fleet_instance_ids(), steps, deadline_seconds=60)
 
-            # Step 7: Restore permissions since we created new directories
-            "sudo chown -R ec2-user:ec2-user /home/ec2-user/",
-    ]
 
-    ssm_client = boto3.client('ssm')
+STEPS = {
+    "check_holiday": check_holiday,
+    "start_instance": lambda state: instance_steps.start_instance(instance_steps.fleet_instance_ids()),
+    "describe_instance": lambda state: instance_steps.describe_instance(instance_steps.fleet_instance_ids()),
+    "check_agent": lambda state: instance_steps.check_agent(instance_steps.fleet_instance_ids()),
+    "send_bootstrap": send_bootstrap,
+    "send_verify": send_verify,
+    "poll_command": lambda state: ssm_runner.poll(instance_steps.fleet_instance_ids(), state),
+    "mark_ready": mark_ready,
+}
 
-    try:
-        # Send commands as a shell script
-        response = ssm_client.send_command(
-            InstanceIds=[instance_id],
-            DocumentName="AWS-RunShellScript",  # Built-in SSM document for running shell scripts
-            Parameters={"commands": commands},
-        )
-        
-        # Get Command ID
-        command_id = response['Command']['CommandId']
-        print(f"Command sent: {command_id}")
-
-        # Optionally, wait for the command to complete
-        time.sleep(2)  # Small delay before checking status
-        output = ssm_client.get_command_invocation(
-            CommandId=command_id,
-            InstanceId=instance_id,
-        )
-        print(f"Command output: {output['StandardOutputContent']}")
-        
-        return {"status": "Success", "details": output}
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        return {"status": "Failed", "error": str(e)}
\ No newline at end of file
+
+# Invoked once per state of the start state machine, see simple_trader_cdk/instance_workflow.py
+def handler(event, context):
+    return instance_steps.run_step(STEPS, event)
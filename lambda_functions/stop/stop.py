@@ -1,61 +1,72 @@
 import os
-import boto3
-import time
 
-def handler(event, context):
-    upload_logs_to_s3()
-    
-    instance_id = os.environ['INSTANCE_ID']
-    ec2_client = boto3.client('ec2')
-    ec2_client.stop_instances(InstanceIds=[instance_id])
-
-    # Wait for the instance to enter the 'stopped' state
-    print(f"Waiting for instance {instance_id} to be in 'stopped' state...")
-    waiter = ec2_client.get_waiter('instance_stopped')
-    waiter.wait(InstanceIds=[instance_id])
-    print(f"Instance {instance_id} is now stopped.")
-
-    return {
-        'statusCode': 200,
-        'body': f"Instance {instance_id} has been stopped successfully."
-    }
-
-def upload_logs_to_s3():
-    instance_id = os.environ['INSTANCE_ID']
-    bucket_name = os.environ['BUCKET_NAME']
-    app_name = os.environ['APP_NAME']
-
-    commands = [
-        f"echo \"Uploading log file to S3\"",
-        f"CURRENT_DATE=$(date +%Y-%m-%d)",
-        f"cd /home/ec2-user/projects/{app_name}; export PYTHONPATH\=/home/ec2-user/projects/{app_name}/src && /usr/local/bin/python3.9 /home/ec2-user/projects/{app_name}/src/setup/closure_setup.py",
-        f"aws s3 cp /home/ec2-user/projects/{app_name}/trade_logs/$CURRENT_DATE/ s3://{bucket_name}/{app_name}Logs/$CURRENT_DATE/ --recursive",
-        f"aws s3 cp /home/ec2-user/projects/{app_name}/ledger/ s3://{bucket_name}/{app_name}Ledger/ --recursive",
+import instance_steps
+import ssm_runner
+from market_calendar import next_trading_day, today_ist
+
+
+def upload_steps(bucket_name, app_name):
+    return [
+        ("closure_setup", [
+            f"echo \"Uploading log file to S3\"",
+            f"CURRENT_DATE=$(date +%Y-%m-%d)",
+            # In a fleet every shard uploads under its own prefix, the ledger conversion merges them
+            "[ -f /etc/simpletrader/shard.env ] && . /etc/simpletrader/shard.env",
+            "SHARD_PREFIX=\"\"; [ \"${SIMPLETRADER_SHARD_COUNT:-1}\" -gt 1 ] && SHARD_PREFIX=\"shard=$SIMPLETRADER_SHARD/\"",
+            f"cd /home/ec2-user/projects/{app_name}; export PYTHONPATH\\=/home/ec2-user/projects/{app_name}/src && /home/ec2-user/venvs/current/bin/python /home/ec2-user/projects/{app_name}/src/setup/closure_setup.py",
+        ]),
+        # The log shipper streamed the day already, stopping it ships the last chunks. Should anything be
+        # left behind, one zstd archive of the day's logs is uploaded and verified instead.
+        ("upload_logs", [
+            "systemctl stop simpletrader-log-shipper.service || echo \"No log shipper running\"",
+            f"/usr/local/bin/python3.9 /home/ec2-user/bin/log_shipper.py check --app-dir /home/ec2-user/projects/{app_name} --app-name {app_name}"
+            f" || /home/ec2-user/venvs/current/bin/python /home/ec2-user/bin/eod_upload.py upload --bucket {bucket_name} --source /home/ec2-user/projects/{app_name}/trade_logs/$CURRENT_DATE --prefix {app_name}LogArchive/$CURRENT_DATE/$SHARD_PREFIX --name trade_logs-$CURRENT_DATE",
+        ]),
+        ("upload_ledger", [
+            # Only new or changed ledger files are uploaded
+            f"aws s3 sync /home/ec2-user/projects/{app_name}/ledger/ s3://{bucket_name}/{app_name}Ledger/$SHARD_PREFIX --only-show-errors",
+        ]),
     ]
 
-    ssm_client = boto3.client('ssm')
-
-    try:
-        # Send commands as a shell script
-        response = ssm_client.send_command(
-            InstanceIds=[instance_id],
-            DocumentName="AWS-RunShellScript",  # Built-in SSM document for running shell scripts
-            Parameters={"commands": commands},
-        )
-        
-        # Get Command ID
-        command_id = response['Command']['CommandId']
-        print(f"Command sent: {command_id}")
-
-        # Optionally, wait for the command to complete
-        time.sleep(2)  # Small delay before checking status
-        output = ssm_client.get_command_invocation(
-            CommandId=command_id,
-            InstanceId=instance_id,
-        )
-        print(f"Command output: {output['StandardOutputContent']}")
-        
-        return {"status": "Success", "details": output}
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        return {"status": "Failed", "error": str(e)}
\ No newline at end of file
+
+def snapshot_steps(bucket_name, app_name, session):
+    wd_path = f"/home/ec2-user/projects/{app_name}"
+    return [
+        # Prepare tomorrow's historical context now, so 08:55 only has to load it
+        ("context_snapshot", [
+            f"cd {wd_path}; /home/ec2-user/venvs/current/bin/python /home/ec2-user/bin/context_snapshot.py build --bucket {bucket_name} --app-dir {wd_path} --session {session}",
+        ]),
+        # Import time breakdown of setup.py's imports, only for a repo.zip version not profiled yet. Run in
+        # the evening, so the morning a new release lands does not wait for it.
+        ("import_profile", [
+            f"/usr/local/bin/python3.9 /home/ec2-user/bin/artifact_sync.py profile --bucket {bucket_name} --app-dir {wd_path}"
+            " --python /home/ec2-user/venvs/current/bin/python || echo \"Import profile failed\"",
+        ]),
+    ]
+
+
+def send_snapshot(state):
+    session = next_trading_day(today_ist()).isoformat()
+    steps = snapshot_steps(os.environ['BUCKET_NAME'], os.environ['APP_NAME'], session)
+    # The snapshot covers the whole universe and is restored by every shard, the first one builds it
+    return ssm_runner.send(instance_steps.fleet_instance_ids()[0], steps, deadline_seconds=900)
+
+
+def send_upload(state):
+    steps = upload_steps(os.environ['BUCKET_NAME'], os.environ['APP_NAME'])
+    return ssm_runner.send(instance_steps.fleet_instance_ids(), steps, deadline_seconds=900)
+
+
+STEPS = {
+    "send_snapshot": send_snapshot,
+    "send_upload": send_upload,
+    "poll_command": lambda state: ssm_runner.poll(instance_steps.fleet_instance_ids(), state),
+    "stop_instance": lambda state: instance_steps.stop_instance(instance_steps.fleet_instance_ids(),
+                                                                hibernate=os.environ.get('HIBERNATE') == 'true'),
+    "describe_instance": lambda state: instance_steps.describe_instance(instance_steps.fleet_instance_ids()),
+}
+
+
+# Invoked once per state of the stop state machine, see simple_trader_cdk/instance_workflow.py
+def handler(event, context):
+    return instance_steps.run_step(STEPS, event)
@@ -0,0 +1,96 @@
+"""Small, non-blocking EC2/SSM steps shared by the Step Functions driven Lambdas.
+
+Every step does one quick API call and returns the keys to merge into the state machine's state.
+Steps take one instance id or a list of them, a fleet is handled with the same batched calls.
+Waiting happens in the state machine, never inside the Lambda. SSM commands go through ssm_runner.
+"""
+import os
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+import phase_metrics
+
+
+def run_step(steps, event):
+    state = dict(event.get("state") or {})
+    step = event["step"]
+    print(f"Running step {step}")
+    started = time.monotonic()
+    state.update(steps[step](state) or {})
+    phase_metrics.emit_phase(f"lambda.{step}", time.monotonic() - started)
+    return state
+
+
+def fleet_instance_ids():
+    """The trading fleet in shard order, INSTANCE_IDS is set by the stack"""
+    return os.environ['INSTANCE_IDS'].split(',')
+
+
+def instance_id_list(instance_ids):
+    """One instance id or several, the steps work the same on a single instance and on a fleet"""
+    return [instance_ids] if isinstance(instance_ids, str) else list(instance_ids)
+
+
+def fleet_state(states):
+    """The state all instances share, "mixed" while they differ so waits keep waiting"""
+    distinct = set(states.values())
+    return distinct.pop() if len(distinct) == 1 else "mixed"
+
+
+def describe_states(instance_ids, ec2_client):
+    response = ec2_client.describe_instances(InstanceIds=instance_id_list(instance_ids))
+    return {instance['InstanceId']: instance['State']['Name']
+            for reservation in response['Reservations'] for instance in reservation['Instances']}
+
+
+def describe_instance(instance_ids, ec2_client=None):
+    ec2_client = ec2_client or boto3.client('ec2')
+    states = describe_states(instance_ids, ec2_client)
+    print(f"Current state of instances: {states}")
+    return {"instance_state": fleet_state(states)}
+
+
+def start_instance(instance_ids, ec2_client=None):
+    ec2_client = ec2_client or boto3.client('ec2')
+    states = describe_states(instance_ids, ec2_client)
+    to_start = [instance_id for instance_id, state in states.items() if state not in ('running', 'pending')]
+    if to_start:
+        # One call for the whole fleet
+        print(f"Starting instances {to_start}...")
+        ec2_client.start_instances(InstanceIds=to_start)
+    else:
+        print(f"Instances are already {states}. Skipping start.")
+    return {"instance_state": fleet_state(states)}
+
+
+def stop_instance(instance_ids, ec2_client=None, hibernate=False):
+    ec2_client = ec2_client or boto3.client('ec2')
+    instance_ids = instance_id_list(instance_ids)
+    if hibernate:
+        try:
+            print(f"Hibernating instances {instance_ids}...")
+            ec2_client.stop_instances(InstanceIds=instance_ids, Hibernate=True)
+            return {"instance_state": "stopping", "hibernated": True}
+        except ClientError as e:
+            # e.g. the instance was never configured for hibernation or is not ready for it yet
+            print(f"Hibernation failed with {e.response['Error']['Code']}, stopping instead")
+
+    print(f"Stopping instances {instance_ids}...")
+    ec2_client.stop_instances(InstanceIds=instance_ids)
+    return {"instance_state": "stopping", "hibernated": False} if hibernate else {"instance_state": "stopping"}
+
+
+def check_agent(instance_ids, ssm_client=None):
+    """The SSM agent reporting Online is the earliest point commands can be sent"""
+    ssm_client = ssm_client or boto3.client('ssm')
+    instance_ids = instance_id_list(instance_ids)
+    response = ssm_client.describe_instance_information(
+        Filters=[{'Key': 'InstanceIds', 'Values': instance_ids}]
+    )
+    online = {information['InstanceId'] for information in response['InstanceInformationList']
+              if information['PingStatus'] == 'Online'}
+    agent_online = online.issuperset(instance_ids)
+    print(f"SSM agent online on {sorted(online)} of {instance_ids}: {agent_online}")
+    return {"agent_online": agent_online}
@@ -0,0 +1,60 @@
+from datetime import date, datetime, timedelta, timezone
+
+# India does not observe DST, so a fixed offset is enough and avoids tzdata lookups
+IST = timezone(timedelta(hours=5, minutes=30), "IST")
+
+BSE_HOLIDAYS = [
+    "2024-01-26",  # Fri, Republic Day
+    "2024-03-08",  # Fri, Mahashivratri
+    "2024-03-25",  # Mon, Holi
+    "2024-03-29",  # Fri, Good Friday
+    "2024-04-11",  # Thu, Id-Ul-Fitr (Ramadan Eid)
+    "2024-04-17",  # Wed, Shri Ram Navmi
+    "2024-05-01",  # Wed, Maharashtra Din
+    "2024-06-17",  # Mon, Bakri Id / Eid ul-Adha
+    "2024-07-17",  # Wed, Moharram
+    "2024-08-15",  # Thu, Independence Day
+    "2024-10-02",  # Wed, Mahatma Gandhi Jayanti
+    "2024-11-01",  # Fri, Diwali
+    "2024-11-15",  # Fri, Guru Nanak's Birthday
+    "2024-11-20",  # Wed, Maharashtra election
+    "2024-12-25",  # Wed, Christmas
+    "2025-02-26",  # Wed, Mahashivratri
+    "2025-03-14",  # Fri, Holi
+    "2025-03-31",  # Mon, Id-Ul-Fitr (Ramadan Eid)
+    "2025-04-10",  # Thu, Shri Mahavir Jayanti
+    "2025-04-14",  # Mon, Dr. Baba Saheb Ambedkar Jayanti
+    "2025-04-18",  # Fri, Good Friday
+    "2025-05-01",  # Thu, Maharashtra Day
+    "2025-08-15",  # Fri, Independence Day
+    "2025-08-27",  # Wed, Ganesh Chaturthi
+    "2025-10-02",  # Thu, Mahatma Gandhi Jayanti/Dussehra
+    "2025-10-21",  # Tue, Diwali Laxmi Pujan*
+    "2025-10-22",  # Wed, Diwali-Balipratipada
+    "2025-11-05",  # Wed, Prakash Gurpurb Sri Guru Nanak Dev
+    "2025-12-25",  # Thu, Christmas
+]
+
+# Built once per import, so warm Lambda invocations only pay for a set lookup
+HOLIDAY_ORDINALS = frozenset(date.fromisoformat(day).toordinal() for day in BSE_HOLIDAYS)
+
+
+def today_ist():
+    return datetime.now(IST).date()
+
+
+def is_holiday(day=None):
+    day = day or today_ist()
+    return day.toordinal() in HOLIDAY_ORDINALS
+
+
+def is_trading_day(day=None):
+    day = day or today_ist()
+    return day.weekday() < 5 and day.toordinal() not in HOLIDAY_ORDINALS
+
+
+def next_trading_day(day=None):
+    day = (day or today_ist()) + timedelta(days=1)
+    while not is_trading_day(day):
+        day += timedelta(days=1)
+    return day
@@ -0,0 +1,42 @@
+"""Phase timings as CloudWatch Embedded Metric Format records.
+
+Lambda ships stdout to CloudWatch Logs, which turns every EMF record into metrics, so no API
+calls or permissions are needed. Durations are published as PhaseDuration with App and Phase
+dimensions; Lambda steps are named lambda.<step>, steps of SSM commands instance.<step>.
+"""
+import json
+import os
+import time
+
+NAMESPACE = "SimpleTrader"
+
+
+def emit(metrics, dimensions, unit="Seconds"):
+    """Prints one EMF record with the metrics {name: value} under the given {dimension: value}"""
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": [sorted(dimensions)],
+                "Metrics": [{"Name": name, "Unit": unit} for name in metrics],
+            }],
+        },
+        **dimensions,
+        **metrics,
+    }
+    print(json.dumps(record))
+    return record
+
+
+def app_name():
+    return os.environ.get("APP_NAME", "unknown")
+
+
+def emit_phase(phase, seconds, app=None):
+    return emit({"PhaseDuration": round(seconds, 3)}, {"App": app or app_name(), "Phase": phase})
+
+
+def emit_phases(timings, prefix, app=None):
+    for phase, seconds in timings.items():
+        emit_phase(f"{prefix}.{phase}", seconds, app)
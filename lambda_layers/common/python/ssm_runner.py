@@ -0,0 +1,219 @@
+"""Runs shell commands on instances through SSM Run Command.
+
+Commands are grouped into named steps. Every step is bracketed with timestamp markers, so the
+finished invocation can be turned into per-step timings. Full output goes to S3 and CloudWatch
+Logs when configured, which avoids the 24 KB limit of get_command_invocation.
+
+The script stops at the first failing command and exits with its status, so SSM reports the
+command as Failed. A command that may fail has to say so itself, e.g. with || echo "...", and a
+step must not end in a test like [ -f x ] && ...
+
+send() and poll() are non-blocking and meant to be driven by a state machine. poll() returns the
+next wait_seconds, growing exponentially with jitter, and cancels the command once its deadline
+passes. run() drives both in a loop for callers that can afford to block. A command sent to
+several instances is finished once it finished on all of them, and failed if it failed on any.
+
+Where output goes defaults to the SSM_OUTPUT_BUCKET, SSM_OUTPUT_PREFIX and SSM_LOG_GROUP
+environment variables set on the Lambdas by the stacks.
+"""
+import math
+import os
+import random
+import re
+import time
+from urllib.parse import urlparse
+
+import boto3
+
+import phase_metrics
+from instance_steps import instance_id_list
+
+FINAL_STATUSES = {"Success", "Failed", "Cancelled", "TimedOut"}
+
+# get_command_invocation truncates StandardOutputContent to this many characters
+INLINE_OUTPUT_LIMIT = 24000
+
+FIRST_WAIT_SECONDS = 2
+MAX_WAIT_SECONDS = 30
+DEFAULT_DEADLINE_SECONDS = 900
+
+STEP_MARKER = re.compile(r"^::step-(start|end)::(?P<name>[\w.-]+)::(?P<ts>[\d.]+)$", re.MULTILINE)
+
+
+SCRIPT_HEADER = [
+    "set -euo pipefail",
+    'trap \'echo "Step $SSM_STEP failed with exit code $?" >&2\' ERR',
+]
+
+
+def step_script(steps):
+    """Flattens [(name, [commands])] into one command list with timing markers around each step"""
+    commands = list(SCRIPT_HEADER)
+    for name, step_commands in steps:
+        commands.append(f'SSM_STEP={name}; echo "::step-start::{name}::$(date +%s.%N)"')
+        commands.extend(step_commands)
+        # set -e lets a failing a && b list pass, the status of a step's last command is checked here
+        commands.append('STEP_RC=$?; [ $STEP_RC -eq 0 ] || { echo "Step $SSM_STEP failed with exit code $STEP_RC" >&2; exit $STEP_RC; }')
+        commands.append(f'echo "::step-end::{name}::$(date +%s.%N)"')
+    return commands
+
+
+def parse_step_timings(output):
+    starts = {}
+    timings = {}
+    for match in STEP_MARKER.finditer(output or ""):
+        name, ts = match.group("name"), float(match.group("ts"))
+        if match.group(1) == "start":
+            starts[name] = ts
+        elif name in starts:
+            timings[name] = round(ts - starts[name], 3)
+    return timings
+
+
+def next_wait_seconds(attempt, deadline=None):
+    """Full jitter exponential backoff, never sleeping past the deadline"""
+    ceiling = min(MAX_WAIT_SECONDS, FIRST_WAIT_SECONDS * 2 ** attempt)
+    wait = random.uniform(ceiling / 2, ceiling)
+    if deadline is not None:
+        wait = min(wait, max(deadline - time.time(), 1))
+    return max(1, math.ceil(wait))
+
+
+def send(instance_id, steps, output_bucket=None, output_prefix=None, log_group=None,
+         deadline_seconds=DEFAULT_DEADLINE_SECONDS, ssm_client=None):
+    """instance_id is one instance or a list of them, a fleet gets the command in a single send_command"""
+    ssm_client = ssm_client or boto3.client('ssm')
+    instance_ids = instance_id_list(instance_id)
+    output_bucket = output_bucket or os.environ.get("SSM_OUTPUT_BUCKET")
+    output_prefix = output_prefix or os.environ.get("SSM_OUTPUT_PREFIX")
+    log_group = log_group or os.environ.get("SSM_LOG_GROUP")
+
+    kwargs = {}
+    if output_bucket:
+        kwargs["OutputS3BucketName"] = output_bucket
+        kwargs["OutputS3KeyPrefix"] = output_prefix or "ssm-output"
+    if log_group:
+        kwargs["CloudWatchOutputConfig"] = {"CloudWatchOutputEnabled": True, "CloudWatchLogGroupName": log_group}
+
+    response = ssm_client.send_command(
+        InstanceIds=instance_ids,
+        DocumentName="AWS-RunShellScript",  # Built-in SSM document for running shell scripts
+        Parameters={"commands": step_script(steps), "executionTimeout": [str(deadline_seconds)]},
+        **kwargs,
+    )
+    command_id = response['Command']['CommandId']
+    print(f"Command sent: {command_id}")
+
+    return {
+        "command_id": command_id,
+        "command_instance_ids": instance_ids,
+        "command_status": "Pending",
+        "command_sent_at": time.time(),
+        "command_deadline": time.time() + deadline_seconds,
+        "poll_attempt": 0,
+        "wait_seconds": next_wait_seconds(0),
+    }
+
+
+def read_full_output(output, s3_client=None):
+    content = output.get('StandardOutputContent', '')
+    url = output.get('StandardOutputUrl')
+    if len(content) < INLINE_OUTPUT_LIMIT or not url:
+        return content
+
+    # https://s3.<region>.amazonaws.com/<bucket>/<key>
+    bucket, key = urlparse(url).path.lstrip('/').split('/', 1)
+    s3_client = s3_client or boto3.client('s3')
+    return s3_client.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8', errors='replace')
+
+
+def poll(instance_id, command, ssm_client=None, s3_client=None):
+    """Checks a command sent with send() once, command is the dict send() returned"""
+    ssm_client = ssm_client or boto3.client('ssm')
+    instance_ids = command.get("command_instance_ids") or instance_id_list(instance_id)
+    if len(instance_ids) > 1:
+        return poll_fleet(instance_ids, command, ssm_client, s3_client)
+    instance_id = instance_ids[0]
+    command_id = command["command_id"]
+    attempt = command.get("poll_attempt", 0) + 1
+    deadline = command.get("command_deadline")
+
+    try:
+        output = ssm_client.get_command_invocation(CommandId=command_id, InstanceId=instance_id)
+        status = output['Status']
+    except ssm_client.exceptions.InvocationDoesNotExist:
+        # Returned for a short while right after send_command
+        output, status = None, "Pending"
+
+    if status not in FINAL_STATUSES:
+        if deadline is not None and time.time() > deadline:
+            print(f"Command {command_id} passed its deadline, cancelling")
+            ssm_client.cancel_command(CommandId=command_id, InstanceIds=[instance_id])
+            return {"command_status": "TimedOut", "poll_attempt": attempt}
+        return {"command_status": status, "poll_attempt": attempt, "wait_seconds": next_wait_seconds(attempt, deadline)}
+
+    full_output = read_full_output(output, s3_client)
+    timings = parse_step_timings(full_output)
+    elapsed = round(time.time() - command.get("command_sent_at", time.time()), 3)
+    print(f"Command {command_id} finished with {status} after {attempt} polls, {elapsed}s, steps: {timings}")
+    phase_metrics.emit_phases(timings, "instance")
+    print(f"Command output: {output.get('StandardOutputContent', '')}")
+    print(f"Command error: {output.get('StandardErrorContent', '')}")
+
+    return {
+        "command_status": status,
+        "poll_attempt": attempt,
+        "command_elapsed": elapsed,
+        "command_timings": timings,
+        "command_output_url": output.get('StandardOutputUrl', ''),
+    }
+
+
+def poll_fleet(instance_ids, command, ssm_client, s3_client=None):
+    """poll() for a command sent to several instances, one call for all of their statuses"""
+    command_id = command["command_id"]
+    attempt = command.get("poll_attempt", 0) + 1
+    deadline = command.get("command_deadline")
+
+    statuses = {}
+    for page in ssm_client.get_paginator('list_command_invocations').paginate(CommandId=command_id):
+        statuses.update({invocation['InstanceId']: invocation['Status'] for invocation in page['CommandInvocations']})
+    # Instances without an invocation yet are still pending
+    pending = [instance_id for instance_id in instance_ids if statuses.get(instance_id) not in FINAL_STATUSES]
+
+    if pending:
+        if deadline is not None and time.time() > deadline:
+            print(f"Command {command_id} passed its deadline on {pending}, cancelling")
+            ssm_client.cancel_command(CommandId=command_id, InstanceIds=pending)
+            return {"command_status": "TimedOut", "poll_attempt": attempt, "failed_instances": pending}
+        print(f"Command {command_id} still running on {pending}")
+        return {"command_status": "InProgress", "poll_attempt": attempt,
+                "wait_seconds": next_wait_seconds(attempt, deadline)}
+
+    timings = {}
+    for instance_id in instance_ids:
+        output = ssm_client.get_command_invocation(CommandId=command_id, InstanceId=instance_id)
+        timings[instance_id] = parse_step_timings(read_full_output(output, s3_client))
+        phase_metrics.emit_phases(timings[instance_id], "instance")
+        print(f"{instance_id} finished with {statuses[instance_id]}, steps: {timings[instance_id]}")
+        print(f"{instance_id} error: {output.get('StandardErrorContent', '')}")
+
+    failed = [instance_id for instance_id in instance_ids if statuses[instance_id] != "Success"]
+    elapsed = round(time.time() - command.get("command_sent_at", time.time()), 3)
+    print(f"Command {command_id} finished after {attempt} polls, {elapsed}s, failed on {failed}")
+    return {
+        "command_status": statuses[failed[0]] if failed else "Success",
+        "poll_attempt": attempt,
+        "command_elapsed": elapsed,
+        "command_timings": timings,
+        "failed_instances": failed,
+    }
+
+
+def run(instance_id, steps, ssm_client=None, s3_client=None, **send_kwargs):
+    """Blocking variant, sends the steps and waits until the command finishes or its deadline passes"""
+    command = send(instance_id, steps, ssm_client=ssm_client, **send_kwargs)
+    while command["command_status"] not in FINAL_STATUSES:
+        time.sleep(command["wait_seconds"])
+        command.update(poll(instance_id, command, ssm_client, s3_client))
+    return command
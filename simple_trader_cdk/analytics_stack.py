@@ -5,10 +5,22 @@ from aws_cdk import (
     aws_ec2 as ec2,
     aws_iam as iam,
     aws_lambda as _lambda,
+    aws_s3 as s3,
+    aws_s3_deployment as s3deploy,
+    aws_stepfunctions as sfn,
+    Size,
     Stack
 )
 from constructs import Construct
 
+from simple_trader_cdk.command_output import create_command_output
+from simple_trader_cdk.instance_workflow import InstanceWorkflow
+from simple_trader_cdk.simple_trader_cdk_stack import AWS_SDK_PANDAS_LAYER_ARN
+
+# Backtest chunks running at the same time, each one is a Lambda invocation. An inline Map state
+# runs at most 40 iterations at once whatever max_concurrency says.
+BACKTEST_MAX_CONCURRENCY = 40
+
 user_name = os.getenv("ANALYTICS_USER", "")
 passw = os.getenv("ANALYTICS_PW", "")
 
@@ -48,6 +60,8 @@ class AnalyticsStack(Stack):
         super().__init__(scope, construct_id, **kwargs)
 
         app_name = "Analytics"
+        s3_bucket_suffix = os.getenv("S3_BUCKET_SUFFIX", "")
+        bucket_name = f"simpletrader-working-bucket{s3_bucket_suffix}"
 
         # EC2 Instance
         vpc = ec2.Vpc.from_lookup(self, "DefaultVPC", is_default=True)
@@ -56,7 +70,17 @@ class AnalyticsStack(Stack):
 
         # Lambda
         lambda_role = self.create_lambda_role()
-        self.create_website_lambdas(ec2_instance, lambda_role)
+        command_output_environment = create_command_output(self, app_name, bucket_name, ec2_role, lambda_role)
+        self.create_host_scripts_deployment(bucket_name, ec2_role)
+        common_layer = _lambda.LayerVersion(self, "CommonLayer",
+            code=_lambda.Code.from_asset("lambda_layers/common"),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
+            description="Shared helpers for the SimpleTrader Lambdas",
+        )
+        self.create_website_lambdas(ec2_instance, lambda_role, bucket_name, command_output_environment, common_layer)
+
+        # Long backtests fanned out over Lambda workers instead of running on the website instance
+        self.create_backtest_fanout(bucket_name, common_layer)
 
 
     def create_ec2_instance(self, app_name, vpc, ec2_role):
@@ -121,31 +145,131 @@ class AnalyticsStack(Stack):
         )
         return ec2_role
 
-    def create_website_lambdas(self, ec2_instance, lambda_role):
-        # Create Lambda function to start the EC2, register IP and domain name
-        _lambda.Function(self, "StartWebsiteLambda",
+    def create_host_scripts_deployment(self, bucket_name, ec2_role):
+        # Warmup runner and its manifest, synced to the instance on every start
+        bucket = s3.Bucket.from_bucket_name(self, "WorkingBucket", bucket_name)
+        s3deploy.BucketDeployment(self, "HostScriptsDeployment",
+            sources=[s3deploy.Source.asset("host_scripts/analytics"), s3deploy.Source.asset("host_scripts/common")],
+            destination_bucket=bucket,
+            destination_key_prefix="host_scripts/analytics/",
+        )
+
+        ec2_role.add_to_policy(iam.PolicyStatement(
+            actions=["s3:PutObject"],
+            resources=[f"arn:aws:s3:::{bucket_name}/warmup-reports/*"]
+        ))
+
+    def create_website_lambdas(self, ec2_instance, lambda_role, bucket_name, command_output_environment, common_layer):
+        # Create Lambda function running the steps to start the EC2, register IP and domain name
+        start_lambda = _lambda.Function(self, "StartWebsiteLambda",
             runtime=_lambda.Runtime.PYTHON_3_12,
             code=_lambda.Code.from_asset("lambda_functions/analytics_start"),
             handler="website_start.handler",
             role=lambda_role,
-            timeout=Duration.seconds(600),  # Increase timeout to 10 minutes
+            timeout=Duration.seconds(60),  # Steps are single API calls, waiting happens in the state machine
             environment={
-                "INSTANCE_ID": ec2_instance.instance_id
-            }
+                "INSTANCE_ID": ec2_instance.instance_id,
+                "BUCKET_NAME": bucket_name,
+                "APP_NAME": "Analytics",
+                **command_output_environment
+            },
+            layers=[common_layer],
         )
 
-        # Create Lambda function to stop the EC2, deregister IP
-        _lambda.Function(self, "StopWebsiteLambda",
+        # Create Lambda function running the steps to stop the EC2, deregister IP
+        stop_lambda = _lambda.Function(self, "StopWebsiteLambda",
             runtime=_lambda.Runtime.PYTHON_3_12,
             code=_lambda.Code.from_asset("lambda_functions/analytics_stop"),
             handler="website_stop.handler",
             role=lambda_role,
-            timeout=Duration.seconds(600),  # Increase timeout to 10 minutes
+            timeout=Duration.seconds(60),  # Steps are single API calls, waiting happens in the state machine
             environment={
-                "INSTANCE_ID": ec2_instance.instance_id
-            }
+                "INSTANCE_ID": ec2_instance.instance_id,
+                "BUCKET_NAME": bucket_name,
+                "APP_NAME": "Analytics",
+                **command_output_environment
+            },
+            layers=[common_layer],
+        )
+
+        self.create_start_workflow(start_lambda)
+        self.create_stop_workflow(stop_lambda)
+
+    def create_start_workflow(self, start_lambda):
+        workflow = InstanceWorkflow(self, "StartWebsiteWorkflow", start_lambda, timeout=Duration.minutes(30))
+
+        # DNS and the bootstrap are independent, the bootstrap starts as soon as the SSM agent is online
+        # instead of waiting minutes for the instance status checks
+        network = workflow.step("AssociateEip", "associate_eip") \
+            .next(workflow.step("UpdateRoute53", "update_route53"))
+        bootstrap = workflow.poll("AgentOnline", "check_agent", done=sfn.Condition.boolean_equals("$.agent_online", True)) \
+            .next(workflow.command("Bootstrap", "send_bootstrap")) \
+            .next(workflow.command("Verify", "send_verify"))
+
+        definition = workflow.step("StartInstance", "start_instance") \
+            .next(workflow.wait_for_instance_state("Running", "running")) \
+            .next(sfn.Parallel(workflow, "NetworkAndBootstrap").branch(network).branch(bootstrap)) \
+            .next(sfn.Succeed(workflow, "WebsiteUp"))
+        return workflow.state_machine(definition)
+
+    def create_stop_workflow(self, stop_lambda):
+        workflow = InstanceWorkflow(self, "StopWebsiteWorkflow", stop_lambda, timeout=Duration.minutes(15))
+
+        # The Elastic IP stays allocated and associated, so the next start needs no DNS change
+        definition = workflow.step("StopInstance", "stop_instance") \
+            .next(workflow.wait_for_instance_state("Stopped", "stopped", interval=Duration.seconds(10))) \
+            .next(sfn.Succeed(workflow, "WebsiteDown"))
+        return workflow.state_machine(definition)
+
+    def create_backtest_fanout(self, bucket_name, common_layer):
+        backtest_role = iam.Role(self, "BacktestLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            description="Role for the backtest workers, reads the analytics code and data and writes the results",
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole"),
+                iam.ManagedPolicy.from_aws_managed_policy_name("AmazonS3ReadOnlyAccess"),
+            ]
+        )
+        backtest_role.add_to_policy(iam.PolicyStatement(
+            actions=["s3:PutObject"],
+            resources=[f"arn:aws:s3:::{bucket_name}/backtests/*"]
+        ))
+
+        pandas_layer = _lambda.LayerVersion.from_layer_version_arn(self, "PandasLayer", AWS_SDK_PANDAS_LAYER_ARN)
+
+        backtest_lambda = _lambda.Function(self, "BacktestLambda",
+            runtime=_lambda.Runtime.PYTHON_3_12,
+            code=_lambda.Code.from_asset("lambda_functions/backtest"),
+            handler="backtest.handler",
+            role=backtest_role,
+            timeout=Duration.minutes(15),
+            memory_size=3008,  # CPU is allocated with memory, backtests are CPU bound
+            ephemeral_storage_size=Size.gibibytes(2),  # The unpacked repo_analytics.zip
+            environment={
+                "BUCKET_NAME": bucket_name,
+                "APP_NAME": "Analytics",
+                "CODE_KEY": "repo_analytics.zip",
+            },
+            layers=[common_layer, pandas_layer],
+        )
+
+        workflow = InstanceWorkflow(self, "BacktestWorkflow", backtest_lambda, timeout=Duration.hours(2))
+        chunks = sfn.Map(workflow, "RunChunks",
+            items_path="$.chunks",
+            item_selector={
+                "job_id": sfn.JsonPath.string_at("$.job_id"),
+                "index": sfn.JsonPath.number_at("$$.Map.Item.Value.index"),
+            },
+            max_concurrency=BACKTEST_MAX_CONCURRENCY,
+            result_path=sfn.JsonPath.DISCARD,  # Chunk results are in S3, the reduce step reads them there
         )
+        chunks.item_processor(workflow.step("RunChunk", "run_chunk"))
 
+        definition = workflow.step("Plan", "plan") \
+            .next(chunks) \
+            .next(workflow.step("Reduce", "reduce")) \
+            .next(sfn.Succeed(workflow, "ReportWritten"))
+        return workflow.state_machine(definition)
 
     def create_lambda_role(self):
         lambda_role = iam.Role(self, "LambdaRole",
@@ -161,6 +285,7 @@ class AnalyticsStack(Stack):
         lambda_role.add_to_policy(iam.PolicyStatement(
             actions=[
                 "route53:ListHostedZonesByName",
+                "route53:ListResourceRecordSets",
                 "route53:ChangeResourceRecordSets"
             ],
             resources=["*"]
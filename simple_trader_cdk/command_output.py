@@ -0,0 +1,39 @@
+from aws_cdk import (
+    aws_iam as iam,
+    aws_logs as logs,
+)
+from constructs import Construct
+
+
+def create_command_output(scope: Construct, app_name, bucket_name, ec2_role, lambda_role):
+    """Where the instance's SSM agent writes the full output of the commands the Lambdas send.
+
+    get_command_invocation only returns the first 24 KB, ssm_runner.py reads the rest from S3. Returns
+    the environment of the Lambdas sending commands. Both roles may be the same role.
+    """
+    output_prefix = f"ssm-output/{app_name}"
+    command_log_group = logs.LogGroup(scope, "CommandLogGroup",
+        log_group_name=f"/{app_name.lower()}/ssm-commands",
+        retention=logs.RetentionDays.ONE_MONTH,
+    )
+    command_log_group.grant_write(ec2_role)
+
+    ec2_role.add_to_policy(iam.PolicyStatement(
+        actions=["s3:PutObject"],
+        resources=[f"arn:aws:s3:::{bucket_name}/{output_prefix}/*"]
+    ))
+    # The SSM agent looks up the log group before streaming command output to it
+    ec2_role.add_to_policy(iam.PolicyStatement(
+        actions=["logs:DescribeLogGroups", "logs:DescribeLogStreams"],
+        resources=["*"]
+    ))
+    lambda_role.add_to_policy(iam.PolicyStatement(
+        actions=["s3:GetObject"],
+        resources=[f"arn:aws:s3:::{bucket_name}/{output_prefix}/*"]
+    ))
+
+    return {
+        "SSM_OUTPUT_BUCKET": bucket_name,
+        "SSM_OUTPUT_PREFIX": output_prefix,
+        "SSM_LOG_GROUP": command_log_group.log_group_name,
+    }
@@ -0,0 +1,275 @@
+import os
+
+from aws_cdk import (
+    Duration,
+    aws_codebuild as codebuild,
+    aws_ec2 as ec2,
+    aws_iam as iam,
+    aws_imagebuilder as imagebuilder,
+    aws_lambda as _lambda,
+    aws_s3 as s3,
+    aws_s3_deployment as s3deploy,
+    aws_sns as sns,
+    aws_sns_subscriptions as subscriptions,
+    aws_ssm as ssm,
+    custom_resources as cr,
+    Stack
+)
+from constructs import Construct
+
+# SimpleTraderCdkStack launches the trading instance from whatever AMI this parameter points at
+GOLDEN_AMI_PARAMETER = "/simpletrader/golden-ami/latest"
+
+# Image Builder components and recipes are immutable, bump this on any change to them
+GOLDEN_AMI_VERSION = "1.4.0"
+
+# The latest Amazon Linux 2 image managed by Image Builder, resolved when the pipeline runs. The recipe
+# stays the same when AWS publishes a new base image, so deploys never have to replace it.
+PARENT_IMAGE = "arn:aws:imagebuilder:{region}:aws:image/amazon-linux-2-arm64/x.x.x"
+
+PYTHON_VERSION = "3.9.6"
+# Published by the PythonBuild CodeBuild project (host_scripts/python_build/build_python.sh)
+PYTHON_BUILDS_PREFIX = "python-builds"
+
+
+# Shared between the image build and the instance user data. On a golden AMI the interpreter
+# is already present and the whole block is skipped.
+def python_install_script(bucket_name):
+    return f"""
+if [ ! -x /usr/local/bin/python3.9 ]; then
+    # Install development tools
+    sudo yum groupinstall "Development Tools" -y
+    sudo yum install gcc libffi-devel bzip2 bzip2-devel zlib-devel xz-devel wget make -y
+    sudo yum install openssl11-devel -y
+    sudo yum install -y openssl11
+    sudo yum install -y sqlite-devel
+
+    sudo yum remove -y openssl-devel
+
+    # Create the base directory if it doesn't exist
+    mkdir -p /home/ec2-user/installers
+    cd /home/ec2-user/installers
+
+    # The PGO+LTO interpreter tuned for Neoverse N1, once one has passed the benchmark gate
+    if aws s3 cp s3://{bucket_name}/{PYTHON_BUILDS_PREFIX}/latest.sha256 python-build.sha256 --only-show-errors; then
+        read -r PYTHON_SHA256 PYTHON_TARBALL < python-build.sha256
+        if aws s3 cp s3://{bucket_name}/{PYTHON_BUILDS_PREFIX}/$PYTHON_TARBALL $PYTHON_TARBALL --only-show-errors \\
+                && sha256sum -c python-build.sha256; then
+            sudo tar -C / -xzf $PYTHON_TARBALL
+        fi
+    fi
+
+    # Otherwise install python {PYTHON_VERSION} from source
+    if [ ! -x /usr/local/bin/python3.9 ]; then
+        sudo wget https://www.python.org/ftp/python/{PYTHON_VERSION}/Python-{PYTHON_VERSION}.tgz
+        sudo tar xzf Python-{PYTHON_VERSION}.tgz
+
+        cd Python-{PYTHON_VERSION}/
+
+        sudo make clean
+        sudo ./configure --enable-optimizations
+        sudo make altinstall
+    fi
+    sudo /usr/local/bin/python3.9 -m ensurepip --upgrade
+    sudo /usr/local/bin/python3.9 -m pip install --upgrade pip
+fi
+"""
+
+
+class GoldenAmiStack(Stack):
+    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        app_name = "SimpleTrader"
+        s3_bucket_suffix = os.getenv("S3_BUCKET_SUFFIX", "")
+        bucket_name = f"simpletrader-working-bucket{s3_bucket_suffix}"
+
+        ami_parameter = self.create_ami_parameter()
+        topic = self.create_ami_publisher(ami_parameter)
+        self.create_image_pipeline(app_name, bucket_name, topic)
+        self.create_python_build(app_name, bucket_name)
+
+    def create_ami_parameter(self):
+        # The parameter is not a resource of this stack, CloudFormation would set it back to the stock
+        # image on every deploy. It is only created, pointing at the stock Amazon Linux 2 image so the
+        # trading stack can always deploy, when it does not exist yet. The pipeline overwrites it after
+        # every successful build.
+        base_image = ec2.MachineImage.latest_amazon_linux2(cpu_type=ec2.AmazonLinuxCpuType.ARM_64)
+        parameter_arn = self.format_arn(service="ssm", resource="parameter", resource_name=GOLDEN_AMI_PARAMETER.lstrip("/"))
+        cr.AwsCustomResource(self, "GoldenAmiParameterSeed",
+            on_create=cr.AwsSdkCall(
+                service="SSM",
+                action="putParameter",
+                parameters={
+                    "Name": GOLDEN_AMI_PARAMETER,
+                    "Value": base_image.get_image(self).image_id,
+                    "Type": "String",
+                    "DataType": "aws:ec2:image",
+                    "Description": "Latest golden AMI for the SimpleTrader trading instance",
+                    "Overwrite": False,
+                },
+                physical_resource_id=cr.PhysicalResourceId.of(GOLDEN_AMI_PARAMETER),
+                ignore_error_codes_matching="ParameterAlreadyExists",
+            ),
+            # No on_update or on_delete, the golden AMI the pipeline published is left alone
+            policy=cr.AwsCustomResourcePolicy.from_sdk_calls(resources=[parameter_arn]),
+        )
+        return ssm.StringParameter.from_string_parameter_name(self, "GoldenAmiParameter", GOLDEN_AMI_PARAMETER)
+
+    def create_image_pipeline(self, app_name, bucket_name, topic):
+        build_role = iam.Role(self, "ImageBuilderRole",
+                    assumed_by=iam.ServicePrincipal("ec2.amazonaws.com"),
+                    description="Role used by the Image Builder instance baking the SimpleTrader AMI",
+                    managed_policies=[
+                        iam.ManagedPolicy.from_aws_managed_policy_name("EC2InstanceProfileForImageBuilder"),
+                        iam.ManagedPolicy.from_aws_managed_policy_name("AmazonSSMManagedInstanceCore"),
+                        iam.ManagedPolicy.from_aws_managed_policy_name("AmazonS3ReadOnlyAccess")
+                    ]
+        )
+        instance_profile = iam.CfnInstanceProfile(self, "ImageBuilderInstanceProfile",
+            roles=[build_role.role_name],
+        )
+
+        component_data = f"""
+name: {app_name}Python
+description: Toolchain, Python 3.9.6 and the current virtualenv for the {app_name} trading host
+schemaVersion: 1.0
+phases:
+  - name: build
+    steps:
+      - name: InstallPython
+        action: ExecuteBash
+        inputs:
+          commands:
+            - |
+{self.indent(python_install_script(bucket_name), 14)}
+      - name: InstallTools
+        action: ExecuteBash
+        inputs:
+          commands:
+            - yum install -y zstd
+      - name: InstallBaseWheels
+        action: ExecuteBash
+        inputs:
+          commands:
+            - aws s3 cp s3://{bucket_name}/requirements.txt /tmp/requirements.txt
+            - aws s3 sync s3://{bucket_name}/host_scripts/trading/ /home/ec2-user/bin/ --only-show-errors
+            - /usr/local/bin/python3.9 /home/ec2-user/bin/python_env.py ensure --bucket {bucket_name} --requirements /tmp/requirements.txt
+            - chown -R ec2-user:ec2-user /home/ec2-user/
+  - name: validate
+    steps:
+      - name: CheckPython
+        action: ExecuteBash
+        inputs:
+          commands:
+            - /usr/local/bin/python3.9 -c "import ssl, sqlite3, bz2, lzma, ctypes"
+            - /usr/local/bin/python3.9 -c "import sysconfig; print(sysconfig.get_config_var('CONFIG_ARGS'))"
+"""
+
+        component = imagebuilder.CfnComponent(self, "PythonComponent",
+            name=app_name + "Python",
+            platform="Linux",
+            version=GOLDEN_AMI_VERSION,
+            data=component_data,
+        )
+
+        recipe = imagebuilder.CfnImageRecipe(self, "GoldenAmiRecipe",
+            name=app_name + "GoldenAmi",
+            version=GOLDEN_AMI_VERSION,
+            parent_image=PARENT_IMAGE.format(region=self.region),
+            components=[
+                imagebuilder.CfnImageRecipe.ComponentConfigurationProperty(component_arn=component.attr_arn)
+            ],
+        )
+
+        infrastructure = imagebuilder.CfnInfrastructureConfiguration(self, "GoldenAmiInfrastructure",
+            name=app_name + "GoldenAmiInfrastructure",
+            instance_profile_name=instance_profile.ref,
+            instance_types=["c6g.2xlarge"],  # Same family as the trading instance
+            sns_topic_arn=topic.topic_arn,
+            terminate_instance_on_failure=True,
+        )
+
+        distribution = imagebuilder.CfnDistributionConfiguration(self, "GoldenAmiDistribution",
+            name=app_name + "GoldenAmiDistribution",
+            distributions=[
+                imagebuilder.CfnDistributionConfiguration.DistributionProperty(
+                    region=self.region,
+                    ami_distribution_configuration={
+                        "Name": app_name + "Golden-{{ imagebuilder:buildDate }}",
+                        "AmiTags": {"Project": app_name},
+                    },
+                )
+            ],
+        )
+
+        imagebuilder.CfnImagePipeline(self, "GoldenAmiPipeline",
+            name=app_name + "GoldenAmiPipeline",
+            image_recipe_arn=recipe.attr_arn,
+            infrastructure_configuration_arn=infrastructure.attr_arn,
+            distribution_configuration_arn=distribution.attr_arn,
+            schedule=imagebuilder.CfnImagePipeline.ScheduleProperty(
+                # Saturday 11:30PM IST / 6PM UTC, well away from market hours
+                schedule_expression="cron(0 18 ? * SAT *)",
+                pipeline_execution_start_condition="EXPRESSION_MATCH_ONLY",
+            ),
+        )
+
+    def create_python_build(self, app_name, bucket_name):
+        # Run with aws codebuild start-build --project-name SimpleTraderPythonBuild, the next image
+        # build and fresh instances install what it publishes
+        bucket = s3.Bucket.from_bucket_name(self, "WorkingBucket", bucket_name)
+        s3deploy.BucketDeployment(self, "PythonBuildScriptsDeployment",
+            sources=[s3deploy.Source.asset("host_scripts/python_build")],
+            destination_bucket=bucket,
+            destination_key_prefix="host_scripts/python_build/",
+        )
+
+        project = codebuild.Project(self, "PythonBuildProject",
+            project_name=app_name + "PythonBuild",
+            description=f"PGO+LTO Python {PYTHON_VERSION} for Neoverse N1, benchmarked against the stock build",
+            environment=codebuild.BuildEnvironment(
+                # Graviton2 like the c6g trading instance, Amazon Linux 2 like its AMI
+                build_image=codebuild.LinuxArmBuildImage.AMAZON_LINUX_2_STANDARD_3_0,
+                compute_type=codebuild.ComputeType.LARGE,
+            ),
+            environment_variables={
+                "BUCKET_NAME": codebuild.BuildEnvironmentVariable(value=bucket_name),
+                "PYTHON_VERSION": codebuild.BuildEnvironmentVariable(value=PYTHON_VERSION),
+            },
+            build_spec=codebuild.BuildSpec.from_object({
+                "version": "0.2",
+                "phases": {
+                    "build": {
+                        "commands": [
+                            "aws s3 sync s3://$BUCKET_NAME/host_scripts/python_build/ python_build/ --only-show-errors",
+                            "bash python_build/build_python.sh $BUCKET_NAME $PYTHON_VERSION",
+                        ]
+                    }
+                }
+            }),
+            timeout=Duration.hours(4),  # Two PGO builds and two pyperformance runs
+        )
+        bucket.grant_read_write(project)
+
+    def create_ami_publisher(self, ami_parameter):
+        # Image Builder reports finished builds on this topic, the Lambda records the new AMI id
+        topic = sns.Topic(self, "GoldenAmiTopic")
+
+        publish_lambda = _lambda.Function(self, "PublishGoldenAmiLambda",
+            runtime=_lambda.Runtime.PYTHON_3_12,
+            code=_lambda.Code.from_asset("lambda_functions/golden_ami"),
+            handler="publish_ami.handler",
+            timeout=Duration.seconds(30),
+            environment={
+                "AMI_PARAMETER": ami_parameter.parameter_name
+            }
+        )
+        ami_parameter.grant_write(publish_lambda)
+        topic.add_subscription(subscriptions.LambdaSubscription(publish_lambda))
+
+        return topic
+
+    @staticmethod
+    def indent(script, spaces):
+        return "\n".join((" " * spaces + line) if line else line for line in script.strip("\n").splitlines())
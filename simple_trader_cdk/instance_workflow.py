@@ -0,0 +1,85 @@
+from aws_cdk import (
+    Duration,
+    aws_stepfunctions as sfn,
+    aws_stepfunctions_tasks as tasks,
+)
+from constructs import Construct
+
+# Statuses of get_command_invocation that end a command, see lambda_layers/common/python/ssm_runner.py
+COMMAND_FAILED_STATUSES = ["Failed", "Cancelled", "TimedOut"]
+
+
+class InstanceWorkflow(Construct):
+    """Builds a state machine out of the short steps exposed by one of the start/stop Lambdas.
+
+    The Lambda is invoked with {"step": <name>, "state": <current state>} and returns the new state,
+    all waiting is done with native Wait states so no Lambda sits idle.
+    """
+
+    def __init__(self, scope: Construct, construct_id: str, step_function, timeout=Duration.minutes(30)) -> None:
+        super().__init__(scope, construct_id)
+        self.step_function = step_function
+        self.timeout = timeout
+
+    def step(self, name, step, step_function=None, on_error=None):
+        """on_error, if given, takes over once the Lambda failed all its retries, with the error in $.error"""
+        task = tasks.LambdaInvoke(self, name,
+            lambda_function=step_function or self.step_function,
+            payload=sfn.TaskInput.from_object({"step": step, "state": sfn.JsonPath.entire_payload}),
+            payload_response_only=True,
+        )
+        task.add_retry(
+            errors=["States.TaskFailed"],
+            interval=Duration.seconds(2),
+            max_attempts=3,
+            backoff_rate=2,
+        )
+        if on_error is not None:
+            task.add_catch(on_error, errors=["States.ALL"], result_path="$.error")
+        return task
+
+    def poll(self, name, step, done, interval=Duration.seconds(5), failed=None, on_failure=None, wait_time=None):
+        """Runs step until the done condition holds, waiting interval (or wait_time) between attempts.
+
+        on_failure also takes over when the step itself keeps failing.
+        """
+        check = self.step("Check" + name, step, on_error=on_failure)
+        wait = sfn.Wait(self, "WaitFor" + name, time=wait_time or sfn.WaitTime.duration(interval))
+        finished = sfn.Pass(self, name + "Done")
+
+        choice = sfn.Choice(self, "Is" + name + "Done").when(done, finished)
+        if failed is not None:
+            choice.when(failed, on_failure or sfn.Fail(self, name + "Failed", error=name + "Failed"))
+        choice.otherwise(wait)
+
+        wait.next(check)
+        check.next(choice)
+        return sfn.Chain.custom(check, [finished], finished)
+
+    def command(self, name, send_step, on_failure=None):
+        """Sends an SSM command through send_step and polls it until it finishes.
+
+        The poll step picks the next wait itself (exponential backoff with jitter, see ssm_runner.py).
+        """
+        send = self.step("Send" + name, send_step, on_error=on_failure)
+        finished = self.poll(name, "poll_command",
+            done=sfn.Condition.string_equals("$.command_status", "Success"),
+            failed=sfn.Condition.or_(*[
+                sfn.Condition.string_equals("$.command_status", status) for status in COMMAND_FAILED_STATUSES
+            ]),
+            on_failure=on_failure,
+            wait_time=sfn.WaitTime.seconds_path("$.wait_seconds"),
+        )
+        return send.next(finished)
+
+    def wait_for_instance_state(self, name, instance_state, interval=Duration.seconds(5)):
+        return self.poll(name, "describe_instance",
+            done=sfn.Condition.string_equals("$.instance_state", instance_state),
+            interval=interval,
+        )
+
+    def state_machine(self, definition):
+        return sfn.StateMachine(self, "StateMachine",
+            definition_body=sfn.DefinitionBody.from_chainable(definition),
+            timeout=self.timeout,
+        )
@@ -0,0 +1,48 @@
+"""Schema of the order ledger, shared by the Glue table and the Lambdas writing the ledger as Parquet.
+
+The Lambdas get the columns through the LEDGER_COLUMNS environment variable (see columns_json), so
+a column added here reaches both the table and the writers on the next deploy.
+"""
+import json
+from typing import List, NamedTuple
+
+DATABASE_NAME = "trading_analytics"
+TABLE_NAME = "order_ledger"
+
+
+class Column(NamedTuple):
+    name: str
+    type: str  # Glue/Athena type
+
+
+LEDGER_COLUMNS: List[Column] = [
+    Column("symbol", "string"),
+    Column("entry_time", "timestamp"),
+    Column("entry_price", "double"),
+    Column("entry_qty", "int"),
+    Column("entry_type", "string"),
+    Column("entry_value", "double"),
+    Column("entry_tag", "string"),
+    Column("exit_time", "timestamp"),
+    Column("exit_price", "double"),
+    Column("exit_qty", "int"),
+    Column("exit_type", "string"),
+    Column("exit_value", "double"),
+    Column("exit_tag", "string"),
+    Column("buy_price", "double"),
+    Column("sell_price", "double"),
+    Column("buy_value", "double"),
+    Column("sell_value", "double"),
+    Column("charges", "double"),
+    Column("gross_pnl", "double"),
+    Column("net_pnl", "double"),
+]
+
+# Derived from entry_time by the writers, one partition per day
+PARTITION_KEYS: List[Column] = [
+    Column("trade_date", "date"),
+]
+
+
+def columns_json(columns=LEDGER_COLUMNS):
+    return json.dumps([{"name": column.name, "type": column.type} for column in columns])
@@ -0,0 +1,204 @@
+"""Common investigations over the trade logs in Athena, only the result rows come back.
+
+Runs in the SimpleTraderLogs workgroup on the trade_logs table (see log_schema.py), every query
+is limited to the days asked for so only those days' logs are scanned:
+
+    python -m simple_trader_cdk.log_query latency --date 2024-01-02 [--symbol TCS] [--event order_fill]
+    python -m simple_trader_cdk.log_query rejects --from-date 2024-01-01 --to-date 2024-01-05
+    python -m simple_trader_cdk.log_query slowest --date 2024-01-02 [--limit 20]
+    python -m simple_trader_cdk.log_query order   --date 2024-01-02 --order-id 240102000123
+    python -m simple_trader_cdk.log_query sql     "SELECT count(*) FROM trade_logs WHERE log_date = DATE '2024-01-02'"
+    python -m simple_trader_cdk.log_query lint    trade_logs/2024-01-02/orders.log    (checks lines against the contract)
+
+The date defaults to today in IST. Rows go to stdout (--format table, csv or json), the bytes
+scanned and the run time to stderr.
+"""
+import argparse
+import csv
+import json
+import re
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import boto3
+
+from simple_trader_cdk import log_schema
+
+IST = timezone(timedelta(hours=5, minutes=30))
+IDENTIFIER = re.compile(r"^[A-Za-z0-9&_.:-]+$")
+FIRST_POLL_SECONDS = 0.25
+MAX_POLL_SECONDS = 2
+
+QUERIES = {
+    # Broker round trip per symbol, worst tail first
+    "latency": """
+SELECT symbol, count(*) AS orders,
+       round(approx_percentile(latency_ms, 0.5), 1) AS p50_ms,
+       round(approx_percentile(latency_ms, 0.9), 1) AS p90_ms,
+       round(approx_percentile(latency_ms, 0.99), 1) AS p99_ms,
+       round(max(latency_ms), 1) AS max_ms
+FROM {table}
+WHERE {days} AND event = '{event}' AND latency_ms IS NOT NULL{symbol_filter}
+GROUP BY symbol
+ORDER BY p99_ms DESC
+LIMIT {limit}""",
+    # Broker rejects per hour of the session and reason
+    "rejects": """
+SELECT log_date, hour(ts) AS hour, reason, count(*) AS rejects, count(DISTINCT symbol) AS symbols
+FROM {table}
+WHERE {days} AND event = 'order_reject'{symbol_filter}
+GROUP BY log_date, hour(ts), reason
+ORDER BY log_date, hour, rejects DESC
+LIMIT {limit}""",
+    # The single slowest broker answers
+    "slowest": """
+SELECT ts, symbol, order_id, event, side, qty, price, latency_ms
+FROM {table}
+WHERE {days} AND latency_ms IS NOT NULL{symbol_filter}
+ORDER BY latency_ms DESC
+LIMIT {limit}""",
+    # Everything logged about one order, e.g. a bad fill
+    "order": """
+SELECT ts, event, symbol, side, qty, price, latency_ms, reason, message, "$path" AS file
+FROM {table}
+WHERE {days} AND order_id = '{order_id}'
+ORDER BY ts
+LIMIT {limit}""",
+}
+
+
+def checked_identifier(value, name):
+    """Symbols and order ids go into the SQL as literals, so only plain identifiers are accepted"""
+    if not IDENTIFIER.match(value):
+        raise ValueError(f"{name} {value!r} has characters other than letters, digits and &_.:-")
+    return value
+
+
+def days_filter(from_date, to_date):
+    start, end = date.fromisoformat(from_date), date.fromisoformat(to_date)
+    if end < start:
+        raise ValueError(f"to_date {to_date} is before from_date {from_date}")
+    if start == end:
+        return f"log_date = DATE '{start.isoformat()}'"
+    return f"log_date BETWEEN DATE '{start.isoformat()}' AND DATE '{end.isoformat()}'"
+
+
+def build_query(name, from_date, to_date, symbol=None, order_id=None, event="order_ack", limit=100):
+    if name == "order" and not order_id:
+        raise ValueError("The order query needs an order id")
+    if event not in log_schema.EVENTS:
+        raise ValueError(f"Unknown event {event!r}, one of {', '.join(log_schema.EVENTS)}")
+    return QUERIES[name].format(
+        table=log_schema.TABLE_NAME,
+        days=days_filter(from_date, to_date),
+        event=event,
+        symbol_filter=f" AND symbol = '{checked_identifier(symbol, 'symbol')}'" if symbol else "",
+        order_id=checked_identifier(order_id, "order id") if order_id else "",
+        limit=int(limit),
+    ).strip()
+
+
+def run_query(sql, athena_client=None):
+    """(columns, rows, statistics) of the query, rows as lists of strings with None for NULL"""
+    athena_client = athena_client or boto3.client('athena')
+    execution_id = athena_client.start_query_execution(
+        QueryString=sql,
+        QueryExecutionContext={"Database": log_schema.DATABASE_NAME},
+        WorkGroup=log_schema.WORKGROUP_NAME,
+    )["QueryExecutionId"]
+
+    wait = FIRST_POLL_SECONDS
+    while True:
+        execution = athena_client.get_query_execution(QueryExecutionId=execution_id)["QueryExecution"]
+        state = execution["Status"]["State"]
+        if state == "SUCCEEDED":
+            break
+        if state in ("FAILED", "CANCELLED"):
+            raise RuntimeError(f"Query {execution_id} {state.lower()}: {execution['Status'].get('StateChangeReason')}")
+        time.sleep(wait)
+        wait = min(MAX_POLL_SECONDS, wait * 2)
+
+    columns, rows = None, []
+    for page in athena_client.get_paginator("get_query_results").paginate(QueryExecutionId=execution_id):
+        for row in page["ResultSet"]["Rows"]:
+            values = [datum.get("VarCharValue") for datum in row["Data"]]
+            if columns is None:
+                columns = values  # The first row holds the column names
+            else:
+                rows.append(values)
+    return columns or [], rows, execution.get("Statistics", {})
+
+
+def print_rows(columns, rows, output_format="table", out=sys.stdout):
+    if output_format == "json":
+        for row in rows:
+            out.write(json.dumps(dict(zip(columns, row))) + "\n")
+    elif output_format == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    else:
+        cells = [columns] + [["" if value is None else value for value in row] for row in rows]
+        widths = [max(len(row[index]) for row in cells) for index in range(len(columns))]
+        for row in cells:
+            out.write("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() + "\n")
+
+
+def lint(path, out=sys.stdout):
+    """Number of lines of a log file breaking the contract, the first few are printed"""
+    bad = 0
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            problems = log_schema.validate(line) if line.strip() else []
+            if problems:
+                bad += 1
+                if bad <= 20:
+                    out.write(f"{path}:{line_number}: {', '.join(problems)}\n")
+    return bad
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("query", choices=sorted(QUERIES) + ["sql", "lint"])
+    parser.add_argument("text", nargs="?", help="sql: the query, lint: the log file")
+    parser.add_argument("--date", help="Single day, defaults to today in IST")
+    parser.add_argument("--from-date")
+    parser.add_argument("--to-date")
+    parser.add_argument("--symbol")
+    parser.add_argument("--order-id")
+    parser.add_argument("--event", default="order_ack", help="latency: the event carrying latency_ms")
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--format", choices=["table", "csv", "json"], default="table")
+    args = parser.parse_args(argv)
+
+    if args.query == "lint":
+        if not args.text:
+            parser.error("lint needs a log file")
+        bad = lint(args.text)
+        print(f"{bad} lines break the log contract", file=sys.stderr)
+        return 1 if bad else 0
+
+    if args.query == "sql":
+        if not args.text:
+            parser.error("sql needs the query text")
+        sql = args.text
+    else:
+        today = datetime.now(IST).date().isoformat()
+        from_date = args.from_date or args.date or today
+        try:
+            sql = build_query(args.query, from_date, args.to_date or args.date or from_date, args.symbol,
+                              args.order_id, args.event, args.limit)
+        except ValueError as e:
+            parser.error(str(e))
+
+    started = time.monotonic()
+    columns, rows, statistics = run_query(sql)
+    print_rows(columns, rows, args.format)
+    print(f"{len(rows)} rows, {statistics.get('DataScannedInBytes', 0) / 1e6:.1f} MB scanned "
+          f"in {time.monotonic() - started:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
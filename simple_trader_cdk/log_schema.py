@@ -0,0 +1,86 @@
+"""Contract of the trade log writer, shared by the Glue table over SimpleTraderLogs/ and log_query.py.
+
+The trading app writes one JSON object per line to trade_logs/<yyyy-mm-dd>/*.log, the log shipper
+uploads the lines as they are written (host_scripts/trading/log_shipper.py). Every line has
+ts and event, the other fields only where they apply to the event:
+
+    {"ts": "2024-01-02 09:15:01.123", "event": "order_ack", "symbol": "TCS", "order_id": "240102000123",
+     "side": "BUY", "qty": 25, "price": 3801.5, "latency_ms": 38.2}
+
+ts is IST wall clock time in TIMESTAMP_FORMAT, which Athena reads as a timestamp. latency_ms is
+measured by the writer from sending the order to the broker's answer, on order_ack, order_fill
+and order_reject. Lines that are not JSON are skipped by the table rather than failing queries.
+"""
+import json
+from datetime import datetime
+from typing import List
+
+from simple_trader_cdk.ledger_schema import DATABASE_NAME, Column
+
+TABLE_NAME = "trade_logs"
+LOGS_PREFIX = "SimpleTraderLogs"
+# Queries of log_query.py run here, the cutoff stops a query before it scans more than a few days
+WORKGROUP_NAME = "SimpleTraderLogs"
+BYTES_SCANNED_CUTOFF = 10 * 1024 ** 3
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+LOG_COLUMNS: List[Column] = [
+    Column("ts", "timestamp"),
+    Column("event", "string"),
+    Column("symbol", "string"),
+    Column("order_id", "string"),
+    Column("side", "string"),
+    Column("qty", "int"),
+    Column("price", "double"),
+    Column("latency_ms", "double"),
+    Column("reason", "string"),
+    Column("strategy", "string"),
+    Column("level", "string"),
+    Column("message", "string"),
+]
+
+EVENTS = {
+    "signal": "Strategy decided to trade, before the order is placed",
+    "order_sent": "Order handed to the broker API",
+    "order_ack": "Broker accepted the order, with latency_ms",
+    "order_fill": "Order (partially) filled, qty and price of the fill, with latency_ms",
+    "order_reject": "Broker rejected the order, reason from the broker, with latency_ms",
+    "order_cancel": "Order cancelled",
+    "error": "Anything else that went wrong, level and message",
+    "info": "Free text, level and message",
+}
+
+# One partition per day, the directory the writer logs to
+PARTITION_KEYS: List[Column] = [
+    Column("log_date", "date"),
+]
+
+JSON_TYPES = {"string": str, "int": int, "double": (int, float)}
+
+
+def validate(line):
+    """What is wrong with a log line, an empty list for a line that follows the contract"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return ["not JSON"]
+    if not isinstance(record, dict):
+        return ["not a JSON object"]
+    problems = []
+    for required in ["ts", "event"]:
+        if required not in record:
+            problems.append(f"no {required}")
+    if "event" in record and record["event"] not in EVENTS:
+        problems.append(f"unknown event {record['event']!r}")
+    for column in LOG_COLUMNS:
+        value = record.get(column.name)
+        if value is None:
+            continue
+        if column.type == "timestamp":
+            try:
+                datetime.strptime(value, TIMESTAMP_FORMAT)
+            except (TypeError, ValueError):
+                problems.append(f"{column.name} {value!r} is not {TIMESTAMP_FORMAT}")
+        elif isinstance(value, bool) or not isinstance(value, JSON_TYPES[column.type]):
+            problems.append(f"{column.name} {value!r} is not of type {column.type}")
+    return problems
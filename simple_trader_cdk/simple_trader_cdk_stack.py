@@ -1,17 +1,62 @@
 import os
-import boto3
+import re
 
 from aws_cdk import (
     Duration,
+    aws_athena as athena,
+    aws_cloudwatch as cloudwatch,
+    aws_cloudwatch_actions as cloudwatch_actions,
     aws_ec2 as ec2,
     aws_iam as iam,
     aws_events as events,
     aws_events_targets as targets,
+    aws_glue as glue,
     aws_lambda as _lambda,
-    Stack
+    aws_s3 as s3,
+    aws_s3_deployment as s3deploy,
+    aws_sns as sns,
+    aws_sns_subscriptions as subscriptions,
+    aws_stepfunctions as sfn,
+    Stack,
+    Tags,
 )
 from constructs import Construct
 
+from simple_trader_cdk.command_output import create_command_output
+from simple_trader_cdk.golden_ami_stack import GOLDEN_AMI_PARAMETER, python_install_script
+from simple_trader_cdk.instance_workflow import InstanceWorkflow
+from simple_trader_cdk import ledger_schema, log_schema
+
+DEFAULT_INSTANCE_TYPE = "c6g.2xlarge"
+
+# https://aws-sdk-pandas.readthedocs.io/en/stable/layers.html
+AWS_SDK_PANDAS_LAYER_ARN = "arn:aws:lambda:ap-south-1:336392948345:layer:AWSSDKPandas-Python312:17"
+
+# Alarm when the trading instance is not ready to trade by 09:05 IST
+READY_BY_MINUTE_IST = 9 * 60 + 5
+
+# Hibernation writes the RAM to the root volume next to the OS, virtualenvs, releases and the day's logs
+HIBERNATION_FOOTPRINT_GB = 24
+# EC2 does not hibernate instances with more RAM than this
+MAX_HIBERNATION_MEMORY_GIB = 150
+# Graviton families (c6g, c6gn, m7g, r6gd...) have a fixed amount of RAM per vCPU
+GRAVITON_GIB_PER_VCPU = {"c": 2, "m": 4, "r": 8}
+VCPUS_BY_SIZE = {"medium": 1, "large": 2, "xlarge": 4, "2xlarge": 8, "4xlarge": 16, "8xlarge": 32,
+                 "12xlarge": 48, "16xlarge": 64}
+
+
+def hibernation_root_volume_gb(instance_type):
+    """Root volume big enough to hibernate instance_type, ValueError for a type that cannot be sized or hibernated"""
+    family, _, size = instance_type.partition(".")
+    match = re.fullmatch(r"([cmr])\d+g[a-z]*", family)
+    if not match or size not in VCPUS_BY_SIZE:
+        raise ValueError(f"Unknown memory size of {instance_type}, deploy it with TRADER_HIBERNATE=false")
+    memory_gib = GRAVITON_GIB_PER_VCPU[match.group(1)] * VCPUS_BY_SIZE[size]
+    if memory_gib > MAX_HIBERNATION_MEMORY_GIB:
+        raise ValueError(f"{instance_type} has {memory_gib} GiB of RAM, EC2 only hibernates up to "
+                         f"{MAX_HIBERNATION_MEMORY_GIB} GiB, deploy it with TRADER_HIBERNATE=false")
+    return memory_gib + HIBERNATION_FOOTPRINT_GB
+
 class SimpleTraderCdkStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -19,24 +64,35 @@ class SimpleTraderCdkStack(Stack):
         app_name = "SimpleTrader"
         s3_bucket_suffix = os.getenv("S3_BUCKET_SUFFIX", "")
         bucket_name = f"simpletrader-working-bucket{s3_bucket_suffix}"
+        # Hibernate the trading instance overnight instead of stopping it, resuming with memory intact
+        hibernate = os.getenv("TRADER_HIBERNATE", "false").lower() == "true"
+        # One instance per shard of the symbol universe, e.g. TRADER_FLEET=c6g.2xlarge,c6g.4xlarge
+        instance_types = os.getenv("TRADER_FLEET", DEFAULT_INSTANCE_TYPE).split(",")
 
         role = self.create_iam_role(app_name)
 
         # VPC for EC2
         vpc = ec2.Vpc.from_lookup(self, "DefaultVPC", is_default=True)
 
-        # EC2 Instance
-        instance = self.create_ec2_instance(app_name, vpc, role)
+        # EC2 Instances, one per shard
+        instances = self.create_fleet(app_name, vpc, role, bucket_name, instance_types, hibernate)
+
+        # Scripts the start/stop Lambdas run on the instance
+        self.create_host_scripts_deployment(bucket_name)
 
-        # Automatically start and stop ec2 instance
-        self.create_start_stop_role(instance, app_name, role, bucket_name)
+        # Automatically start and stop ec2 instance through Step Functions
+        state_machines = self.create_start_stop_role(instances, app_name, role, bucket_name, hibernate)
 
         # Create Athena table for analyzing trading data
-        self.create_athena_table(bucket_name)
+        database = self.create_athena_table(bucket_name)
+
+        # Table over the trade logs the log shipper streams, queried with simple_trader_cdk/log_query.py
+        self.create_logs_table(bucket_name, database)
 
-    def create_ec2_instance(self, app_name, vpc, role):
-        wd_path = f"/home/ec2-user/projects/{app_name}"
-        instance_type_str = "c6g.2xlarge"
+        # Phase timings of the start/stop flows, alarms on a late ready-to-trade and on failed flows
+        self.create_phase_dashboard(app_name, state_machines)
+
+    def create_fleet(self, app_name, vpc, role, bucket_name, instance_types, hibernate=False):
         key_pair_name = app_name + "KeyPair"
 
         ec2.CfnKeyPair(self, key_pair_name, key_name=key_pair_name)
@@ -52,19 +108,40 @@ class SimpleTraderCdkStack(Stack):
             "Allow SSH access"
         )
 
+        # Shard 0 keeps the logical id of the single instance the stack used to have
+        return [
+            self.create_ec2_instance(app_name, vpc, role, bucket_name, key_pair_name, security_group, shard, instance_type,
+                                     hibernate)
+            for shard, instance_type in enumerate(instance_types)
+        ]
+
+    def create_ec2_instance(self, app_name, vpc, role, bucket_name, key_pair_name, security_group, shard,
+                            instance_type_str, hibernate=False):
         instance = ec2.Instance(
-            self, app_name+"Instance",
+            self, app_name + "Instance" + (str(shard) if shard else ""),
             instance_type=ec2.InstanceType(f"{instance_type_str}"),  # Graviton processor
-            machine_image=ec2.MachineImage.latest_amazon_linux2(cpu_type=ec2.AmazonLinuxCpuType.ARM_64),
+            machine_image=ec2.MachineImage.from_ssm_parameter(GOLDEN_AMI_PARAMETER),  # Baked by GoldenAmiStack
             vpc=vpc,
             key_name=key_pair_name,
             security_group=security_group,
-            role=role
+            role=role,
+            block_devices=[ec2.BlockDevice(
+                device_name="/dev/xvda",
+                # Encrypted and big enough for the RAM of this instance type, 40 GB for a c6g.2xlarge
+                volume=ec2.BlockDeviceVolume.ebs(hibernation_root_volume_gb(instance_type_str),
+                    encrypted=True,
+                    volume_type=ec2.EbsDeviceVolumeType.GP3,
+                ),
+            )] if hibernate else None,
         )
+        if hibernate:
+            # Only takes effect on a new instance, CloudFormation replaces the instance to switch it on
+            instance.instance.hibernation_options = ec2.CfnInstance.HibernationOptionsProperty(configured=True)
+        Tags.of(instance).add("Shard", str(shard))
 
         # User Data Script for EC2 Instance
         # User Data script
-        user_data_script = """
+        user_data_script = f"""
 #!/bin/bash
 
 sudo systemctl enable crond
@@ -72,40 +149,16 @@ sudo systemctl enable crond
 sudo ln -sf /usr/share/zoneinfo/Asia/Kolkata /etc/localtime
 sudo timedatectl set-timezone Asia/Kolkata
 
-# Install development tools
-sudo yum groupinstall "Development Tools" -y
-sudo yum install gcc libffi-devel bzip2 bzip2-devel zlib-devel xz-devel wget make -y
-sudo yum install openssl11-devel -y
-sudo yum install -y openssl11
-sudo yum install -y sqlite-devel
-
-sudo yum remove -y openssl-devel
-
-# Create the base directory if it doesn't exist
-mkdir -p /home/ec2-user/installers
-
-# Install python 3.9.6
-cd /home/ec2-user/installers
-sudo wget https://www.python.org/ftp/python/3.9.6/Python-3.9.6.tgz
-sudo tar xzf Python-3.9.6.tgz
-
-cd Python-3.9.6/
-
-sudo make clean
-sudo ./configure --enable-optimizations
-sudo make altinstall
-python3.9 -m ensurepip --upgrade
-python3.9 -m pip install --upgrade pip
+# Compresses the end-of-day log archive, see host_scripts/trading/eod_upload.py
+sudo yum install -y zstd
 
+# Python 3.9.6, already baked in when launched from the golden AMI, else the tuned build from the bucket
+{python_install_script(bucket_name)}
 # Give back control to the user
 sudo chown -R ec2-user:ec2-user /home/ec2-user/
 
-# Create the cron job entries
-echo "55 8 * * * ec2-user /bin/bash -c 'cd /home/ec2-user/projects/SimpleTrader; export PYTHONPATH\=/home/ec2-user/projects/SimpleTrader/src && /usr/local/bin/python3.9 /home/ec2-user/projects/SimpleTrader/src/setup/pre_market_setup.py 2>&1'" | sudo tee -a /etc/crontab
-echo "14 9 * * * ec2-user /bin/bash -c 'cd /home/ec2-user/projects/SimpleTrader; export PYTHONPATH\=/home/ec2-user/projects/SimpleTrader/src && /usr/local/bin/python3.9 /home/ec2-user/projects/SimpleTrader/src/setup/setup.py 2>&1'" | sudo tee -a /etc/crontab
-
-# Restart cron to apply the new jobs
-sudo systemctl restart crond
+# The pre-market setup and trading process run as systemd timers with pinned cores, installed on every
+# start by host_scripts/trading/host_profile/host_profile.sh
 """
 
         instance.add_user_data(user_data_script)
@@ -115,48 +168,221 @@ sudo systemctl restart crond
 
         return instance
 
-    def create_start_stop_role(self, instance, app_name, role, bucket_name):
-        # https://aws-sdk-pandas.readthedocs.io/en/stable/layers.html
-        lambda_layer_arn = "arn:aws:lambda:ap-south-1:336392948345:layer:AWSSDKPandas-Python312:17"
+    def create_host_scripts_deployment(self, bucket_name):
+        # The helpers every host script imports land next to the scripts
+        bucket = s3.Bucket.from_bucket_name(self, "WorkingBucket", bucket_name)
+        s3deploy.BucketDeployment(self, "HostScriptsDeployment",
+            sources=[s3deploy.Source.asset("host_scripts/trading"), s3deploy.Source.asset("host_scripts/common")],
+            destination_bucket=bucket,
+            destination_key_prefix="host_scripts/trading/",
+        )
 
-        # Create Lambda functions to start and stop the instance
+    def create_start_stop_role(self, instances, app_name, role, bucket_name, hibernate=False):
+        # Pure-Python helpers (market calendar etc.) shared by the Lambdas, keeps pandas off the cold path
+        common_layer = _lambda.LayerVersion(self, "CommonLayer",
+            code=_lambda.Code.from_asset("lambda_layers/common"),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
+            description="Shared helpers for the SimpleTrader Lambdas",
+        )
+
+        # Full output of the SSM commands, the instance and the Lambdas share the role
+        command_output_environment = create_command_output(self, app_name, bucket_name, role, role)
+
+        # Create Lambda functions running the individual steps of starting and stopping the instance
         start_lambda = _lambda.Function(self, "Start"+app_name+"InstanceLambda",
             runtime=_lambda.Runtime.PYTHON_3_12,
             code=_lambda.Code.from_asset("lambda_functions/start"),
             handler="start.handler",
             role=role,
-            timeout=Duration.seconds(300),  # Increase timeout to 5 minutes
+            timeout=Duration.seconds(60),  # Steps are single API calls, waiting happens in the state machine
             environment={
-                "INSTANCE_ID": instance.instance_id,
+                "INSTANCE_IDS": ",".join(instance.instance_id for instance in instances),  # In shard order
                 "BUCKET_NAME" : bucket_name,
-                "APP_NAME" : app_name
+                "APP_NAME" : app_name,
+                "HIBERNATE" : "true" if hibernate else "false",
+                **command_output_environment
             },
-            layers=[_lambda.LayerVersion.from_layer_version_arn(self, "PandasLayer", lambda_layer_arn)],
+            layers=[common_layer],
         )
 
         stop_lambda = _lambda.Function(self, "Stop"+app_name+"InstanceLambda",
             runtime=_lambda.Runtime.PYTHON_3_12,
             code=_lambda.Code.from_asset("lambda_functions/stop"),
             handler="stop.handler",
-            timeout=Duration.seconds(300),  # Increase timeout to 5 minutes
+            timeout=Duration.seconds(60),  # Steps are single API calls, waiting happens in the state machine
             role=role,
             environment={
-                "INSTANCE_ID": instance.instance_id,
+                "INSTANCE_IDS": ",".join(instance.instance_id for instance in instances),  # In shard order
                 "BUCKET_NAME" : bucket_name,
-                "APP_NAME" : app_name
-            }
+                "APP_NAME" : app_name,
+                "HIBERNATE" : "true" if hibernate else "false",
+                **command_output_environment
+            },
+            layers=[common_layer],
         )
 
-        # Create EventBridge rules to trigger Lambda functions
+        ledger_lambda = self.create_ledger_lambda(app_name, role, bucket_name, common_layer)
+
+        start_state_machine = self.create_start_workflow(start_lambda)
+        stop_state_machine = self.create_stop_workflow(stop_lambda, ledger_lambda)
+
+        # Create EventBridge rules to trigger the state machines
         start_rule = events.Rule(self, "StartRule",
             schedule=events.Schedule.cron(minute="15", hour="3", week_day="MON-FRI")  # Every weekday at 8:45AM IST / 3:15AM UTC. DST should not affect this
         )
-        start_rule.add_target(targets.LambdaFunction(start_lambda))
+        start_rule.add_target(targets.SfnStateMachine(start_state_machine, input=events.RuleTargetInput.from_object({})))
 
         stop_rule = events.Rule(self, "StopRule",
             schedule=events.Schedule.cron(minute="10", hour="10", week_day="MON-FRI")  # Every weekday at 3:40PM IST / 10:10AM UTC. DST should not affect this
         )
-        stop_rule.add_target(targets.LambdaFunction(stop_lambda))
+        stop_rule.add_target(targets.SfnStateMachine(stop_state_machine, input=events.RuleTargetInput.from_object({})))
+
+        return {"Start": start_state_machine, "Stop": stop_state_machine}
+
+    def create_ledger_lambda(self, app_name, role, bucket_name, common_layer):
+        pandas_layer = _lambda.LayerVersion.from_layer_version_arn(self, "PandasLayer", AWS_SDK_PANDAS_LAYER_ARN)
+
+        # Converts the uploaded CSV ledger into date partitioned Parquet for Athena
+        ledger_lambda = _lambda.Function(self, app_name+"LedgerParquetLambda",
+            runtime=_lambda.Runtime.PYTHON_3_12,
+            code=_lambda.Code.from_asset("lambda_functions/ledger"),
+            handler="ledger_parquet.handler",
+            role=role,
+            timeout=Duration.minutes(15),  # The first run converts the whole history
+            memory_size=1024,
+            environment={
+                "BUCKET_NAME" : bucket_name,
+                "APP_NAME" : app_name,
+                "LEDGER_PREFIX" : f"{app_name}Ledger/",
+                "PARQUET_PREFIX" : f"{app_name}LedgerParquet/",
+                "LEDGER_COLUMNS" : ledger_schema.columns_json(),
+            },
+            layers=[common_layer, pandas_layer],
+        )
+
+        # Merges the daily ledger fragments into one file per month for the pandas based analytics
+        compaction_lambda = _lambda.Function(self, app_name+"LedgerCompactionLambda",
+            runtime=_lambda.Runtime.PYTHON_3_12,
+            code=_lambda.Code.from_asset("lambda_functions/ledger"),
+            handler="ledger_compaction.handler",
+            role=role,
+            timeout=Duration.minutes(15),
+            memory_size=1024,
+            environment={
+                "BUCKET_NAME" : bucket_name,
+                "APP_NAME" : app_name,
+                "LEDGER_PREFIX" : f"{app_name}Ledger/",
+                "COMPACTED_PREFIX" : f"{app_name}LedgerCompacted/",
+                "LEDGER_COLUMNS" : ledger_schema.columns_json(),
+            },
+            layers=[common_layer, pandas_layer],
+        )
+
+        compaction_rule = events.Rule(self, "LedgerCompactionRule",
+            schedule=events.Schedule.cron(minute="30", hour="20")  # Every night at 2:00AM IST / 8:30PM UTC, well after the stop flow
+        )
+        compaction_rule.add_target(targets.LambdaFunction(compaction_lambda))
+
+        return ledger_lambda
+
+    def create_start_workflow(self, start_lambda):
+        workflow = InstanceWorkflow(self, "StartWorkflow", start_lambda, timeout=Duration.minutes(25))
+
+        start = workflow.step("StartInstance", "start_instance") \
+            .next(workflow.wait_for_instance_state("Running", "running")) \
+            .next(workflow.poll("AgentOnline", "check_agent", done=sfn.Condition.boolean_equals("$.agent_online", True))) \
+            .next(workflow.command("Bootstrap", "send_bootstrap")) \
+            .next(workflow.command("Verify", "send_verify")) \
+            .next(workflow.step("MarkReady", "mark_ready")) \
+            .next(sfn.Succeed(workflow, "ReadyToTrade"))
+
+        definition = workflow.step("CheckHoliday", "check_holiday").next(
+            sfn.Choice(workflow, "IsHoliday")
+                .when(sfn.Condition.boolean_equals("$.holiday", True), sfn.Succeed(workflow, "Holiday"))
+                .otherwise(start)
+        )
+        return workflow.state_machine(definition)
+
+    def create_stop_workflow(self, stop_lambda, ledger_lambda):
+        workflow = InstanceWorkflow(self, "StopWorkflow", stop_lambda, timeout=Duration.minutes(45))
+
+        # The logs are still on the volume if the upload fails, so stop the instance regardless. Failing
+        # commands and Lambda errors alike end in StopInstance, never with the instance running overnight.
+        stop = workflow.step("StopInstance", "stop_instance")
+        upload = workflow.command("UploadLogs", "send_upload", on_failure=stop)
+        # Without a snapshot the next morning falls back to the live pre-market setup, so carry on
+        definition = workflow.command("ContextSnapshot", "send_snapshot", on_failure=upload) \
+            .next(upload) \
+            .next(stop) \
+            .next(workflow.wait_for_instance_state("Stopped", "stopped", interval=Duration.seconds(10))) \
+            .next(workflow.step("ConvertLedger", "convert_ledger", ledger_lambda)) \
+            .next(sfn.Succeed(workflow, "InstanceStopped"))
+        return workflow.state_machine(definition)
+
+    def create_phase_dashboard(self, app_name, state_machines):
+        # Published as EMF by lambda_layers/common/python/phase_metrics.py
+        namespace = "SimpleTrader"
+        ready_at = cloudwatch.Metric(namespace=namespace, metric_name="ReadyAtMinuteIST",
+            dimensions_map={"App": app_name}, statistic="Maximum", period=Duration.days(1))
+        start_to_ready = cloudwatch.Metric(namespace=namespace, metric_name="StartToReady",
+            dimensions_map={"App": app_name}, statistic="Maximum", period=Duration.days(1))
+
+        def phases(search, label):
+            return cloudwatch.MathExpression(
+                expression=f"SEARCH('{{{namespace},App,Phase}} MetricName=\"PhaseDuration\" App=\"{app_name}\" {search}', 'Maximum', 86400)",
+                label=label,
+                period=Duration.days(1),
+            )
+
+        dashboard = cloudwatch.Dashboard(self, "PhaseDashboard", dashboard_name=f"{app_name}Phases")
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="Ready to trade (minute of day, IST)", left=[ready_at],
+                left_annotations=[cloudwatch.HorizontalAnnotation(value=READY_BY_MINUTE_IST, label="09:05 IST")],
+                width=12),
+            cloudwatch.GraphWidget(title="Start to ready (seconds)", left=[start_to_ready], width=12),
+        )
+        dashboard.add_widgets(
+            # Unquoted values match the tokens of instance.<step> and lambda.<step>, a quoted one only the exact
+            # value. Lambda steps like lambda.describe_instance also contain the token instance.
+            cloudwatch.GraphWidget(title="Instance phases (seconds)", left=[phases("Phase=instance NOT Phase=lambda", "")],
+                stacked=True, width=12),
+            cloudwatch.GraphWidget(title="Lambda steps (seconds)", left=[phases("Phase=lambda", "")], width=12),
+        )
+
+        # The bot starts at 09:14, ready after 09:05 leaves too little room to fix anything
+        alerts_topic = sns.Topic(self, "AlertsTopic", display_name=f"{app_name} alerts")
+        alert_email = os.getenv("ALERT_EMAIL")
+        if alert_email:
+            alerts_topic.add_subscription(subscriptions.EmailSubscription(alert_email))
+
+        late_alarm = cloudwatch.Alarm(self, "LateReadyAlarm",
+            metric=ready_at.with_(period=Duration.hours(1)),
+            threshold=READY_BY_MINUTE_IST,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            evaluation_periods=1,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,  # Holidays and weekends never get ready
+            alarm_description="Trading instance became ready to trade after 09:05 IST",
+        )
+        late_alarm.add_alarm_action(cloudwatch_actions.SnsAction(alerts_topic))
+
+        # A start that fails outright never publishes ReadyAtMinuteIST, and a failed stop leaves the instance running
+        for name, state_machine in state_machines.items():
+            failed_alarm = cloudwatch.Alarm(self, name + "FlowFailedAlarm",
+                metric=cloudwatch.MathExpression(
+                    expression="FILL(failed, 0) + FILL(timed_out, 0)",
+                    using_metrics={
+                        "failed": state_machine.metric_failed(statistic="Sum"),
+                        "timed_out": state_machine.metric_timed_out(statistic="Sum"),
+                    },
+                    period=Duration.minutes(5),
+                ),
+                threshold=0,
+                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                evaluation_periods=1,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                alarm_description=f"The {name.lower()} flow of the trading instance failed or timed out",
+            )
+            failed_alarm.add_alarm_action(cloudwatch_actions.SnsAction(alerts_topic))
 
     def create_iam_role(self, app_name):
         role = iam.Role(self, app_name+"Role",
@@ -196,6 +422,15 @@ sudo systemctl restart crond
             )
         )
 
+        role.add_to_policy(
+            iam.PolicyStatement(
+                sid="InstanceCommandControl",
+                effect=iam.Effect.ALLOW,
+                actions=["ssm:DescribeInstanceInformation", "ssm:CancelCommand", "ssm:ListCommandInvocations"],
+                resources=["*"],
+            )
+        )
+
         role.add_to_policy(
             iam.PolicyStatement(
                 sid="SecretsManagerRead",
@@ -208,76 +443,108 @@ sudo systemctl restart crond
         return role
 
     def create_athena_table(self, bucket_name: str):
-        glue_client = boto3.client('glue')
-        
-        # Create database if it doesn't exist
-        try:
-            glue_client.create_database(
-                DatabaseInput={
-                    'Name': 'trading_analytics'
-                }
-            )
-        except glue_client.exceptions.AlreadyExistsException:
-            pass
-
-        # Create table
-        table_input = {
-            'Name': 'order_ledger',
-            'TableType': 'EXTERNAL_TABLE',
-            'Parameters': {
-                'classification': 'csv',
-                'typeOfData': 'file',
-                'areColumnsQuoted': 'false',
-                'delimiter': ',',
-                'skip.header.line.count': '1'
-            },
-            'StorageDescriptor': {
-                'Location': f's3://{bucket_name}/SimpleTraderLedger/',
-                'InputFormat': 'org.apache.hadoop.mapred.TextInputFormat',
-                'OutputFormat': 'org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
-                'SerdeInfo': {
-                    'SerializationLibrary': 'org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe',
-                    'Parameters': {
-                        'serialization.format': ',',
-                        'field.delim': ',',
-                        'timestamp.formats': 'yyyy-MM-dd HH:mm:ss'
-                    }
+        database = glue.CfnDatabase(self, "TradingAnalyticsDatabase",
+            catalog_id=self.account,
+            database_input=glue.CfnDatabase.DatabaseInputProperty(name=ledger_schema.DATABASE_NAME),
+        )
+
+        # Table over the Parquet written by the ledger Lambda, partitions come from projection
+        # so queries filtered on trade_date only read the matching days
+        parquet_location = f's3://{bucket_name}/SimpleTraderLedgerParquet/'
+        table = glue.CfnTable(self, "OrderLedgerTable",
+            catalog_id=self.account,
+            database_name=ledger_schema.DATABASE_NAME,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=ledger_schema.TABLE_NAME,
+                table_type='EXTERNAL_TABLE',
+                parameters={
+                    'classification': 'parquet',
+                    'parquet.compression': 'ZSTD',
+                    'projection.enabled': 'true',
+                    'projection.trade_date.type': 'date',
+                    'projection.trade_date.format': 'yyyy-MM-dd',
+                    'projection.trade_date.range': '2024-01-01,NOW',
+                    'projection.trade_date.interval': '1',
+                    'projection.trade_date.interval.unit': 'DAYS',
+                    'storage.location.template': parquet_location + 'trade_date=${trade_date}/'
                 },
-                'Columns': [
-                    {'Name': 'symbol', 'Type': 'string'},
-                    {'Name': 'entry_time', 'Type': 'timestamp'},
-                    {'Name': 'entry_price', 'Type': 'double'},
-                    {'Name': 'entry_qty', 'Type': 'int'},
-                    {'Name': 'entry_type', 'Type': 'string'},
-                    {'Name': 'entry_value', 'Type': 'double'},
-                    {'Name': 'entry_tag', 'Type': 'string'},
-                    {'Name': 'exit_time', 'Type': 'timestamp'},
-                    {'Name': 'exit_price', 'Type': 'double'},
-                    {'Name': 'exit_qty', 'Type': 'int'},
-                    {'Name': 'exit_type', 'Type': 'string'},
-                    {'Name': 'exit_value', 'Type': 'double'},
-                    {'Name': 'exit_tag', 'Type': 'string'},
-                    {'Name': 'buy_price', 'Type': 'double'},
-                    {'Name': 'sell_price', 'Type': 'double'},
-                    {'Name': 'buy_value', 'Type': 'double'},
-                    {'Name': 'sell_value', 'Type': 'double'},
-                    {'Name': 'charges', 'Type': 'double'},
-                    {'Name': 'gross_pnl', 'Type': 'double'},
-                    {'Name': 'net_pnl', 'Type': 'double'}
-                ]
-            }
-        }
-
-        try:
-            glue_client.create_table(
-                DatabaseName='trading_analytics',
-                TableInput=table_input
-            )
-            print("Successfully created Athena table")
-        except glue_client.exceptions.AlreadyExistsException:
-            print("Table already exists. Updating schema...")
-            glue_client.update_table(
-                DatabaseName='trading_analytics',
-                TableInput=table_input
-            )
-            print("Successfully updated Athena table")
+                partition_keys=[
+                    glue.CfnTable.ColumnProperty(name=column.name, type=column.type)
+                    for column in ledger_schema.PARTITION_KEYS
+                ],
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    location=parquet_location,
+                    input_format='org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat',
+                    output_format='org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat',
+                    serde_info=glue.CfnTable.SerdeInfoProperty(
+                        serialization_library='org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe',
+                        parameters={'serialization.format': '1'},
+                    ),
+                    columns=[
+                        glue.CfnTable.ColumnProperty(name=column.name, type=column.type)
+                        for column in ledger_schema.LEDGER_COLUMNS
+                    ],
+                ),
+            ),
+        )
+        table.add_dependency(database)
+        return database
+
+    def create_logs_table(self, bucket_name, database):
+        # JSON lines as defined in log_schema.py, gzip chunks are read as they are. Only the days a
+        # query filters on log_date are listed and scanned, thanks to partition projection.
+        logs_location = f's3://{bucket_name}/{log_schema.LOGS_PREFIX}/'
+        table = glue.CfnTable(self, "TradeLogsTable",
+            catalog_id=self.account,
+            database_name=log_schema.DATABASE_NAME,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=log_schema.TABLE_NAME,
+                table_type='EXTERNAL_TABLE',
+                parameters={
+                    'classification': 'json',
+                    'projection.enabled': 'true',
+                    'projection.log_date.type': 'date',
+                    'projection.log_date.format': 'yyyy-MM-dd',
+                    'projection.log_date.range': '2024-01-01,NOW',
+                    'projection.log_date.interval': '1',
+                    'projection.log_date.interval.unit': 'DAYS',
+                    # Shards log under <date>/shard=<n>/, read along with the rest of the day
+                    'storage.location.template': logs_location + '${log_date}/'
+                },
+                partition_keys=[
+                    glue.CfnTable.ColumnProperty(name=column.name, type=column.type)
+                    for column in log_schema.PARTITION_KEYS
+                ],
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    location=logs_location,
+                    input_format='org.apache.hadoop.mapred.TextInputFormat',
+                    output_format='org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
+                    serde_info=glue.CfnTable.SerdeInfoProperty(
+                        serialization_library='org.openx.data.jsonserde.JsonSerDe',
+                        parameters={'ignore.malformed.json': 'true'},
+                    ),
+                    columns=[
+                        glue.CfnTable.ColumnProperty(name=column.name, type=column.type)
+                        for column in log_schema.LOG_COLUMNS
+                    ],
+                ),
+            ),
+        )
+        table.add_dependency(database)
+
+        athena.CfnWorkGroup(self, "LogsWorkGroup",
+            name=log_schema.WORKGROUP_NAME,
+            description="Investigations over the SimpleTrader trade logs, see log_query.py",
+            recursive_delete_option=True,
+            work_group_configuration=athena.CfnWorkGroup.WorkGroupConfigurationProperty(
+                bytes_scanned_cutoff_per_query=log_schema.BYTES_SCANNED_CUTOFF,
+                enforce_work_group_configuration=True,
+                publish_cloud_watch_metrics_enabled=True,
+                engine_version=athena.CfnWorkGroup.EngineVersionProperty(
+                    selected_engine_version="Athena engine version 3",
+                ),
+                result_configuration=athena.CfnWorkGroup.ResultConfigurationProperty(
+                    output_location=f's3://{bucket_name}/athena-results/{log_schema.WORKGROUP_NAME}/',
+                ),
+            ),
+        )
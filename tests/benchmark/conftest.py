@@ -0,0 +1,38 @@
+import boto3
+import pytest
+from botocore.awsrequest import AWSResponse
+
+
+class AwsStandIn:
+    """Answers every AWS API call made through boto3.client() with a canned response and counts them.
+
+    responses maps "<service>.<operation_name>" to a response dict, or to a list of them returned
+    in order with the last one repeating. Like a Stubber, but for every client the code creates,
+    including the ones created per call inside the handlers.
+    """
+    def __init__(self):
+        self.responses = {}
+        self.calls = []
+
+    def reset(self, responses):
+        self.responses = {key: list(value) if isinstance(value, list) else [value] for key, value in responses.items()}
+        self.calls = []
+
+    def __call__(self, model, **kwargs):
+        key = f"{model.service_model.service_name}.{model.name}"
+        self.calls.append(key)
+        if key not in self.responses:
+            raise AssertionError(f"No stand-in response for {key}")
+        queue = self.responses[key]
+        parsed = queue.pop(0) if len(queue) > 1 else queue[0]
+        return AWSResponse(None, 200, {}, None), dict(parsed, ResponseMetadata={"HTTPStatusCode": 200})
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """A fresh default boto3 session whose clients are all answered by an AwsStandIn"""
+    stand_in = AwsStandIn()
+    session = boto3.session.Session()
+    session.events.register("before-call", stand_in)
+    monkeypatch.setattr(boto3, "DEFAULT_SESSION", session)
+    return stand_in
@@ -0,0 +1,192 @@
+"""Offline benchmark of the step Lambdas, compared against baseline.json.
+
+Every handler is driven through the happy path of its state machine with all AWS calls answered by
+the AwsStandIn. Per handler it records the API calls of every step, the median wall time of the
+whole path and the cold import time in a fresh interpreter. The test fails when a step makes more
+API calls than the baseline. Timings depend on the machine, so they are only measured, printed and
+compared against the baseline's tolerance when asked for.
+
+    python -m pytest -q tests/benchmark                                  (API calls only)
+    BENCHMARK_TIMINGS=1 python -m pytest -q tests/benchmark             (and timings)
+    BENCHMARK_UPDATE_BASELINE=1 python -m pytest -q tests/benchmark    (after an intended change)
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import pytest
+
+from tests.conftest import ROOT_DIR
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+UPDATE_BASELINE = os.environ.get("BENCHMARK_UPDATE_BASELINE") == "1"
+TIMINGS = UPDATE_BASELINE or os.environ.get("BENCHMARK_TIMINGS") == "1"
+FLOW_RUNS = 20
+IMPORT_RUNS = 3
+
+INSTANCE_ID = "i-0123456789abcdef0"
+COMMAND_ID = "0f6e6a5c-1b2d-4c3e-9f8a-7b6c5d4e3f2a"
+PUBLIC_IP = "13.200.1.2"
+ENV = {
+    "INSTANCE_ID": INSTANCE_ID,  # The analytics site
+    "INSTANCE_IDS": INSTANCE_ID,  # The trading fleet
+    "BUCKET_NAME": "simpletrader-working-bucket",
+    "APP_NAME": "SimpleTrader",
+}
+
+
+def instances(state):
+    return {"Reservations": [{"Instances": [{"InstanceId": INSTANCE_ID, "State": {"Name": state}}]}]}
+
+
+AGENT_ONLINE = {"InstanceInformationList": [{"InstanceId": INSTANCE_ID, "PingStatus": "Online"}]}
+COMMAND_SENT = {"Command": {"CommandId": COMMAND_ID}}
+COMMAND_DONE = {"Status": "Success", "StandardOutputContent": "::step-start::a::1.0\n::step-end::a::2.5\n"}
+
+# Happy path of each state machine, see create_start_workflow/create_stop_workflow in the stacks
+FLOWS = {
+    "start": {
+        "module": ("start", "start"),
+        "steps": ["check_holiday", "start_instance", "describe_instance", "check_agent", "send_bootstrap",
+                  "poll_command", "send_verify", "poll_command", "mark_ready"],
+        "responses": {
+            "ec2.DescribeInstances": [instances("stopped"), instances("running")],
+            "ec2.StartInstances": {},
+            "ssm.DescribeInstanceInformation": AGENT_ONLINE,
+            "ssm.SendCommand": COMMAND_SENT,
+            "ssm.GetCommandInvocation": COMMAND_DONE,
+        },
+    },
+    "stop": {
+        "module": ("stop", "stop"),
+        "steps": ["send_snapshot", "poll_command", "send_upload", "poll_command", "stop_instance",
+                  "describe_instance"],
+        "responses": {
+            "ssm.SendCommand": COMMAND_SENT,
+            "ssm.GetCommandInvocation": COMMAND_DONE,
+            "ec2.StopInstances": {},
+            "ec2.DescribeInstances": instances("stopped"),
+        },
+    },
+    "website_start": {
+        "module": ("analytics_start", "website_start"),
+        "steps": ["start_instance", "describe_instance", "associate_eip", "update_route53", "check_agent",
+                  "send_bootstrap", "poll_command", "send_verify", "poll_command"],
+        "responses": {
+            "ec2.DescribeInstances": [instances("stopped"), instances("running")],
+            "ec2.StartInstances": {},
+            "ec2.DescribeAddresses": {"Addresses": [{"AllocationId": "eipalloc-1", "PublicIp": PUBLIC_IP,
+                                                     "InstanceId": INSTANCE_ID}]},
+            "route53.ListHostedZonesByName": {"HostedZones": [{"Id": "/hostedzone/Z1",
+                                                               "Name": "simple-trader-analytics.click."}]},
+            "route53.ListResourceRecordSets": {"ResourceRecordSets": [{
+                "Name": "simple-trader-analytics.click.", "Type": "A", "ResourceRecords": [{"Value": PUBLIC_IP}]}]},
+            "ssm.DescribeInstanceInformation": AGENT_ONLINE,
+            "ssm.SendCommand": COMMAND_SENT,
+            "ssm.GetCommandInvocation": COMMAND_DONE,
+        },
+    },
+    "website_stop": {
+        "module": ("analytics_stop", "website_stop"),
+        "steps": ["stop_instance", "describe_instance"],
+        "responses": {
+            "ec2.StopInstances": {},
+            "ec2.DescribeInstances": instances("stopped"),
+        },
+    },
+}
+
+IMPORT_SNIPPET = """
+import importlib.util, sys, time
+sys.path[:0] = {paths!r}
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location({module!r}, {path!r})
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+print((time.perf_counter() - started) * 1000)
+"""
+
+
+def cold_import_ms(directory, module):
+    """Import time of the handler module in a fresh interpreter, like a Lambda cold start"""
+    snippet = IMPORT_SNIPPET.format(
+        paths=[os.path.join(ROOT_DIR, "lambda_layers", "common", "python")],
+        module=module,
+        path=os.path.join(ROOT_DIR, "lambda_functions", directory, module + ".py"),
+    )
+    env = dict(os.environ, **ENV)
+    timings = [float(subprocess.run([sys.executable, "-c", snippet], env=env, capture_output=True, text=True,
+                                    check=True).stdout) for _ in range(IMPORT_RUNS)]
+    return round(min(timings), 1)
+
+
+def run_flow(handler, flow, aws):
+    """One pass over the flow, returns [[step, api calls]]"""
+    aws.reset(flow["responses"])
+    state, api_calls = {}, []
+    for step in flow["steps"]:
+        before = len(aws.calls)
+        state = handler({"step": step, "state": state}, None)
+        api_calls.append([step, len(aws.calls) - before])
+    return api_calls
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return {"tolerance": 1.0, "slack_ms": 50, "handlers": {}}
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+def save_baseline(name, result):
+    baseline = load_baseline()
+    baseline["handlers"][name] = result
+    document = json.dumps(baseline, indent=2, sort_keys=True)
+    # One [step, calls] pair per line
+    document = re.sub(r'\[\s+("\w+"),\s+(\d+)\s+\]', r"[\1, \2]", document)
+    with open(BASELINE_PATH, "w") as f:
+        f.write(document + "\n")
+
+
+@pytest.mark.parametrize("name", sorted(FLOWS))
+def test_handler_benchmark(name, aws, load_lambda, monkeypatch, capsys):
+    flow = FLOWS[name]
+    for key, value in ENV.items():
+        monkeypatch.setenv(key, value)
+    lambda_module = load_lambda(*flow["module"])
+    if hasattr(lambda_module, "is_holiday"):
+        monkeypatch.setattr(lambda_module, "is_holiday", lambda: False)
+
+    api_calls = run_flow(lambda_module.handler, flow, aws)
+    result = {"api_calls": api_calls}
+    if TIMINGS:
+        durations = []
+        for _ in range(FLOW_RUNS):
+            started = time.perf_counter()
+            run_flow(lambda_module.handler, flow, aws)
+            durations.append((time.perf_counter() - started) * 1000)
+        result["flow_ms"] = round(statistics.median(durations), 1)
+        result["import_ms"] = cold_import_ms(*flow["module"])
+        with capsys.disabled():
+            print(f"\n{name}: {sum(calls for _, calls in api_calls)} API calls, flow {result['flow_ms']} ms, "
+                  f"cold import {result['import_ms']} ms")
+
+    if UPDATE_BASELINE:
+        save_baseline(name, result)
+        return
+
+    baseline = load_baseline()
+    expected = baseline["handlers"].get(name)
+    assert expected, f"No baseline for {name}, run with BENCHMARK_UPDATE_BASELINE=1"
+    assert [step for step, _ in api_calls] == [step for step, _ in expected["api_calls"]], \
+        f"The {name} flow changed, update the baseline"
+    for (step, calls), (_, expected_calls) in zip(api_calls, expected["api_calls"]):
+        assert calls <= expected_calls, f"{name}.{step} makes {calls} API calls, baseline {expected_calls}"
+    if not TIMINGS:
+        return
+    for metric in ["flow_ms", "import_ms"]:
+        limit = expected[metric] * (1 + baseline["tolerance"]) + baseline["slack_ms"]
+        assert result[metric] <= limit, f"{name} {metric} {result[metric]} exceeds {limit:.1f} (baseline {expected[metric]})"
@@ -0,0 +1,83 @@
+import importlib.util
+import json
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Make the shared Lambda layer importable the same way the Lambda runtime does
+sys.path.insert(0, os.path.join(ROOT_DIR, "lambda_layers", "common", "python"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "host_scripts", "trading"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "host_scripts", "analytics"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "host_scripts", "python_build"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "host_scripts", "common"))
+
+# Lambda modules create boto3 clients at import, tests only ever talk to stubs
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-south-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+
+@pytest.fixture
+def load_lambda():
+    """Imports lambda_functions/<directory>/<module>.py the way the Lambda runtime would"""
+    def load(directory, module):
+        path = os.path.join(ROOT_DIR, "lambda_functions", directory, module + ".py")
+        spec = importlib.util.spec_from_file_location(module, path)
+        lambda_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(lambda_module)
+        return lambda_module
+    return load
+
+
+class FakeBucket:
+    """Local directory standing in for the working bucket, replaces the AWS CLI helpers of host scripts"""
+    def __init__(self, root, monkeypatch):
+        self.root = root
+        self.monkeypatch = monkeypatch
+        self.downloads = []
+        self.metadata = {}
+
+    def patch(self, module, *names):
+        """Swaps the given S3 helpers of a host script for the local ones, returns the bucket directory"""
+        for name in names:
+            self.monkeypatch.setattr(module, name, getattr(self, name))
+        return self.root
+
+    def s3_get(self, bucket_name, key, dest):
+        self.downloads.append(key)
+        shutil.copyfile(self.root / key, dest)
+
+    def s3_put(self, src, bucket_name, key):
+        (self.root / key).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(src, self.root / key)
+
+    def s3_upload(self, path, bucket_name, key, object_metadata, env=None):
+        self.s3_put(path, bucket_name, key)
+        self.metadata[key] = object_metadata
+
+    def s3_copy(self, bucket_name, src_key, dest_key):
+        self.s3_put(self.root / src_key, bucket_name, dest_key)
+
+    def s3_exists(self, bucket_name, key):
+        return (self.root / key).exists()
+
+    def s3_sync(self, bucket_name, prefix, dest):
+        shutil.copytree(self.root / prefix, dest, dirs_exist_ok=True)
+
+    def s3_read_json(self, bucket_name, key):
+        return json.loads((self.root / key).read_text())
+
+    def s3_write_json(self, document, bucket_name, key):
+        (self.root / key).parent.mkdir(parents=True, exist_ok=True)
+        (self.root / key).write_text(json.dumps(document))
+
+
+@pytest.fixture
+def fake_bucket(tmp_path, monkeypatch):
+    root = tmp_path / "bucket"
+    root.mkdir()
+    return FakeBucket(root, monkeypatch)
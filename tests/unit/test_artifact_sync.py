@@ -0,0 +1,102 @@
+import importlib.util
+import json
+import os
+import sys
+import zipfile
+
+import pytest
+
+import artifact_sync
+
+
+@pytest.fixture
+def bucket(fake_bucket):
+    fake_bucket.patch(artifact_sync, "s3_get", "s3_put", "s3_copy", "s3_exists", "s3_read_json", "s3_write_json")
+    return fake_bucket
+
+
+def write_artifacts(source_dir, config="LIVE = True\n"):
+    source_dir.mkdir(exist_ok=True)
+    with zipfile.ZipFile(source_dir / "repo.zip", "w") as archive:
+        archive.writestr("src/setup/setup.py", "import json\nfrom strategy import signals\nprint('setup')\n")
+        archive.writestr("src/strategy/__init__.py", "")
+        archive.writestr("src/strategy/signals.py", "import decimal\n")
+        archive.writestr("src/config.py", "LIVE = False\n")
+    (source_dir / "config.py").write_text(config)
+    (source_dir / "requirements.txt").write_text("requests\n")
+    (source_dir / "keys.json").write_text("{}")
+
+
+def test_sync_only_fetches_changed_artifacts(tmp_path, bucket):
+    source_dir = tmp_path / "build"
+    app_dir = str(tmp_path / "projects" / "SimpleTrader")
+
+    write_artifacts(source_dir)
+    artifact_sync.publish("bucket", str(source_dir))
+    artifact_sync.sync("bucket", app_dir)
+    assert os.path.islink(app_dir)
+    assert open(os.path.join(app_dir, "src", "config.py")).read() == "LIVE = True\n"
+
+    write_artifacts(source_dir, config="LIVE = True\nQTY = 2\n")
+    artifact_sync.publish("bucket", str(source_dir))
+    bucket.downloads.clear()
+    artifact_sync.sync("bucket", app_dir)
+
+    fetched = [key for key in bucket.downloads if key.startswith("artifacts/")]
+    assert len(fetched) == 1 and fetched[0].endswith("/config.py")
+    assert "QTY = 2" in open(os.path.join(app_dir, "src", "config.py")).read()
+
+
+def test_rollback_restores_previous_manifest(tmp_path, bucket):
+    source_dir = tmp_path / "build"
+    write_artifacts(source_dir)
+    first = artifact_sync.publish("bucket", str(source_dir))
+    write_artifacts(source_dir, config="LIVE = False\n")
+    second = artifact_sync.publish("bucket", str(source_dir))
+
+    assert second["previous"] == first["id"]
+    assert artifact_sync.rollback("bucket")["id"] == first["id"]
+    assert artifact_sync.current_manifest("bucket")["id"] == first["id"]
+
+
+def test_root_copies_follow_the_current_manifest(tmp_path, bucket):
+    source_dir = tmp_path / "build"
+    root_config = bucket.root / "config.py"
+    write_artifacts(source_dir, config="A = 1\n")
+    first = artifact_sync.publish("bucket", str(source_dir))
+    write_artifacts(source_dir, config="B = 1\n")
+    artifact_sync.publish("bucket", str(source_dir))
+    assert root_config.read_text() == "B = 1\n"
+
+    # Republishing A finds its blob already uploaded, the root copy still has to move back
+    write_artifacts(source_dir, config="A = 1\n")
+    artifact_sync.publish("bucket", str(source_dir))
+    assert root_config.read_text() == "A = 1\n"
+
+    artifact_sync.rollback("bucket")
+    assert root_config.read_text() == "B = 1\n"
+    artifact_sync.pin("bucket", first["id"])
+    assert root_config.read_text() == "A = 1\n"
+
+
+def test_release_is_compiled_and_profiled(tmp_path, bucket, monkeypatch):
+    source_dir = tmp_path / "build"
+    app_dir = str(tmp_path / "projects" / "SimpleTrader")
+    write_artifacts(source_dir)
+    artifact_sync.publish("bucket", str(source_dir))
+    artifact_sync.sync("bucket", app_dir)
+
+    # Bytecode for this interpreter is already there before the first start
+    signals = os.path.join(app_dir, "src", "strategy", "signals.py")
+    assert os.path.exists(importlib.util.cache_from_source(signals))
+
+    written = {}
+    monkeypatch.setattr(artifact_sync, "s3_write_json", lambda document, bucket_name, key: written.update({key: document}))
+    report = artifact_sync.profile("bucket", app_dir, sys.executable)
+
+    assert report["imports"] == ["from strategy import signals", "import json"]
+    assert report["failed"] == {}
+    assert any(row["module"] == "strategy.signals" for row in report["slowest_cumulative"])
+    [key] = written
+    assert key.startswith("artifacts/") and key.endswith(f"/importtime-py{sys.version_info[0]}{sys.version_info[1]}.json")
+    json.dumps(written[key])
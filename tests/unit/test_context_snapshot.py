@@ -0,0 +1,41 @@
+import os
+import shutil
+
+import pytest
+
+import context_snapshot
+
+PRE_MARKET_SETUP = """
+import os
+os.makedirs("historical_context", exist_ok=True)
+with open("historical_context/RELIANCE.csv", "w") as f:
+    f.write("date,close\\n" + os.environ["SIMPLETRADER_SESSION_DATE"] + ",2950.5\\n")
+"""
+
+
+@pytest.fixture
+def bucket(fake_bucket):
+    return fake_bucket.patch(context_snapshot, "s3_put", "s3_sync", "s3_exists", "s3_read_json", "s3_write_json")
+
+
+def test_snapshot_built_in_the_evening_is_restored_in_the_morning(tmp_path, bucket):
+    app_dir = tmp_path / "projects" / "SimpleTrader"
+    (app_dir / "src" / "setup").mkdir(parents=True)
+    (app_dir / "src" / "setup" / "pre_market_setup.py").write_text(PRE_MARKET_SETUP)
+
+    assert context_snapshot.restore("bucket", str(app_dir), "2025-01-02") == context_snapshot.NO_SNAPSHOT
+
+    manifest = context_snapshot.build("bucket", str(app_dir), "2025-01-02")
+    assert "RELIANCE.csv" in manifest["files"]
+    shutil.rmtree(app_dir / "historical_context")
+
+    assert context_snapshot.restore("bucket", str(app_dir), "2025-01-02") == 0
+    context_dir = app_dir / "historical_context"
+    assert os.path.islink(context_dir)
+    assert "2025-01-02,2950.5" in (context_dir / "RELIANCE.csv").read_text()
+
+    # Tampered files are caught by the manifest
+    (bucket / "context-snapshots/2025-01-02/files/RELIANCE.csv").write_text("date,close\n")
+    shutil.rmtree(tmp_path / "projects" / ".context")
+    with pytest.raises(RuntimeError):
+        context_snapshot.restore("bucket", str(app_dir), "2025-01-02")
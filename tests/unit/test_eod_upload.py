@@ -0,0 +1,89 @@
+import hashlib
+import os
+import shutil
+import tarfile
+
+import pytest
+
+import eod_upload
+
+
+@pytest.fixture
+def bucket(fake_bucket, monkeypatch):
+    """Keeps the metadata of every upload for the verification head request"""
+    def s3_head(bucket_name, key):
+        path = fake_bucket.root / key
+        return {"ContentLength": path.stat().st_size, "Metadata": fake_bucket.metadata[key],
+                "ETag": f'"{eod_upload.multipart_etag(str(path))}"'}
+
+    monkeypatch.setattr(eod_upload, "configure_transfers", lambda work_dir: None)
+    monkeypatch.setattr(eod_upload, "s3_head", s3_head)
+    return fake_bucket.patch(eod_upload, "s3_upload", "s3_put")
+
+
+def test_day_of_logs_is_archived_verified_and_cleaned_up(tmp_path, bucket):
+    logs = tmp_path / "trade_logs" / "2024-01-02"
+    logs.mkdir(parents=True)
+    (logs / "orders.log").write_text('{"symbol": "RELIANCE"}\n' * 1000)
+    work_dir = tmp_path / "eod"
+
+    key = eod_upload.upload("bucket", str(logs), "SimpleTraderLogArchive/2024-01-02/", "trade_logs-2024-01-02",
+                            str(work_dir))
+
+    archive = bucket / key
+    assert key.startswith("SimpleTraderLogArchive/2024-01-02/trade_logs-2024-01-02.tar.")
+    digest, name = (bucket / (key + ".sha256")).read_text().split()
+    assert digest == hashlib.sha256(archive.read_bytes()).hexdigest() and name == archive.name
+    if key.endswith(".tar.gz"):
+        with tarfile.open(archive) as tar:
+            assert tar.getnames() == ["2024-01-02", "2024-01-02/orders.log"]
+    assert os.listdir(work_dir) == []
+
+
+def test_mismatching_upload_is_retried_then_fails(tmp_path, bucket, monkeypatch):
+    logs = tmp_path / "2024-01-02"
+    logs.mkdir()
+    (logs / "orders.log").write_text("{}\n")
+    heads = []
+
+    def truncated_head(bucket_name, key):
+        heads.append(key)
+        return {"ContentLength": 1, "Metadata": {}, "ETag": '"0"'}
+
+    monkeypatch.setattr(eod_upload, "s3_head", truncated_head)
+
+    with pytest.raises(RuntimeError, match="could not be verified"):
+        eod_upload.upload("bucket", str(logs), "archive/", "logs", str(tmp_path / "eod"))
+    assert len(heads) == eod_upload.UPLOAD_ATTEMPTS
+    assert len(os.listdir(tmp_path / "eod")) == 2  # Archive and checksum stay for the next try
+
+
+def test_multipart_etag_matches_the_s3_part_scheme(tmp_path):
+    path = tmp_path / "archive"
+    path.write_bytes(b"a" * 10 + b"b" * 10 + b"c" * 5)
+
+    parts = [hashlib.md5(b"a" * 10).digest(), hashlib.md5(b"b" * 10).digest(), hashlib.md5(b"c" * 5).digest()]
+    assert eod_upload.multipart_etag(str(path), chunk_size=10) == hashlib.md5(b"".join(parts)).hexdigest() + "-3"
+    assert eod_upload.multipart_etag(str(path), chunk_size=100) == hashlib.md5(path.read_bytes()).hexdigest()
+    assert eod_upload.part_size(25, chunk_size=1) == 1
+    assert eod_upload.part_size(eod_upload.MAX_PARTS * 3, chunk_size=1) == 4
+
+
+def test_kms_encrypted_objects_are_verified_without_the_etag():
+    head = {"ContentLength": 5, "Metadata": {"sha256": "abc"}, "ETag": '"not-an-md5"', "ServerSideEncryption": "aws:kms"}
+
+    assert eod_upload.verify(head, 5, "abc", "d41d8cd98f00b204e9800998ecf8427e") == []
+    assert eod_upload.verify(dict(head, ServerSideEncryption="AES256"), 5, "abc", "x") == ['ETag "not-an-md5" instead of x']
+
+
+@pytest.mark.skipif(not shutil.which("aws"), reason="AWS CLI not installed")
+def test_transfer_settings_stay_out_of_the_shared_cli_config(tmp_path, monkeypatch):
+    shared_config = tmp_path / "config"
+    shared_config.write_text("[default]\nregion = ap-south-1\n")
+    monkeypatch.setenv("AWS_CONFIG_FILE", str(shared_config))
+
+    env = eod_upload.configure_transfers(str(tmp_path))
+
+    assert shared_config.read_text() == "[default]\nregion = ap-south-1\n"
+    upload_config = open(env["AWS_CONFIG_FILE"]).read()
+    assert "region = ap-south-1" in upload_config and f"multipart_chunksize = {eod_upload.MULTIPART_CHUNK_MB}MB" in upload_config
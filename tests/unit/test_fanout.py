@@ -0,0 +1,83 @@
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+
+from tests.conftest import ROOT_DIR
+
+BACKTEST_MODULE = """
+def run_test(from_date, to_date, stop_loss, entry_time):
+    return {"trades": [from_date], "pnl": stop_loss, "entry_time": entry_time}
+"""
+
+
+@pytest.fixture
+def fanout(monkeypatch):
+    # Imported by name so the process pool can pickle its functions
+    monkeypatch.syspath_prepend(os.path.join(ROOT_DIR, "lambda_functions", "backtest"))
+    import fanout
+    monkeypatch.setattr(fanout, "current_code_dir", None)
+    return fanout
+
+
+def test_date_chunks_cover_the_range(fanout):
+    assert fanout.date_chunks("2024-01-01", "2024-03-15", 31) == [
+        ("2024-01-01", "2024-01-31"), ("2024-02-01", "2024-03-02"), ("2024-03-03", "2024-03-15")]
+    with pytest.raises(ValueError):
+        fanout.date_chunks("2024-02-01", "2024-01-01")
+
+
+def test_plan_crosses_the_grid_with_the_chunks(fanout):
+    chunks = fanout.plan({"from_date": "2024-01-01", "to_date": "2024-02-29", "chunk_days": 30,
+                          "grid": {"stop_loss": [0.5, 1.0]}, "params": {"entry_time": "09:17"}})
+    assert [chunk["index"] for chunk in chunks] == [0, 1, 2, 3]
+    assert chunks[3]["params"] == {"entry_time": "09:17", "stop_loss": 1.0,
+                                   "from_date": "2024-01-31", "to_date": "2024-02-29"}
+
+
+def test_local_run_reduces_every_grid_value(fanout, tmp_path):
+    (tmp_path / "gaps_backtest.py").write_text(BACKTEST_MODULE)
+    job = {"callable": "gaps_backtest:run_test", "from_date": "2024-01-01", "to_date": "2024-03-31",
+           "chunk_days": 31, "grid": {"stop_loss": [1, 2]}, "params": {"entry_time": "09:17"}}
+
+    report = fanout.run_local(job, str(tmp_path), workers=2)
+    assert report["chunks"] == 6
+    assert report["results"][1] == {
+        "params": {"stop_loss": 2},
+        "result": {"trades": ["2024-01-01", "2024-02-01", "2024-03-03"], "pnl": 6,
+                   "per_chunk": {"entry_time": ["09:17", "09:17", "09:17"]}},
+    }
+
+
+def release_zip(pnl):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("release_backtest/__init__.py", "")
+        zip_file.writestr("release_backtest/strategy.py", f"def run_test(**params):\n    return {{'pnl': {pnl}}}\n")
+    return archive.getvalue()
+
+
+def test_warm_worker_runs_the_release_of_each_job(fanout, load_lambda, tmp_path, monkeypatch):
+    monkeypatch.setenv("BUCKET_NAME", "bucket")
+    monkeypatch.setenv("CODE_KEY", "repo_analytics.zip")
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    backtest = load_lambda("backtest", "backtest")
+    monkeypatch.setattr(backtest, "CODE_ROOT", str(tmp_path / "analytics"))
+
+    results = []
+    with Stubber(backtest.s3_client) as stubber:
+        for etag, pnl in [("etag1", 1), ("etag2", 2)]:
+            body = release_zip(pnl)
+            stubber.add_response("get_object", {"Body": StreamingBody(io.BytesIO(body), len(body))},
+                                 {"Bucket": "bucket", "Key": "repo_analytics.zip", "IfMatch": f'"{etag}"'})
+            backtest.ensure_code(etag)
+            results.append(fanout.load_callable("release_backtest.strategy:run_test")()["pnl"])
+
+    assert results == [1, 2]
+    assert str(tmp_path / "analytics" / "etag1") not in sys.path
+    for name in ["release_backtest", "release_backtest.strategy"]:
+        sys.modules.pop(name, None)
@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+import fleet_shard
+
+FLEET = ["i-0123456789abcdef0", "i-0fedcba9876543210"]
+
+
+def test_balance_spreads_the_load():
+    symbols = {"RELIANCE": 5, "TCS": 4, "INFY": 3, "HDFCBANK": 3, "SBIN": 1}
+    shards, loads = fleet_shard.balance(symbols, 2)
+    assert sorted(symbol for shard in shards for symbol in shard) == sorted(symbols)
+    assert loads == [8, 8]
+
+
+def test_apply_writes_the_shard_of_this_instance(tmp_path, monkeypatch):
+    assignment = {"shard_count": 2, "shards": [["RELIANCE"], ["INFY", "TCS"]]}
+    monkeypatch.setattr(fleet_shard, "s3_exists", lambda bucket, key: True)
+    monkeypatch.setattr(fleet_shard, "s3_read_json", lambda bucket, key: assignment)
+    env_path = tmp_path / "etc" / "shard.env"
+
+    assert fleet_shard.apply("bucket", str(tmp_path), FLEET, instance_id=FLEET[1], env_path=str(env_path)) == 1
+    with open(tmp_path / "shard.json") as f:
+        assert json.load(f) == {"shard": 1, "shard_count": 2, "symbols": ["INFY", "TCS"]}
+    assert "SIMPLETRADER_SHARD=1\nSIMPLETRADER_SHARD_COUNT=2\n" in env_path.read_text()
+
+    # An assignment for another fleet size would trade symbols twice or not at all
+    with pytest.raises(RuntimeError):
+        fleet_shard.apply("bucket", str(tmp_path), FLEET + ["i-00000000000000001"], instance_id=FLEET[0],
+                          env_path=str(env_path))
@@ -0,0 +1,23 @@
+import os
+
+from host_common import percentile, switch_link
+
+
+def test_percentile_is_nearest_rank():
+    assert percentile([5, 1, 4, 2, 3], 50) == 3
+    assert percentile([5, 1, 4, 2, 3], 99) == 5
+    assert percentile([], 95) is None
+
+
+def test_switch_link_replaces_a_plain_directory_then_repoints(tmp_path):
+    link = tmp_path / "SimpleTrader"
+    (link / "src").mkdir(parents=True)
+    first, second = tmp_path / "releases" / "1", tmp_path / "releases" / "2"
+    first.mkdir(parents=True)
+    second.mkdir()
+
+    switch_link(str(link), str(first))
+    assert os.readlink(link) == str(first)
+    switch_link(str(link), str(second))
+    assert os.readlink(link) == str(second)
+    assert not os.path.lexists(str(link) + ".next")
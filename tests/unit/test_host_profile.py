@@ -0,0 +1,36 @@
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+PROFILE_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "host_scripts", "trading", "host_profile")
+TIMERS = ["simpletrader-premarket.timer", "simpletrader-trading.timer"]
+
+
+def read(name):
+    with open(os.path.join(PROFILE_DIR, name)) as f:
+        return f.read()
+
+
+def test_timers_load_on_amazon_linux_2():
+    # systemd 219 only knows date and time, a timezone suffix makes the timer fail to load
+    for timer in TIMERS:
+        specs = re.findall(r"^OnCalendar=(.*)$", read(timer), re.MULTILINE)
+        assert specs and all(re.fullmatch(r"\*-\*-\* \d\d:\d\d:\d\d", spec) for spec in specs), timer
+
+
+def test_cpu_affinity_is_left_to_host_profile():
+    for unit in ["simpletrader-premarket.service", "simpletrader-trading.service"]:
+        assert not re.search(r"^CPUAffinity=", read(unit), re.MULTILINE), unit
+
+
+@pytest.mark.skipif(not shutil.which("systemd-analyze"), reason="systemd-analyze not installed")
+def test_timers_verify(tmp_path):
+    for name in os.listdir(PROFILE_DIR):
+        if name.startswith("simpletrader-premarket.") or name.startswith("simpletrader-trading."):
+            shutil.copy(os.path.join(PROFILE_DIR, name), tmp_path)
+    result = subprocess.run(["systemd-analyze", "verify"] + [str(tmp_path / timer) for timer in TIMERS],
+                            capture_output=True, text=True)
+    assert "calendar" not in result.stderr and "Refusing" not in result.stderr, result.stderr
@@ -0,0 +1,84 @@
+import boto3
+from botocore.stub import Stubber
+
+import instance_steps
+
+INSTANCE_ID = "i-0123456789abcdef0"
+COMMAND_ID = "0f6e6a5c-1b2d-4c3e-9f8a-7b6c5d4e3f2a"
+
+
+def describe_response(state):
+    return {"Reservations": [{"Instances": [{"InstanceId": INSTANCE_ID, "State": {"Name": state}}]}]}
+
+
+def test_start_instance_only_starts_a_stopped_instance():
+    ec2_client = boto3.client("ec2")
+    with Stubber(ec2_client) as stubber:
+        stubber.add_response("describe_instances", describe_response("stopped"), {"InstanceIds": [INSTANCE_ID]})
+        stubber.add_response("start_instances", {}, {"InstanceIds": [INSTANCE_ID]})
+        stubber.add_response("describe_instances", describe_response("running"), {"InstanceIds": [INSTANCE_ID]})
+
+        assert instance_steps.start_instance(INSTANCE_ID, ec2_client) == {"instance_state": "stopped"}
+        # Already running, no second start_instances call is stubbed
+        assert instance_steps.start_instance(INSTANCE_ID, ec2_client) == {"instance_state": "running"}
+        stubber.assert_no_pending_responses()
+
+
+def test_fleet_is_started_with_one_call():
+    fleet = [INSTANCE_ID, "i-0fedcba9876543210", "i-00000000000000001"]
+    ec2_client = boto3.client("ec2")
+    with Stubber(ec2_client) as stubber:
+        stubber.add_response("describe_instances", {"Reservations": [{"Instances": [
+            {"InstanceId": fleet[0], "State": {"Name": "stopped"}},
+            {"InstanceId": fleet[1], "State": {"Name": "running"}},
+            {"InstanceId": fleet[2], "State": {"Name": "stopped"}},
+        ]}]}, {"InstanceIds": fleet})
+        stubber.add_response("start_instances", {}, {"InstanceIds": [fleet[0], fleet[2]]})
+
+        # The state machine keeps waiting until every instance is in the same state
+        assert instance_steps.start_instance(fleet, ec2_client) == {"instance_state": "mixed"}
+        stubber.assert_no_pending_responses()
+
+
+def test_hibernate_falls_back_to_a_plain_stop():
+    ec2_client = boto3.client("ec2")
+    with Stubber(ec2_client) as stubber:
+        stubber.add_client_error("stop_instances", "UnsupportedHibernationConfiguration",
+                                 expected_params={"InstanceIds": [INSTANCE_ID], "Hibernate": True})
+        stubber.add_response("stop_instances", {}, {"InstanceIds": [INSTANCE_ID]})
+
+        assert instance_steps.stop_instance(INSTANCE_ID, ec2_client, hibernate=True) \
+            == {"instance_state": "stopping", "hibernated": False}
+        stubber.assert_no_pending_responses()
+
+
+def test_start_flow_steps(load_lambda, monkeypatch):
+    """Walks the start state machine's happy path against stubbed EC2/SSM clients"""
+    monkeypatch.setenv("INSTANCE_IDS", INSTANCE_ID)
+    monkeypatch.setenv("BUCKET_NAME", "simpletrader-working-bucket")
+    monkeypatch.setenv("APP_NAME", "SimpleTrader")
+    start = load_lambda("start", "start")
+    monkeypatch.setattr(start, "is_holiday", lambda: False)
+
+    ec2_client = boto3.client("ec2")
+    ssm_client = boto3.client("ssm")
+    monkeypatch.setattr(boto3, "client", lambda service: {"ec2": ec2_client, "ssm": ssm_client}[service])
+
+    with Stubber(ec2_client) as ec2_stubber, Stubber(ssm_client) as ssm_stubber:
+        ec2_stubber.add_response("describe_instances", describe_response("stopped"))
+        ec2_stubber.add_response("start_instances", {})
+        ec2_stubber.add_response("describe_instances", describe_response("running"))
+        ssm_stubber.add_response("describe_instance_information",
+                                 {"InstanceInformationList": [{"InstanceId": INSTANCE_ID, "PingStatus": "Online"}]})
+        ssm_stubber.add_response("send_command", {"Command": {"CommandId": COMMAND_ID}})
+        ssm_stubber.add_response("get_command_invocation", {"Status": "Success"})
+
+        state = {}
+        for step in ["check_holiday", "start_instance", "describe_instance", "check_agent", "send_bootstrap",
+                     "poll_command"]:
+            state = start.handler({"step": step, "state": state}, None)
+
+    assert {key: state[key] for key in ["holiday", "instance_state", "agent_online", "command_id", "command_status"]} \
+        == {"holiday": False, "instance_state": "running", "agent_online": True,
+            "command_id": COMMAND_ID, "command_status": "Success"}
+    assert state["poll_attempt"] == 1
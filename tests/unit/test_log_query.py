@@ -0,0 +1,73 @@
+import io
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from simple_trader_cdk import log_query, log_schema
+
+EXECUTION_ID = "3b6e5f2a-1c4d-4e8f-9a0b-1c2d3e4f5a6b"
+
+
+def test_queries_only_scan_the_days_asked_for():
+    sql = log_query.build_query("latency", "2024-01-02", "2024-01-02", symbol="M&M")
+
+    assert "FROM trade_logs" in sql
+    assert "log_date = DATE '2024-01-02'" in sql
+    assert "event = 'order_ack'" in sql and "symbol = 'M&M'" in sql
+    assert "log_date BETWEEN DATE '2024-01-01' AND DATE '2024-01-05'" \
+        in log_query.build_query("rejects", "2024-01-01", "2024-01-05")
+
+
+def test_literals_that_could_break_out_of_the_sql_are_refused():
+    with pytest.raises(ValueError, match="symbol"):
+        log_query.build_query("latency", "2024-01-02", "2024-01-02", symbol="TCS' OR '1'='1")
+    with pytest.raises(ValueError):
+        log_query.build_query("order", "2024-01-02", "2024-01-02")
+    with pytest.raises(ValueError):
+        log_query.build_query("latency", "2024-01-02", "2024-01-01")
+
+
+def test_run_query_waits_for_athena_and_returns_only_the_rows(monkeypatch):
+    monkeypatch.setattr(log_query.time, "sleep", lambda seconds: None)
+    athena = boto3.client("athena")
+    with Stubber(athena) as stubber:
+        stubber.add_response("start_query_execution", {"QueryExecutionId": EXECUTION_ID}, {
+            "QueryString": "SELECT 1",
+            "QueryExecutionContext": {"Database": log_schema.DATABASE_NAME},
+            "WorkGroup": log_schema.WORKGROUP_NAME,
+        })
+        stubber.add_response("get_query_execution", {"QueryExecution": {"Status": {"State": "RUNNING"}}})
+        stubber.add_response("get_query_execution", {"QueryExecution": {
+            "Status": {"State": "SUCCEEDED"}, "Statistics": {"DataScannedInBytes": 2048}}})
+        stubber.add_response("get_query_results", {"ResultSet": {"Rows": [
+            {"Data": [{"VarCharValue": "symbol"}, {"VarCharValue": "p99_ms"}]},
+            {"Data": [{"VarCharValue": "TCS"}, {"VarCharValue": "81.5"}]},
+            {"Data": [{"VarCharValue": "INFY"}, {}]},
+        ]}})
+
+        columns, rows, statistics = log_query.run_query("SELECT 1", athena)
+
+    assert columns == ["symbol", "p99_ms"]
+    assert rows == [["TCS", "81.5"], ["INFY", None]]
+    assert statistics["DataScannedInBytes"] == 2048
+
+    out = io.StringIO()
+    log_query.print_rows(columns, rows, out=out)
+    assert out.getvalue() == "symbol  p99_ms\nTCS     81.5\nINFY\n"
+
+
+def test_log_lines_are_checked_against_the_contract(tmp_path):
+    path = tmp_path / "orders.log"
+    path.write_text(
+        '{"ts": "2024-01-02 09:15:01.123", "event": "order_ack", "symbol": "TCS", "qty": 25, "latency_ms": 38.2}\n'
+        '{"ts": "09:15", "event": "order_ack", "qty": "25"}\n'
+        'Traceback (most recent call last):\n'
+    )
+
+    out = io.StringIO()
+    assert log_query.lint(str(path), out) == 2
+    assert out.getvalue().splitlines() == [
+        f"{path}:2: ts '09:15' is not %Y-%m-%d %H:%M:%S.%f, qty '25' is not of type int",
+        f"{path}:3: not JSON",
+    ]
@@ -0,0 +1,125 @@
+import gzip
+import os
+import shutil
+import time
+from datetime import datetime
+
+import pytest
+
+import log_shipper
+
+# Noon today, the files written by the tests are from today as far as the shipper is concerned
+NOON = log_shipper.start_of_day(time.time()) + 12 * 3600
+TODAY = datetime.fromtimestamp(NOON).date().isoformat()
+LOG_KEY = f"SimpleTraderLogs/{TODAY}/orders.log"
+
+
+@pytest.fixture
+def bucket(fake_bucket):
+    return fake_bucket.patch(log_shipper, "s3_put")
+
+
+@pytest.fixture
+def app_dir(tmp_path):
+    app_dir = tmp_path / "SimpleTrader"
+    (app_dir / "trade_logs" / TODAY).mkdir(parents=True)
+    (app_dir / "ledger").mkdir()
+    return app_dir
+
+
+def append(path, text):
+    with open(path, "a") as f:
+        f.write(text)
+
+
+def shipped(bucket):
+    """{key: lines} of every uploaded chunk"""
+    return {str(path.relative_to(bucket)): gzip.decompress(path.read_bytes()).decode()
+            for path in sorted(bucket.rglob("*.gz"))}
+
+
+def shipper(app_dir, tmp_path, **kwargs):
+    return log_shipper.LogShipper("bucket", str(app_dir), "SimpleTrader", str(tmp_path / "shipper"), **kwargs)
+
+
+def test_complete_lines_are_rolled_per_window_and_the_rest_on_the_final_flush(tmp_path, bucket, app_dir):
+    orders = app_dir / "trade_logs" / TODAY / "orders.log"
+    append(orders, '{"event": "order", "symbol": "TCS"}\n{"event": "fill", "sym')
+    ledger = app_dir / "ledger" / "2023-12-29.csv"
+    append(ledger, "symbol,entry_time\n")
+    os.utime(ledger, (NOON - 5 * 86400, NOON - 5 * 86400))  # Shipped on its own day
+    agent = shipper(app_dir, tmp_path)
+
+    agent.poll(NOON)
+    assert agent.drain(time.time() + 5) and shipped(bucket) == {}  # The window is still open
+
+    append(orders, 'bol": "TCS"}\n')
+    agent.poll(NOON + log_shipper.ROLL_SECONDS)
+    append(orders, '{"event": "exit"')
+    agent.poll(NOON + log_shipper.ROLL_SECONDS + 1, final=True)
+    assert agent.drain(time.time() + 5)
+
+    assert shipped(bucket) == {
+        f"{LOG_KEY}.0.000000000000.gz": '{"event": "order", "symbol": "TCS"}\n{"event": "fill", "symbol": "TCS"}\n',
+        f"{LOG_KEY}.0.000000000071.gz": '{"event": "exit"\n',
+    }
+    assert log_shipper.check(str(app_dir), "SimpleTrader", str(tmp_path / "shipper"), now=NOON) \
+        == {"spooled": [], "unshipped": {}}
+
+
+def test_full_spool_pauses_reading_until_it_drains(tmp_path, bucket, app_dir):
+    orders = app_dir / "trade_logs" / TODAY / "orders.log"
+    append(orders, "first\n")
+    agent = shipper(app_dir, tmp_path, max_spool_bytes=1)
+    agent.poll(NOON)
+    agent.poll(NOON + log_shipper.ROLL_SECONDS)  # Sealed, the spool is now over its limit
+
+    append(orders, "second\n")
+    agent.poll(NOON + log_shipper.ROLL_SECONDS + 1)
+    assert agent.buffers == {}
+    assert log_shipper.check(str(app_dir), "SimpleTrader", str(tmp_path / "shipper"), now=NOON)["unshipped"] \
+        == {str(orders): len("second\n")}
+
+    agent.drain(time.time() + 5)
+    agent.poll(NOON + log_shipper.ROLL_SECONDS + 2)
+    assert bytes(agent.buffers[str(orders)]["data"]) == b"second\n"
+
+
+def test_chunk_sealed_again_after_a_crash_replaces_the_first_one(tmp_path, bucket, app_dir):
+    orders = app_dir / "trade_logs" / TODAY / "orders.log"
+    append(orders, "first\n")
+    agent = shipper(app_dir, tmp_path)
+    agent.poll(NOON)
+    agent.save_state()
+    state_before_seal = (tmp_path / "shipper" / "state.json").read_text()
+    agent.poll(NOON + log_shipper.ROLL_SECONDS)
+    # Crash after the chunk was spooled but before the state recorded it, nothing uploaded yet
+    (tmp_path / "shipper" / "state.json").write_text(state_before_seal)
+
+    append(orders, "second\n")
+    restarted = shipper(app_dir, tmp_path)
+    restarted.poll(NOON + log_shipper.ROLL_SECONDS + 1, final=True)
+    assert restarted.drain(time.time() + 5)
+
+    assert shipped(bucket) == {f"{LOG_KEY}.0.000000000000.gz": "first\nsecond\n"}
+
+
+@pytest.mark.skipif(not os.environ.get("LOG_SHIPPER_S3_ENDPOINT") or not shutil.which("aws"),
+                    reason="Set LOG_SHIPPER_S3_ENDPOINT to a local S3 stand-in, e.g. MinIO or moto_server")
+def test_ships_to_a_local_s3_endpoint(tmp_path, app_dir, monkeypatch):
+    import boto3
+
+    endpoint = os.environ["LOG_SHIPPER_S3_ENDPOINT"]
+    monkeypatch.setenv("S3_ENDPOINT_URL", endpoint)
+    s3 = boto3.client("s3", endpoint_url=endpoint)
+    bucket_name = f"log-shipper-test-{int(time.time())}"
+    s3.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={"LocationConstraint": "ap-south-1"})
+    append(app_dir / "trade_logs" / TODAY / "orders.log", '{"event": "order"}\n')
+
+    agent = log_shipper.LogShipper(bucket_name, str(app_dir), "SimpleTrader", str(tmp_path / "shipper"))
+    agent.start_workers(2)
+    agent.poll(NOON, final=True)
+
+    assert agent.drain(time.time() + 30)
+    body = s3.get_object(Bucket=bucket_name, Key=f"{LOG_KEY}.0.000000000000.gz")["Body"].read()
+    assert gzip.decompress(body) == b'{"event": "order"}\n'
@@ -0,0 +1,18 @@
+from datetime import date
+
+import market_calendar
+
+
+def test_holiday_lookup():
+    assert market_calendar.is_holiday(date(2024, 12, 25))
+    assert not market_calendar.is_holiday(date(2024, 12, 24))
+
+
+def test_weekends_are_not_trading_days():
+    assert not market_calendar.is_trading_day(date(2025, 1, 4))  # Saturday
+    assert market_calendar.is_trading_day(date(2025, 1, 6))  # Monday
+
+
+def test_next_trading_day_skips_holidays_and_weekends():
+    # Thu 2025-04-17 -> Fri 2025-04-18 is Good Friday -> next session is Mon 2025-04-21
+    assert market_calendar.next_trading_day(date(2025, 4, 17)) == date(2025, 4, 21)
@@ -0,0 +1,24 @@
+import json
+
+import phase_metrics
+
+
+def test_emit_phase_is_valid_emf(capsys):
+    phase_metrics.emit_phase("instance.bootstrap", 12.34567, app="SimpleTrader")
+    record = json.loads(capsys.readouterr().out)
+
+    directive = record["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == phase_metrics.NAMESPACE
+    assert directive["Dimensions"] == [["App", "Phase"]]
+    assert directive["Metrics"] == [{"Name": "PhaseDuration", "Unit": "Seconds"}]
+    # Every dimension and metric named in the directive has to be a top level member
+    assert record["App"] == "SimpleTrader" and record["Phase"] == "instance.bootstrap"
+    assert record["PhaseDuration"] == 12.346
+
+
+def test_emit_phases_prefixes_every_step(capsys, monkeypatch):
+    monkeypatch.setenv("APP_NAME", "Analytics")
+    phase_metrics.emit_phases({"download": 1.5, "install": 2.75}, "instance")
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(r["App"], r["Phase"], r["PhaseDuration"]) for r in records] == \
+        [("Analytics", "instance.download", 1.5), ("Analytics", "instance.install", 2.75)]
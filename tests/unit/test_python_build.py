@@ -0,0 +1,48 @@
+import python_gate
+import strategy_bench
+
+
+def suite(medians):
+    """A pyperf suite with one calibration run and two timed runs per benchmark"""
+    return {"benchmarks": [{"metadata": {"name": name},
+                            "runs": [{"warmups": [[1, 1.0]]},
+                                     {"values": [seconds, seconds * 1.01]},
+                                     {"values": [seconds * 0.99, seconds]}]}
+                           for name, seconds in medians.items()]}
+
+
+def strategy(ns_per_tick, checksum=1.5):
+    return {"ns_per_tick": ns_per_tick, "checksum": checksum}
+
+
+def test_faster_tuned_build_passes():
+    report = python_gate.evaluate(suite({"float": 0.10, "nbody": 0.20}), suite({"float": 0.09, "nbody": 0.19}),
+                                  strategy(1000), strategy(900))
+
+    assert report["passed"]
+    assert report["benchmarks"]["float"]["speedup"] == round(0.10 / 0.09, 4)
+    assert report["strategy"]["speedup"] == round(1000 / 900, 4)
+
+
+def test_single_regression_fails_the_gate_despite_the_mean():
+    report = python_gate.evaluate(suite({"float": 0.10, "nbody": 0.20, "go": 0.30}),
+                                  suite({"float": 0.05, "nbody": 0.10, "go": 0.33}),
+                                  strategy(1000), strategy(900))
+
+    assert report["geomean_speedup"] > python_gate.MIN_GEOMEAN_SPEEDUP
+    assert not report["passed"]
+    assert report["failures"] == ["go speedup 0.9091 is a regression beyond 5%"]
+
+
+def test_slower_strategy_or_different_results_fail_the_gate():
+    stock, tuned = suite({"float": 0.10}), suite({"float": 0.08})
+
+    assert not python_gate.evaluate(stock, tuned, strategy(1000), strategy(1100))["passed"]
+    assert not python_gate.evaluate(stock, tuned, strategy(1000), strategy(900, checksum=2.0))["passed"]
+
+
+def test_strategy_bench_is_deterministic():
+    result = strategy_bench.bench(ticks=2000, repeat=2)
+
+    assert result["checksum"] == strategy_bench.bench(ticks=2000, repeat=1)["checksum"]
+    assert result["ns_per_tick"] > 0
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import python_env
+
+
+def write_requirements(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def test_requirements_hash_ignores_comments_and_order(tmp_path):
+    first = write_requirements(tmp_path / "a.txt", "requests==2.31.0\n# broker sdk\nkiteconnect==5.0.1\n")
+    second = write_requirements(tmp_path / "b.txt", "kiteconnect==5.0.1\n\nrequests==2.31.0  # http\n")
+    changed = write_requirements(tmp_path / "c.txt", "kiteconnect==5.0.1\nrequests==2.32.0\n")
+
+    assert python_env.requirements_hash(first, sys.executable) == python_env.requirements_hash(second, sys.executable)
+    assert python_env.requirements_hash(first, sys.executable) != python_env.requirements_hash(changed, sys.executable)
+
+
+def test_unchanged_requirements_reuse_the_virtualenv(tmp_path, monkeypatch):
+    requirements = write_requirements(tmp_path / "requirements.txt", "requests==2.31.0\n")
+    venvs_dir = tmp_path / "venvs"
+    venv_dir = venvs_dir / python_env.requirements_hash(requirements, sys.executable)
+    venv_dir.mkdir(parents=True)
+    (venv_dir / python_env.COMPLETE_MARKER).touch()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("pip should not run for an unchanged requirements.txt")
+
+    monkeypatch.setattr(python_env, "fetch_wheelhouse", fail)
+    monkeypatch.setattr(python_env, "create_venv", fail)
+
+    python_env.ensure("bucket", requirements, str(venvs_dir), sys.executable)
+    assert os.path.realpath(venvs_dir / "current") == str(venv_dir)
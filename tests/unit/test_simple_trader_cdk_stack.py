@@ -1,15 +1,118 @@
+import json
+
 import aws_cdk as core
 import aws_cdk.assertions as assertions
+import pytest
+
+from simple_trader_cdk import ledger_schema, log_schema
+from simple_trader_cdk.golden_ami_stack import GOLDEN_AMI_PARAMETER, GoldenAmiStack
+from simple_trader_cdk.simple_trader_cdk_stack import SimpleTraderCdkStack, hibernation_root_volume_gb
 
-from simple_trader_cdk.simple_trader_cdk_stack import SimpleTraderCdkStack
+# Vpc.from_lookup resolves from cdk.context.json for this account/region, no AWS access needed
+ENV = core.Environment(account="694237726617", region="ap-south-1")
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in simple_trader_cdk/simple_trader_cdk_stack.py
-def test_sqs_queue_created():
+
+def synth_template():
     app = core.App()
-    stack = SimpleTraderCdkStack(app, "simple-trader-cdk")
-    template = assertions.Template.from_stack(stack)
+    stack = SimpleTraderCdkStack(app, "simple-trader-cdk", env=ENV)
+    return assertions.Template.from_stack(stack)
+
+
+def glue_tables(template):
+    tables = template.find_resources("AWS::Glue::Table").values()
+    return {table["Properties"]["TableInput"]["Name"]: table["Properties"]["TableInput"] for table in tables}
+
+
+def test_ledger_table_is_declared_from_the_shared_schema():
+    template = synth_template()
+
+    template.has_resource_properties("AWS::Glue::Database", {
+        "DatabaseInput": {"Name": ledger_schema.DATABASE_NAME}
+    })
+    table_input = glue_tables(template)[ledger_schema.TABLE_NAME]
+    assert [column["Name"] for column in table_input["StorageDescriptor"]["Columns"]] \
+        == [column.name for column in ledger_schema.LEDGER_COLUMNS]
+    assert table_input["Parameters"]["projection.enabled"] == "true"
+
+    # The Parquet writer gets the very same columns
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "ledger_parquet.handler",
+        "Environment": {"Variables": assertions.Match.object_like({
+            "LEDGER_COLUMNS": ledger_schema.columns_json()
+        })}
+    })
+
+
+def test_logs_table_projects_a_partition_per_day_of_json_lines():
+    template = synth_template()
+
+    table_input = glue_tables(template)[log_schema.TABLE_NAME]
+    assert [column["Name"] for column in table_input["StorageDescriptor"]["Columns"]] \
+        == [column.name for column in log_schema.LOG_COLUMNS]
+    assert table_input["StorageDescriptor"]["SerdeInfo"]["SerializationLibrary"] == "org.openx.data.jsonserde.JsonSerDe"
+    assert table_input["PartitionKeys"] == [{"Name": "log_date", "Type": "date"}]
+    assert table_input["Parameters"]["projection.log_date.type"] == "date"
+    assert table_input["Parameters"]["storage.location.template"] \
+        == "s3://simpletrader-working-bucket/SimpleTraderLogs/${log_date}/"
+
+    template.has_resource_properties("AWS::Athena::WorkGroup", {
+        "Name": log_schema.WORKGROUP_NAME,
+        "WorkGroupConfiguration": assertions.Match.object_like({
+            "BytesScannedCutoffPerQuery": log_schema.BYTES_SCANNED_CUTOFF,
+            "EnforceWorkGroupConfiguration": True,
+        }),
+    })
+
+
+def test_golden_ami_parameter_is_only_seeded_and_recipe_survives_new_base_images():
+    app = core.App()
+    template = assertions.Template.from_stack(GoldenAmiStack(app, "golden-ami", env=ENV))
+
+    # A parameter owned by the stack would be reset to the stock image on every deploy
+    template.resource_count_is("AWS::SSM::Parameter", 0)
+    seed = next(iter(template.find_resources("Custom::AWS").values()))["Properties"]
+    assert GOLDEN_AMI_PARAMETER in str(seed["Create"]) and "Update" not in seed and "Delete" not in seed
+
+    template.has_resource_properties("AWS::ImageBuilder::ImageRecipe", {
+        "ParentImage": "arn:aws:imagebuilder:ap-south-1:aws:image/amazon-linux-2-arm64/x.x.x",
+    })
+
+
+def test_failed_start_and_stop_flows_alarm():
+    template = synth_template()
+    alarms = [alarm["Properties"] for alarm in template.find_resources("AWS::CloudWatch::Alarm").values()]
+    failed_alarms = [alarm for alarm in alarms if "Metrics" in alarm
+                     and {"ExecutionsFailed", "ExecutionsTimedOut"} <= {query["MetricStat"]["Metric"]["MetricName"]
+                                                                       for query in alarm["Metrics"] if "MetricStat" in query}]
+    assert len(failed_alarms) == 2
+    assert all(alarm["AlarmActions"] for alarm in failed_alarms)
+
+
+def state_machine_definitions(template):
+    """{logical id: parsed definition} of every state machine, the Lambda ARNs left as placeholders"""
+    definitions = {}
+    for logical_id, state_machine in template.find_resources("AWS::StepFunctions::StateMachine").items():
+        parts = state_machine["Properties"]["DefinitionString"]["Fn::Join"][1]
+        definitions[logical_id] = json.loads("".join(part if isinstance(part, str) else "ARN" for part in parts))
+    return definitions
+
+
+def test_stop_flow_stops_the_instance_when_a_step_errors():
+    template = synth_template()
+    states = next(definition["States"] for logical_id, definition in state_machine_definitions(template).items()
+                  if logical_id.startswith("StopWorkflow"))
+
+    def catches(state):
+        return [catch["Next"] for catch in states[state].get("Catch", [])]
+
+    assert catches("SendContextSnapshot") == catches("CheckContextSnapshot") == ["SendUploadLogs"]
+    assert catches("SendUploadLogs") == catches("CheckUploadLogs") == ["StopInstance"]
+
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+def test_hibernation_volume_fits_the_ram_of_each_fleet_type():
+    assert hibernation_root_volume_gb("c6g.2xlarge") == 40
+    assert hibernation_root_volume_gb("c6g.4xlarge") == 56
+    assert hibernation_root_volume_gb("r7g.4xlarge") == 152
+    for instance_type in ["t4g.large", "c6g.metal", "r6g.16xlarge"]:
+        with pytest.raises(ValueError):
+            hibernation_root_volume_gb(instance_type)
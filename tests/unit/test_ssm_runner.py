@@ -0,0 +1,121 @@
+import subprocess
+import time
+
+import boto3
+from botocore.stub import ANY, Stubber
+
+import ssm_runner
+
+INSTANCE_ID = "i-0123456789abcdef0"
+COMMAND_ID = "0f6e6a5c-1b2d-4c3e-9f8a-7b6c5d4e3f2a"
+
+
+def test_step_timings_round_trip():
+    commands = ssm_runner.step_script([("download", ["aws s3 cp a b"]), ("install", ["pip install x"])])
+    assert commands[:len(ssm_runner.SCRIPT_HEADER)] == ssm_runner.SCRIPT_HEADER
+    assert 'echo "::step-start::download::' in commands[len(ssm_runner.SCRIPT_HEADER)]
+    assert commands[-1].startswith('echo "::step-end::install::')
+
+    output = "::step-start::download::100.0\ncopied\n::step-end::download::101.5\n" \
+             "::step-start::install::101.5\n::step-end::install::104.25\n"
+    assert ssm_runner.parse_step_timings(output) == {"download": 1.5, "install": 2.75}
+
+
+def run_script(steps):
+    return subprocess.run(["bash", "-c", "\n".join(ssm_runner.step_script(steps))], capture_output=True, text=True)
+
+
+def test_failing_step_fails_the_script():
+    allowed = ("allowed", ["[ -f /nonexistent ] && echo never", "false || echo \"allowed to fail\""])
+    assert run_script([allowed]).returncode == 0
+
+    for failing in [["(exit 3)"], ["false | cat"], ["true && (exit 3)"]]:
+        result = run_script([allowed, ("broken", failing), ("after", ["echo after"])])
+        assert result.returncode != 0, failing
+        assert "::step-end::broken::" not in result.stdout and "after" not in result.stdout
+        assert "Step broken failed" in result.stderr
+    assert run_script([("broken", ["true && (exit 3)"])]).returncode == 3
+
+
+def test_backoff_grows_and_stays_within_bounds():
+    for attempt in range(10):
+        ceiling = min(ssm_runner.MAX_WAIT_SECONDS, ssm_runner.FIRST_WAIT_SECONDS * 2 ** attempt)
+        assert 1 <= ssm_runner.next_wait_seconds(attempt) <= ceiling
+    # Never waits past the deadline
+    assert ssm_runner.next_wait_seconds(10, deadline=time.time() + 3) <= 3
+
+
+def test_poll_treats_missing_invocation_as_pending():
+    ssm_client = boto3.client("ssm")
+    with Stubber(ssm_client) as stubber:
+        stubber.add_client_error("get_command_invocation", "InvocationDoesNotExist")
+        stubber.add_response("get_command_invocation",
+                             {"Status": "Success", "StandardOutputContent": "::step-start::a::1\n::step-end::a::3\n"})
+
+        command = {"command_id": COMMAND_ID, "command_sent_at": time.time()}
+        pending = ssm_runner.poll(INSTANCE_ID, command, ssm_client)
+        assert pending["command_status"] == "Pending" and pending["wait_seconds"] >= 1
+        command.update(pending)
+
+        finished = ssm_runner.poll(INSTANCE_ID, command, ssm_client)
+        assert finished["command_status"] == "Success"
+        assert finished["poll_attempt"] == 2
+        assert finished["command_timings"] == {"a": 2.0}
+
+
+def test_poll_cancels_command_past_its_deadline():
+    ssm_client = boto3.client("ssm")
+    with Stubber(ssm_client) as stubber:
+        stubber.add_response("get_command_invocation", {"Status": "InProgress"})
+        stubber.add_response("cancel_command", {}, {"CommandId": COMMAND_ID, "InstanceIds": [INSTANCE_ID]})
+
+        command = {"command_id": COMMAND_ID, "command_deadline": time.time() - 1, "poll_attempt": 4}
+        assert ssm_runner.poll(INSTANCE_ID, command, ssm_client) == {"command_status": "TimedOut", "poll_attempt": 5}
+        stubber.assert_no_pending_responses()
+
+
+def test_send_routes_output_to_s3_and_logs():
+    ssm_client = boto3.client("ssm")
+    with Stubber(ssm_client) as stubber:
+        stubber.add_response("send_command", {"Command": {"CommandId": COMMAND_ID}}, {
+            "InstanceIds": [INSTANCE_ID],
+            "DocumentName": "AWS-RunShellScript",
+            "Parameters": {"commands": ANY, "executionTimeout": ["60"]},
+            "OutputS3BucketName": "bucket",
+            "OutputS3KeyPrefix": "ssm-output/SimpleTrader",
+            "CloudWatchOutputConfig": {"CloudWatchOutputEnabled": True, "CloudWatchLogGroupName": "/simpletrader/ssm-commands"},
+        })
+        command = ssm_runner.send(INSTANCE_ID, [("verify", ["true"])], output_bucket="bucket",
+                                  output_prefix="ssm-output/SimpleTrader", log_group="/simpletrader/ssm-commands",
+                                  deadline_seconds=60, ssm_client=ssm_client)
+
+    assert command["command_id"] == COMMAND_ID
+    assert command["command_deadline"] - command["command_sent_at"] <= 61
+
+
+def test_fleet_command_waits_for_every_instance():
+    fleet = [INSTANCE_ID, "i-0fedcba9876543210"]
+    ssm_client = boto3.client("ssm")
+
+    def invocations(*statuses):
+        return {"CommandInvocations": [{"InstanceId": instance_id, "Status": status}
+                                       for instance_id, status in zip(fleet, statuses)]}
+
+    with Stubber(ssm_client) as stubber:
+        stubber.add_response("send_command", {"Command": {"CommandId": COMMAND_ID}},
+                             {"InstanceIds": fleet, "DocumentName": "AWS-RunShellScript", "Parameters": ANY})
+        stubber.add_response("list_command_invocations", invocations("Success", "InProgress"), {"CommandId": COMMAND_ID})
+        stubber.add_response("list_command_invocations", invocations("Success", "Failed"), {"CommandId": COMMAND_ID})
+        for instance_id in fleet:
+            stubber.add_response("get_command_invocation", {"Status": "Success", "StandardOutputContent": ""},
+                                 {"CommandId": COMMAND_ID, "InstanceId": instance_id})
+
+        # One send_command for the whole fleet, polled with the fleet of the command
+        command = ssm_runner.send(fleet, [("a", ["true"])], ssm_client=ssm_client)
+        command.update(ssm_runner.poll(None, command, ssm_client))
+        assert command["command_status"] == "InProgress"
+
+        command.update(ssm_runner.poll(None, command, ssm_client))
+        assert command["command_status"] == "Failed"
+        assert command["failed_instances"] == ["i-0fedcba9876543210"]
+        stubber.assert_no_pending_responses()
@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import warmup
+
+MANIFEST_PATH = os.path.join(os.path.dirname(warmup.__file__), "warmup_manifest.json")
+
+
+def test_recent_months_are_whole_months_before_today():
+    assert warmup.recent_months(2, today=date(2025, 3, 14)) == [
+        ("2025-02-01", "2025-02-28"),
+        ("2025-01-01", "2025-01-31"),
+    ]
+
+
+def test_expand_crosses_months_combos_and_grid():
+    endpoint = {
+        "path": "/backtest",
+        "recent_months": 2,
+        "combos": [{"stop_loss": 5, "take_profit": 3}, {"stop_loss": 3, "take_profit": 5}],
+        "grid": {"trade_direction": ["ALL", "LONG", "SHORT"]},
+        "params": {"entry_time": "09:17"},
+    }
+    calls = warmup.expand(endpoint, today=date(2025, 1, 10))
+
+    assert len(calls) == 2 * 2 * 3
+    assert calls[0] == {"entry_time": "09:17", "from_date": "2024-12-01", "to_date": "2024-12-31",
+                        "stop_loss": 5, "take_profit": 3, "trade_direction": "ALL"}
+
+
+def test_default_manifest_is_valid():
+    with open(MANIFEST_PATH) as f:
+        manifest = json.load(f)
+    for endpoint in manifest["endpoints"]:
+        assert endpoint["path"].startswith("/") and warmup.expand(endpoint)
+
+
+def test_calls_ask_nginx_to_skip_its_cache():
+    headers = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            headers.append(self.headers.get(warmup.CACHE_BYPASS_HEADER))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.handle_request, daemon=True).start()
+    try:
+        status, _ = warmup.call(f"http://127.0.0.1:{server.server_port}", "/backtest/", {"stop_loss": 5}, timeout=5)
+    finally:
+        server.server_close()
+    assert status == 200 and headers == ["1"]
+
+
+def test_percentiles_and_regressions():
+    summary = warmup.summarize([10, 20, 30, 40, 500], [200, 200, 200, 200, 500])
+    assert summary == {"calls": 5, "errors": 1, "p50_ms": 20, "p95_ms": 40, "p99_ms": 40, "max_ms": 40}
+
+    report = {"endpoints": {"gaps": {"p95_ms": 150}, "other": {"p95_ms": 100}}}
+    previous = {"release": "abc", "endpoints": {"gaps": {"p95_ms": 100}, "other": {"p95_ms": 95}}}
+    assert warmup.regressions(report, previous, 0.25) == [
+        {"endpoint": "gaps", "p95_ms": 150, "previous_p95_ms": 100, "previous_release": "abc"}
+    ]
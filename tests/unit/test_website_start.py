@@ -0,0 +1,41 @@
+from botocore.stub import Stubber
+
+INSTANCE_ID = "i-0123456789abcdef0"
+PUBLIC_IP = "13.200.1.2"
+TAG_FILTER = {"Filters": [{"Name": "tag:Project", "Values": ["SimpleTraderAnalytics"]}]}
+
+
+def test_associated_eip_is_reused_without_api_writes(load_lambda):
+    website_start = load_lambda("analytics_start", "website_start")
+    with Stubber(website_start.ec2_client) as stubber:
+        stubber.add_response("describe_addresses", {"Addresses": [{
+            "AllocationId": "eipalloc-1", "PublicIp": PUBLIC_IP, "InstanceId": INSTANCE_ID,
+        }]}, TAG_FILTER)
+
+        # No associate_address/allocate_address stubbed, any write would fail the test
+        assert website_start.associate_eip(INSTANCE_ID) == PUBLIC_IP
+        stubber.assert_no_pending_responses()
+
+
+def test_dns_is_only_changed_when_the_ip_changed(load_lambda):
+    website_start = load_lambda("analytics_start", "website_start")
+    zone = {"HostedZones": [{"Id": "/hostedzone/Z1", "Name": "simple-trader-analytics.click.",
+                             "CallerReference": "ref"}],
+            "IsTruncated": False, "MaxItems": "1"}
+
+    def record(ip):
+        return {"ResourceRecordSets": [{"Name": "simple-trader-analytics.click.", "Type": "A", "TTL": 300,
+                                        "ResourceRecords": [{"Value": ip}]}],
+                "IsTruncated": False, "MaxItems": "1"}
+
+    with Stubber(website_start.route53_client) as stubber:
+        stubber.add_response("list_hosted_zones_by_name", zone)
+        stubber.add_response("list_resource_record_sets", record(PUBLIC_IP))
+        assert website_start.update_route53(PUBLIC_IP) == {"dns_changed": False}
+
+        stubber.add_response("list_hosted_zones_by_name", zone)
+        stubber.add_response("list_resource_record_sets", record("13.200.9.9"))
+        stubber.add_response("change_resource_record_sets",
+                             {"ChangeInfo": {"Id": "C1", "Status": "PENDING", "SubmittedAt": "2025-01-01T00:00:00Z"}})
+        assert website_start.update_route53(PUBLIC_IP) == {"dns_changed": True}
+        stubber.assert_no_pending_responses()